@@ -0,0 +1,512 @@
+"""
+合成流程的基准测试
+
+在本地生成固定随机种子的合成海报（1080p、4K、印刷尺寸）和二维码集合（100 到 10000 个，
+PNG/JPEG、RGBA/RGB），测量：
+
+- 端到端吞吐量（张/秒）和每个阶段的耗时（来自运行报告）
+- 峰值内存（每个用例在单独的子进程中运行）
+- 预览画布每个拖动/平移/缩放事件的重绘耗时
+- 打包输出文件夹的耗时
+
+结果写成 JSON，可以用 --compare 与之前的结果对比：
+
+    python bench_poster.py --suite quick --output before.json
+    python bench_poster.py --suite quick --output after.json --compare before.json
+
+生成的测试数据缓存在工作目录中（默认在系统临时目录下），重复运行时直接复用。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+from PIL import Image, ImageChops
+
+import poster_engine
+import poster_archive
+from poster_metrics import RunReport
+from poster_preview import ImagePyramid, PreviewLayer
+
+
+SEED = 20240501
+# 海报尺寸（宽, 高）：竖版 1080p、竖版 4K、A3 300dpi
+POSTER_SIZES = {"1080p": (1080, 1920), "4k": (2160, 3840), "print": (3508, 4961)}
+QR_MODULES = 29  # 版本 3 的模块数
+QR_MODULE_PIXELS = 10
+QR_BORDER = 4
+QR_DATA_VERSION = 2  # 二维码的生成方式变化时加一，不再复用旧的缓存
+PREVIEW_CANVAS = (1000, 800)
+PREVIEW_EVENTS = 60  # 每种交互模拟的事件数
+
+# 每个用例：海报、二维码数量/格式/模式、输出格式、并行方式；pack 表示之后再并行打包一次
+SUITES = {
+    "quick": {
+        "batch": [
+            ("1080p", 100, "png", "RGBA", "png", "thread"),
+            ("1080p", 100, "png", "RGBA", "jpeg", "thread"),
+            ("1080p", 100, "png", "RGB", "png", "thread"),
+        ],
+        "preview": ["1080p"],
+        "pack": [("1080p", 100, "png", "RGBA", "png", "thread")],
+    },
+    "standard": {
+        "batch": [
+            ("1080p", 1000, "png", "RGBA", "png", "thread"),
+            ("1080p", 1000, "png", "RGB", "png", "thread"),
+            ("1080p", 1000, "jpeg", "RGB", "jpeg", "thread"),
+            ("1080p", 1000, "png", "RGBA", "png", "process"),
+            ("4k", 100, "png", "RGBA", "png", "thread"),
+            ("4k", 100, "jpeg", "RGB", "jpeg", "process"),
+        ],
+        "preview": ["1080p", "4k"],
+        "pack": [("1080p", 1000, "png", "RGBA", "png", "thread")],
+    },
+    "full": {
+        "batch": [
+            ("1080p", 10000, "png", "RGBA", "png", "thread"),
+            ("1080p", 10000, "png", "RGB", "png", "thread"),
+            ("1080p", 10000, "jpeg", "RGB", "jpeg", "process"),
+            ("4k", 1000, "png", "RGBA", "png", "thread"),
+            ("4k", 1000, "jpeg", "RGB", "jpeg", "process"),
+            ("print", 100, "png", "RGBA", "png", "thread"),
+            ("print", 100, "png", "RGBA", "tiff", "thread"),
+            ("print", 100, "jpeg", "RGB", "jpeg", "process"),
+        ],
+        "preview": ["1080p", "4k", "print"],
+        "pack": [("1080p", 10000, "png", "RGBA", "png", "thread")],
+    },
+}
+
+
+# ========== 测试数据 ==========
+def make_poster(size, seed=SEED):
+    """固定种子的海报：两个方向的渐变，叠加放大后的随机色块（接近真实海报的压缩难度）"""
+    width, height = size
+    rng = random.Random(seed)
+    horizontal = Image.linear_gradient("L").rotate(90).resize(size)
+    vertical = Image.linear_gradient("L").resize(size)
+    tile_size = (max(1, width // 24), max(1, height // 24))
+    blocks = Image.frombytes("RGB", tile_size, rng.randbytes(tile_size[0] * tile_size[1] * 3))
+    blocks = blocks.resize(size, Image.Resampling.NEAREST)
+    base = Image.merge("RGB", (horizontal, vertical, ImageChops.invert(horizontal)))
+    poster = Image.blend(base, blocks, 0.35).convert("RGBA")
+    return poster
+
+
+def make_qr(seed, mode="RGBA"):
+    """
+    固定种子的两色模块网格，三个角上有定位图形（与真实二维码一样，会走最近邻放大的快速路径）
+    """
+    rng = random.Random(seed)
+    modules = QR_MODULES + QR_BORDER * 2
+    pixels = bytearray(b"\xff" * modules * modules)
+    for row in range(QR_BORDER, QR_BORDER + QR_MODULES):
+        for column in range(QR_BORDER, QR_BORDER + QR_MODULES):
+            if rng.random() < 0.5:
+                pixels[row * modules + column] = 0
+    # 定位图形及其外侧一圈浅色分隔
+    for top, left in ((0, 0), (0, QR_MODULES - 7), (QR_MODULES - 7, 0)):
+        for row in range(-1, 8):
+            for column in range(-1, 8):
+                y, x = QR_BORDER + top + row, QR_BORDER + left + column
+                if QR_BORDER <= y < QR_BORDER + QR_MODULES and QR_BORDER <= x < QR_BORDER + QR_MODULES:
+                    ring = max(abs(row - 3), abs(column - 3))
+                    pixels[y * modules + x] = 255 if ring in (2, 4) else 0
+    grid = Image.frombytes("L", (modules, modules), bytes(pixels))
+    size = modules * QR_MODULE_PIXELS
+    return grid.resize((size, size), Image.Resampling.NEAREST).convert(mode)
+
+
+def ensure_poster(work_dir, name):
+    path = os.path.join(work_dir, f"poster_{name}.png")
+    if not os.path.exists(path):
+        make_poster(POSTER_SIZES[name]).save(path + ".tmp", format="PNG", compress_level=1)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def ensure_qr_set(work_dir, count, image_format, mode):
+    """生成（或复用）一个二维码集合，完整生成后才写入完成标记"""
+    folder = os.path.join(work_dir, f"qr{QR_DATA_VERSION}_{count}_{image_format}_{mode.lower()}")
+    marker = os.path.join(folder, ".complete")
+    if os.path.exists(marker):
+        return folder
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    extension = ".png" if image_format == "png" else ".jpg"
+    width = len(str(count))
+    for number in range(count):
+        qr = make_qr(SEED + number, mode if image_format == "png" else "RGB")
+        path = os.path.join(folder, f"qr_{str(number).zfill(width)}{extension}")
+        if image_format == "png":
+            qr.save(path, format="PNG")
+        else:
+            qr.save(path, format="JPEG", quality=90)
+    open(marker, "w").close()
+    return folder
+
+
+# ========== 测量 ==========
+def peak_rss_mb():
+    """本进程（及已结束的子进程）的峰值内存（MB），无法获取时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        # Linux 上单位为 KB，macOS 上为字节
+        scale = 1 if sys.platform == "darwin" else 1024
+        usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return usage * scale / 1024 / 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 1024 / 1024
+    return None
+
+
+def case_id(kind, params):
+    return kind + ":" + "/".join(str(value) for value in params)
+
+
+def qr_placement(poster_size):
+    """二维码放在海报右下部分，边长为海报宽度的四分之一"""
+    width, height = poster_size
+    side = width // 4
+    return int(width * 0.6), int(height * 0.7), side, side
+
+
+def batch_output_folder(params, work_dir):
+    return os.path.join(work_dir, "out", case_id("batch", params).replace(":", "_").replace("/", "_"))
+
+
+def run_batch_case(params, work_dir, workers=None):
+    poster_name, count, qr_format, qr_mode, output_format, mode = params
+    poster_path = ensure_poster(work_dir, poster_name)
+    qr_folder = ensure_qr_set(work_dir, count, qr_format, qr_mode)
+    output_folder = batch_output_folder(params, work_dir)
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+    x, y, w, h = qr_placement(POSTER_SIZES[poster_name])
+    job = poster_engine.BatchJob(poster_path, qr_folder, output_folder, x, y, w, h,
+                                 output_format=output_format, execution_mode=mode, max_workers=workers)
+    started = time.perf_counter()
+    result = poster_engine.run_batch(job)
+    elapsed = time.perf_counter() - started
+    stages = {stage: {key: stats[key] for key in ("mean", "p50", "p95", "max", "total")}
+              for stage, stats in result.report["stages"].items()}
+    return {
+        "images": result.success_count,
+        "failed": len(result.failed),
+        "elapsed": elapsed,
+        "images_per_second": result.success_count / elapsed if elapsed > 0 else 0.0,
+        "workers": result.worker_count,
+        "stages": stages,
+        "bytes_read": result.report["bytes_read"],
+        "bytes_written": result.report["bytes_written"],
+        "output_folder": output_folder,
+    }
+
+
+def run_pack_case(params, work_dir, workers=None):
+    """用并行 ZIP 打包同参数批量用例的输出文件夹（没有时先合成一批），只计打包时间"""
+    folder = batch_output_folder(params, work_dir)
+    if not os.path.exists(os.path.join(folder, RunReport.FILENAME)):
+        run_batch_case(params, work_dir, workers)
+    # 与界面和命令行打包一样跳过任务清单、运行报告等记录文件
+    files = poster_archive.collect_folder_files(folder)
+    total_bytes = sum(os.path.getsize(path) for path, _ in files)
+    archive_path = folder + ".zip"
+    started = time.perf_counter()
+    volumes = poster_archive.build_zip_archive(folder, archive_path, max_workers=workers)
+    elapsed = time.perf_counter() - started
+    size = sum(os.path.getsize(volume) for volume in volumes)
+    for volume in volumes:
+        os.remove(volume)
+    return {"files": len(files), "input_bytes": total_bytes, "elapsed": elapsed, "archive_bytes": size,
+            "mb_per_second": total_bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0.0}
+
+
+def _latencies(samples):
+    ordered = sorted(samples)
+    return {
+        "events": len(samples),
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def run_preview_case(poster_name, work_dir):
+    """
+    模拟预览画布的交互：拖动二维码、平移海报、滚轮缩放
+
+    每个事件按界面的 draw_canvas 更新海报和二维码两个图层（交互中用 BILINEAR/NEAREST 快速滤波），
+    最后测一次停止交互后的 LANCZOS 高质量重绘。不包含 Tk 显示图片本身的开销。
+    """
+    poster = Image.open(ensure_poster(work_dir, poster_name)).convert("RGBA")
+    qr = make_qr(SEED)
+    canvas_w, canvas_h = PREVIEW_CANVAS
+    qr_x, qr_y, qr_w, qr_h = qr_placement(poster.size)
+
+    started = time.perf_counter()
+    poster_pyramid = ImagePyramid(poster)
+    qr_pyramid = ImagePyramid(qr)
+    pyramid_seconds = time.perf_counter() - started
+
+    poster_layer = PreviewLayer()
+    qr_layer = PreviewLayer()
+    scale = min((canvas_w - 40) / poster.width, (canvas_h - 40) / poster.height, 1.0)
+    view = {"scale": scale,
+            "x": (canvas_w - poster.width * scale) / 2,
+            "y": (canvas_h - poster.height * scale) / 2,
+            "qr_x": qr_x, "qr_y": qr_y}
+
+    def draw(draft=True):
+        s = view["scale"]
+        poster_layer.update(poster_pyramid, view["x"], view["y"], poster.width * s, poster.height * s,
+                            canvas_w, canvas_h, Image.Resampling.LANCZOS,
+                            Image.Resampling.BILINEAR if draft else None)
+        qr_layer.update(qr_pyramid, view["x"] + view["qr_x"] * s, view["y"] + view["qr_y"] * s,
+                        int(qr_w * s), int(qr_h * s), canvas_w, canvas_h, Image.Resampling.LANCZOS,
+                        Image.Resampling.NEAREST if draft else None)
+
+    def refine():
+        # 与界面的 BackgroundRefiner 相同：用 LANCZOS 重新渲染并换上
+        s = view["scale"]
+        for layer, pyramid, x, y, w, h in (
+                (poster_layer, poster_pyramid, view["x"], view["y"], poster.width * s, poster.height * s),
+                (qr_layer, qr_pyramid, view["x"] + view["qr_x"] * s, view["y"] + view["qr_y"] * s,
+                 int(qr_w * s), int(qr_h * s))):
+            rendered = layer.render(pyramid, x, y, w, h, canvas_w, canvas_h, Image.Resampling.LANCZOS)
+            if rendered is not None:
+                layer.install(rendered)
+
+    def measure(step):
+        samples = []
+        for event in range(PREVIEW_EVENTS):
+            step(event)
+            started = time.perf_counter()
+            draw()
+            samples.append(time.perf_counter() - started)
+        return _latencies(samples)
+
+    draw(draft=False)
+    results = {"pyramid_ms": pyramid_seconds * 1000}
+
+    def drag(event):
+        view["qr_x"] += 5 if event % 20 < 10 else -5
+        view["qr_y"] += 3
+    results["drag_qr"] = measure(drag)
+
+    def pan(event):
+        view["x"] += 15 if event < PREVIEW_EVENTS // 2 else -15
+        view["y"] += 10 if event < PREVIEW_EVENTS // 2 else -10
+    results["pan"] = measure(pan)
+
+    def zoom(event):
+        # 以画布中心为锚点每次放大 10%，一半之后再缩小回来
+        factor = 1.1 if event < PREVIEW_EVENTS // 2 else 1 / 1.1
+        center_x, center_y = canvas_w / 2, canvas_h / 2
+        view["x"] = center_x - (center_x - view["x"]) * factor
+        view["y"] = center_y - (center_y - view["y"]) * factor
+        view["scale"] *= factor
+    results["zoom"] = measure(zoom)
+
+    started = time.perf_counter()
+    refine()
+    results["refine_ms"] = (time.perf_counter() - started) * 1000
+    return results
+
+
+def run_case(kind, params, work_dir, workers=None):
+    """在当前进程中运行一个用例（由子进程调用），返回结果字典"""
+    if kind == "batch":
+        measured = run_batch_case(params, work_dir, workers)
+        measured.pop("output_folder")
+    elif kind == "pack":
+        measured = run_pack_case(params, work_dir, workers)
+    else:
+        measured = run_preview_case(params[0], work_dir)
+    measured["peak_rss_mb"] = peak_rss_mb()
+    return measured
+
+
+def prepare_case(kind, params, work_dir):
+    """在父进程中生成用例需要的测试数据，子进程测到的峰值内存不包含生成过程"""
+    ensure_poster(work_dir, params[0])
+    if kind != "preview":
+        ensure_qr_set(work_dir, *params[1:4])
+
+
+def run_in_subprocess(kind, params, work_dir, workers=None):
+    """每个用例一个子进程，峰值内存互不影响"""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps([kind, list(params)]),
+               "--work-dir", work_dir]
+    if workers:
+        command += ["--workers", str(workers)]
+    completed = subprocess.run(command, capture_output=True, text=True, encoding="utf-8")
+    if completed.returncode != 0:
+        return {"error": (completed.stderr or completed.stdout).strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def machine_info():
+    info = {
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+        if revision.returncode == 0:
+            info["git_revision"] = revision.stdout.strip()
+    except OSError:
+        pass
+    return info
+
+
+def run_suite(suite, work_dir, repeat=1, workers=None, log=print):
+    """
+    运行一组用例
+
+    Returns:
+        {"machine", "suite", "started", "cases": {用例 id: 结果}}；
+        repeat 大于 1 时每个用例运行多次，取吞吐量中位数的那一次
+    """
+    definition = SUITES[suite]
+    cases = ([("batch", params) for params in definition["batch"]] +
+             [("preview", (name,)) for name in definition["preview"]] +
+             [("pack", params) for params in definition["pack"]])
+    results = {}
+    for kind, params in cases:
+        identifier = case_id(kind, params)
+        log(f"{identifier} ...")
+        prepare_case(kind, params, work_dir)
+        runs = [run_in_subprocess(kind, params, work_dir, workers) for _ in range(repeat)]
+        runs = [run for run in runs if "error" not in run] or runs[:1]
+        if kind == "batch":
+            runs.sort(key=lambda run: run.get("images_per_second", 0))
+        elif kind == "pack":
+            runs.sort(key=lambda run: run.get("elapsed", 0))
+        chosen = runs[len(runs) // 2]
+        chosen["runs"] = repeat
+        results[identifier] = chosen
+        log("    " + describe(kind, chosen))
+    return {"machine": machine_info(), "suite": suite, "started": datetime.now().isoformat(timespec="seconds"),
+            "cases": results}
+
+
+def describe(kind, measured):
+    if "error" in measured:
+        return f"失败: {measured['error']}"
+    rss = measured.get("peak_rss_mb")
+    rss_text = f"，峰值内存 {rss:.0f} MB" if rss else ""
+    if kind == "batch":
+        return f"{measured['images_per_second']:.1f} 张/秒（{measured['workers']} 个并行）{rss_text}"
+    if kind == "pack":
+        return f"打包 {measured['elapsed']:.2f} 秒，{measured['mb_per_second']:.1f} MB/秒"
+    return "，".join(f"{name} p95 {measured[name]['p95_ms']:.1f} ms" for name in ("drag_qr", "pan", "zoom"))
+
+
+# 对比时关注的指标：(显示名称, 取值函数, 越大越好)
+COMPARED_METRICS = {
+    "batch": [("张/秒", lambda m: m["images_per_second"], True),
+              ("encode p95 ms", lambda m: m["stages"].get("encode", {}).get("p95", 0) * 1000, False),
+              ("峰值内存 MB", lambda m: m.get("peak_rss_mb"), False)],
+    "preview": [("drag p95 ms", lambda m: m["drag_qr"]["p95_ms"], False),
+                ("pan p95 ms", lambda m: m["pan"]["p95_ms"], False),
+                ("zoom p95 ms", lambda m: m["zoom"]["p95_ms"], False),
+                ("峰值内存 MB", lambda m: m.get("peak_rss_mb"), False)],
+    "pack": [("打包秒数", lambda m: m["elapsed"], False)],
+}
+
+
+def compare(baseline, current):
+    """逐个用例对比两次结果，返回文字表格的各行"""
+    lines = []
+    for identifier, measured in current["cases"].items():
+        before = baseline["cases"].get(identifier)
+        if before is None or "error" in before or "error" in measured:
+            continue
+        for label, value_of, higher_is_better in COMPARED_METRICS[identifier.split(":")[0]]:
+            old, new = value_of(before), value_of(measured)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            mark = "↑" if better and abs(change) >= 5 else "↓" if not better and abs(change) >= 5 else " "
+            lines.append(f"{mark} {identifier:<42} {label:<14} {old:>10.4g} → {new:>10.4g}  {change:+6.1f}%")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench_poster", description="海报批量合成的基准测试")
+    parser.add_argument("--suite", choices=tuple(SUITES), default="quick",
+                        help="quick：几十秒；standard：几分钟；full：包含印刷尺寸和 1 万张的用例")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径（默认只打印）")
+    parser.add_argument("--compare", default=None, help="与之前的结果 JSON 对比")
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例运行次数，取中位数")
+    parser.add_argument("--workers", type=int, default=None, help="并行数（默认与批量合成相同）")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "poster_bench"),
+                        help="测试数据和输出的目录（测试数据会缓存复用）")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    if args.run_case:
+        kind, params = json.loads(args.run_case)
+        print(json.dumps(run_case(kind, tuple(params), args.work_dir, args.workers)))
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = run_suite(args.suite, args.work_dir, max(1, args.repeat), args.workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if baseline is not None:
+        lines = compare(baseline, results)
+        print("\n与 {} 对比（↑ 变好、↓ 变差超过 5%）:".format(args.compare))
+        print("\n".join(lines) if lines else "没有可以对比的用例")
+    failed = [identifier for identifier, measured in results["cases"].items() if "error" in measured]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
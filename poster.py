@@ -1,14 +1,19 @@
 import os
+import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, Canvas
 from PIL import Image, ImageTk
 import threading
-import zipfile
-import tarfile
+import time
 from collections import deque
-from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 
+import poster_engine
+import poster_archive
+import poster_qrgen
+import poster_metrics
+from poster_preview import ImagePyramid, PreviewLayer, FrameScheduler, BackgroundRefiner
+
 
 class InteractiveQRPosterGenerator:
     def __init__(self, root):
@@ -38,8 +43,14 @@ class InteractiveQRPosterGenerator:
         # 数据存储
         self.poster_img = None  # PIL Image 原图二维码
         self.qr_img = None      # PIL Image 原图
+        self.poster_pyramid = None  # 海报的多级缩略图，预览从这里取
+        self.qr_pyramid = None
         self.poster_path_str = ""
         self.qr_folder_str = ""
+        self.qr_index = None  # 替换图片文件夹的索引（后台扫描完成后设置）
+        self._qr_scan_id = 0  # 每次扫描递增，用来丢弃过期扫描的结果
+        self.payload_path = ""  # 二维码内容清单（CSV/JSON），与图片文件夹二选一
+        self.payloads = None  # 清单中的 [QrPayload]
         self.output_folder_str = ""
         
         # Canvas 显示相关
@@ -50,7 +61,14 @@ class InteractiveQRPosterGenerator:
         
         # 添加以下两行：
         self.auto_fit_enabled = True  # 是否启用自动适配
-        self._resize_after_id = None  # 用于延迟调整大小
+        # 所有画布和信息面板的更新都经由调度器合并，每帧最多渲染一次
+        self.render_scheduler = FrameScheduler(self.root, self.render_frame, max_fps=60)
+        # 交互过程中用快速滤波出图，停下后在后台换成 LANCZOS
+        self.preview_refiner = BackgroundRefiner(self.root)
+        self.refine_delay = 150  # 停止交互多久后开始高质量渲染（毫秒）
+        self._refine_after_id = None
+        self.interacting_until = 0.0  # 滚轮缩放等没有“松开”事件的交互，到这个时刻为止算作交互中
+        self.layer_geometry = {}  # 每个图片项最近一次绘制的参数，供后台重新渲染
         # 二维码在海报上的位置和尺寸（基于原图像素坐标）
         self.qr_x = 100
         self.qr_y = 100
@@ -72,6 +90,16 @@ class InteractiveQRPosterGenerator:
         self.snap_threshold = 10  # 吸附阈值（像素）
         self.guide_lines = []  # 辅助线坐标
         
+        # 画布上常驻的图形项：只在第一次绘制时创建，之后只移动或改配置
+        self.canvas_items = {}
+        self.canvas_photos = {}  # 保持 PhotoImage 引用，避免被回收
+        self.poster_layer = PreviewLayer()
+        self.qr_layer = PreviewLayer()
+        # 最近一次绘制的几何信息，鼠标命中检测直接使用
+        self.qr_display_rect = None  # (x, y, w, h)
+        self.handle_centers = {}  # "tl"/"tr"/"bl"/"br" -> (x, y)
+        self.current_cursor = "arrow"
+        
         # 撤销/重做功能
         self.history = deque(maxlen=50)  # 最多保存50步历史
         self.redo_stack = deque(maxlen=50)
@@ -83,6 +111,17 @@ class InteractiveQRPosterGenerator:
         self.naming_start_number = tk.IntVar(value=1)  # 序号起始值
         self.naming_prefix = tk.StringVar(value="")  # 前缀
         self.naming_suffix = tk.StringVar(value="")  # 后缀
+        # 并行处理设置
+        self.execution_mode = tk.StringVar(value="thread")  # thread / process
+        self.worker_count_var = tk.StringVar(value="")  # 留空表示自动
+        self.resume_enabled = tk.BooleanVar(value=True)  # 断点续传
+        self.incremental_enabled = tk.BooleanVar(value=False)  # 增量更新
+        self.region_encoding_enabled = tk.BooleanVar(value=False)  # 只重新编码变化区域
+        self.dedup_enabled = tk.BooleanVar(value=True)  # 内容相同的输入只合成一次
+        # 打包输出：合成时直接写入压缩包
+        self.compress_option = tk.StringVar(value="none")  # none / zip / tar / tar.gz
+        self.archive_only = tk.BooleanVar(value=False)  # 只生成压缩包，不保存单独文件
+        self.archive_volume_var = tk.StringVar(value="")  # 打包现有文件夹时的分卷大小，留空表示不分卷
         
         self.setup_ui()
         self.setup_shortcuts()
@@ -147,6 +186,12 @@ class InteractiveQRPosterGenerator:
         self.qr_folder_label = ttk.Label(qr_frame, text="未选择", foreground="gray", wraplength=200)
         self.qr_folder_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Button(qr_frame, text="浏览", command=self.select_qr_folder, width=8).pack(side=tk.RIGHT)
+        self.recursive_scan = tk.BooleanVar(value=False)
+        qr_options_frame = ttk.Frame(left_panel)
+        qr_options_frame.pack(fill=tk.X, padx=10)
+        ttk.Checkbutton(qr_options_frame, text="包含子文件夹", variable=self.recursive_scan,
+                        command=self.rescan_qr_folder).pack(side=tk.LEFT)
+        ttk.Button(qr_options_frame, text="或导入二维码清单", command=self.select_payload_file).pack(side=tk.RIGHT)
         
         # 输出文件夹选择
         ttk.Label(left_panel, text="3. 选择输出文件夹", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=(20, 5), padx=10)
@@ -272,6 +317,19 @@ class InteractiveQRPosterGenerator:
                         value="png", command=self.on_format_change).pack(anchor=tk.W)
         ttk.Radiobutton(format_frame, text="JPEG (有损压缩)", variable=self.output_format, 
                         value="jpeg", command=self.on_format_change).pack(anchor=tk.W)
+        ttk.Radiobutton(format_frame, text="TIFF (无损，印刷用)", variable=self.output_format, 
+                        value="tiff", command=self.on_format_change).pack(anchor=tk.W)
+
+        # PNG 编码档位：只影响速度和文件大小，不影响画质
+        self.png_profile_frame = ttk.Frame(quality_frame)
+        self.png_profile_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(self.png_profile_frame, text="PNG压缩:").pack(side=tk.LEFT)
+        self.png_profile = tk.StringVar(value=poster_engine.DEFAULT_PNG_PROFILE)
+        ttk.Combobox(self.png_profile_frame, textvariable=self.png_profile, state="readonly", width=10,
+                     values=list(poster_engine.PNG_PROFILES)).pack(side=tk.LEFT, padx=(5, 3))
+        self.measure_png_btn = ttk.Button(self.png_profile_frame, text="试算", width=6,
+                                          command=self.start_png_profile_measure)
+        self.measure_png_btn.pack(side=tk.LEFT)
 
         # JPEG质量设置区域
         self.jpeg_quality_frame = ttk.Frame(quality_frame)
@@ -403,6 +461,53 @@ class InteractiveQRPosterGenerator:
         self.custom_naming_frame.pack_forget()
         self.custom_template_frame.pack_forget()
         
+        # 并行处理选项
+        ttk.Separator(left_panel, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=15, padx=10)
+        ttk.Label(left_panel, text="并行处理", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=(0, 5), padx=10)
+        
+        parallel_frame = ttk.Frame(left_panel)
+        parallel_frame.pack(fill=tk.X, padx=10)
+        ttk.Radiobutton(parallel_frame, text="多线程 (启动快)", variable=self.execution_mode,
+                        value="thread").pack(anchor=tk.W)
+        ttk.Radiobutton(parallel_frame, text="多进程 (多核机器更快)", variable=self.execution_mode,
+                        value="process").pack(anchor=tk.W)
+        
+        workers_frame = ttk.Frame(parallel_frame)
+        workers_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(workers_frame, text="并行数:").pack(side=tk.LEFT)
+        ttk.Spinbox(workers_frame, from_=1, to=256, textvariable=self.worker_count_var,
+                    width=8).pack(side=tk.LEFT, padx=(5, 3))
+        ttk.Label(workers_frame, text="(留空=自动)", font=("Arial", 8), foreground="#666").pack(side=tk.LEFT)
+        ttk.Checkbutton(parallel_frame, text="断点续传 (跳过已完成的文件)",
+                        variable=self.resume_enabled).pack(anchor=tk.W, pady=(5, 0))
+        ttk.Checkbutton(parallel_frame, text="增量更新 (只合成有变化的文件)",
+                        variable=self.incremental_enabled).pack(anchor=tk.W, pady=(2, 0))
+        ttk.Checkbutton(parallel_frame, text="只重新编码二维码区域 (更快)",
+                        variable=self.region_encoding_enabled).pack(anchor=tk.W, pady=(2, 0))
+        ttk.Checkbutton(parallel_frame, text="相同内容的图片只合成一次 (其余复制)",
+                        variable=self.dedup_enabled).pack(anchor=tk.W, pady=(2, 0))
+        
+        # 打包输出选项
+        ttk.Separator(left_panel, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=15, padx=10)
+        ttk.Label(left_panel, text="打包输出", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=(0, 5), padx=10)
+        
+        archive_frame = ttk.Frame(left_panel)
+        archive_frame.pack(fill=tk.X, padx=10)
+        archive_types = ttk.Frame(archive_frame)
+        archive_types.pack(fill=tk.X)
+        for text, value in [("不打包", "none"), ("ZIP", "zip"), ("TAR", "tar"), ("TAR.GZ", "tar.gz")]:
+            ttk.Radiobutton(archive_types, text=text, variable=self.compress_option,
+                            value=value).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Checkbutton(archive_frame, text="只生成压缩包 (不保存单独文件)",
+                        variable=self.archive_only).pack(anchor=tk.W, pady=(5, 0))
+        
+        volume_frame = ttk.Frame(archive_frame)
+        volume_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(volume_frame, text="分卷大小:").pack(side=tk.LEFT)
+        ttk.Entry(volume_frame, textvariable=self.archive_volume_var, width=8).pack(side=tk.LEFT, padx=(5, 3))
+        ttk.Label(volume_frame, text="(如 2G，留空=不分卷)", font=("Arial", 8), foreground="#666").pack(side=tk.LEFT)
+        self.package_btn = ttk.Button(archive_frame, text="📦 打包现有输出文件夹", command=self.start_packaging)
+        self.package_btn.pack(fill=tk.X, pady=(5, 0))
         
         # 底部按钮区域
         ttk.Separator(left_panel, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=20, padx=10)
@@ -473,17 +578,25 @@ class InteractiveQRPosterGenerator:
     def update_naming_preview(self):
         """更新文件名预览 - 使用真实文件"""
         try:
+            # 清单模式：直接使用清单中的名称
+            if self.payloads is not None:
+                qr_files = [payload.name for payload in self.payloads]
             # 检查是否已选择二维码文件夹
-            if not self.qr_folder_str or not os.path.exists(self.qr_folder_str):
+            elif not self.qr_folder_str or not os.path.exists(self.qr_folder_str):
                 self.naming_preview_label.configure(
                     text="预览: 请先选择替换图片文件夹", 
                     foreground="gray"
                 )
                 return
-            
-            # 获取文件夹中的图片文件
-            qr_files = [f for f in os.listdir(self.qr_folder_str) 
-                        if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+            # 使用后台扫描得到的索引，不在界面线程中列出文件夹
+            elif self.qr_index is None:
+                self.naming_preview_label.configure(
+                    text="预览: 正在扫描文件夹…", 
+                    foreground="gray"
+                )
+                return
+            else:
+                qr_files = self.qr_index.names
             
             if not qr_files:
                 self.naming_preview_label.configure(
@@ -529,75 +642,32 @@ class InteractiveQRPosterGenerator:
         Returns:
             生成的文件名（含扩展名）
         """
-        from datetime import datetime
-        
-        # 分离文件名和扩展名
-        base_name = os.path.splitext(original_filename)[0]
-        
-        # 确定输出扩展名
-        output_format = self.output_format.get()
-        extension = ".png" if output_format == "png" else ".jpg"
-        
-        # 获取命名模式
+        return poster_engine.generate_filename(
+            original_filename, index,
+            pattern=self.get_naming_template(),
+            start_number=self.naming_start_number.get(),
+            prefix=self.naming_prefix.get(),
+            suffix=self.naming_suffix.get(),
+            output_format=self.output_format.get()
+        )
+
+    def get_naming_template(self):
+        """当前命名方式对应的模板字符串"""
         pattern = self.naming_pattern.get()
-        
-        # 准备变量
-        number = self.naming_start_number.get() + index
-        prefix = self.naming_prefix.get()
-        suffix = self.naming_suffix.get()
-        date_str = datetime.now().strftime("%Y%m%d")
-        time_str = datetime.now().strftime("%H%M%S")
-        
-        # 根据模式生成文件名
-        if pattern == "{original}":
-            filename = base_name
-        
-        elif pattern == "{number}":
-            filename = str(number)
-        
-        elif pattern == "{number:04d}":
-            filename = f"{number:04d}"
-        
-        elif pattern == "{prefix}{original}":
-            filename = f"{prefix}{base_name}"
-        
-        elif pattern == "{original}{suffix}":
-            filename = f"{base_name}{suffix}"
-        
-        elif pattern == "{prefix}{number:04d}":
-            filename = f"{prefix}{number:04d}"
-        
-        elif pattern == "custom":
-            # 自定义模板
-            template = self.custom_template_var.get()
-            filename = template.format(
-                original=base_name,
-                number=number,
-                prefix=prefix,
-                suffix=suffix,
-                date=date_str,
-                time=time_str
-            )
-            # 处理数字格式化（如 {number:04d}）
-            import re
-            filename = re.sub(r'\{number:(\d+)d\}', lambda m: f"{number:0{m.group(1)}d}", filename)
-        
-        else:
-            filename = base_name
-        
-        # 清理非法字符
-        illegal_chars = '<>:"/\\|?*'
-        for char in illegal_chars:
-            filename = filename.replace(char, '_')
-        
-        return filename + extension
+        if pattern == "custom":
+            return self.custom_template_var.get()
+        return pattern
 
     def on_format_change(self):
-        """格式改变时显示/隐藏JPEG质量设置"""
+        """格式改变时显示/隐藏JPEG质量设置和PNG压缩档位"""
         if self.output_format.get() == "jpeg":
             self.jpeg_quality_frame.pack(fill=tk.X, pady=(5, 0))
         else:
             self.jpeg_quality_frame.pack_forget()
+        if self.output_format.get() == "png":
+            self.png_profile_frame.pack(fill=tk.X, pady=(5, 0))
+        else:
+            self.png_profile_frame.pack_forget()
         
         # ========== 添加这一行 ==========
         self.update_naming_preview()  # 扩展名会变化
@@ -746,7 +816,11 @@ class InteractiveQRPosterGenerator:
             self.status_label.configure(text="无法重做", foreground="gray")
     
     def update_input_fields(self):
-        """更新输入框的值"""
+        """请求更新输入框（合并到下一帧）"""
+        self.render_scheduler.request("inputs")
+    
+    def write_input_fields(self):
+        """把当前位置和尺寸写入输入框"""
         if not self.updating_from_code:
             self.updating_from_code = True
             self.x_var.set(str(int(self.qr_x)))
@@ -808,6 +882,7 @@ class InteractiveQRPosterGenerator:
         if file_path:
             try:
                 self.poster_img = Image.open(file_path).convert("RGBA")
+                self.poster_pyramid = ImagePyramid(self.poster_img)
                 self.poster_path_str = file_path
                 self.poster_path_label.configure(text=os.path.basename(file_path), foreground="black")
                 
@@ -830,32 +905,131 @@ class InteractiveQRPosterGenerator:
     def select_qr_folder(self):
         folder_path = filedialog.askdirectory(title="选择被替换的图片文件夹")
         if folder_path:
-            qr_files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
-            if not qr_files:
-                messagebox.showwarning("警告", "文件夹中没有找到图片文件")
+            self.payload_path = ""
+            self.payloads = None
+            self.start_qr_scan(folder_path, load_preview=True)
+    
+    def select_payload_file(self):
+        """导入二维码内容清单：批处理时在内存中生成二维码，不需要先生成图片文件"""
+        path = filedialog.askopenfilename(
+            title="选择二维码内容清单",
+            filetypes=[("内容清单", "*.csv *.json"), ("CSV", "*.csv"), ("JSON", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            payloads = poster_qrgen.load_payloads(path)
+            if not payloads:
+                messagebox.showwarning("警告", "清单中没有内容")
                 return
-            
+            # 预览用第一条生成的二维码，放大到约 300 像素便于显示
+            modules = poster_qrgen.qr_modules(payloads[0].data)
+            scale = max(1, 300 // modules.width)
+            preview = modules.resize((modules.width * scale, modules.height * scale), Image.Resampling.NEAREST)
+        except (OSError, ValueError, RuntimeError) as e:
+            messagebox.showerror("错误", f"无法读取清单: {e}")
+            return
+        
+        # 取消正在进行的文件夹扫描
+        self._qr_scan_id += 1
+        self.qr_index = None
+        self.qr_folder_str = ""
+        self.payload_path = path
+        self.payloads = payloads
+        self.qr_img = preview.convert("RGBA")
+        self.qr_pyramid = ImagePyramid(self.qr_img)
+        self.qr_folder_label.configure(text=f"{os.path.basename(path)} ({len(payloads)}条)", foreground="black")
+        
+        self.qr_w = min(self.qr_img.width, 300)
+        self.qr_h = min(self.qr_img.height, 300)
+        self.original_aspect_ratio = 1.0
+        
+        self.update_input_fields()
+        self.redraw_canvas()
+        self.check_ready()
+        self.save_state()
+        self.update_naming_preview()
+    
+    def rescan_qr_folder(self):
+        """切换是否包含子文件夹后重新扫描当前文件夹"""
+        if self.qr_folder_str:
+            self.start_qr_scan(self.qr_folder_str, load_preview=False)
+    
+    def start_qr_scan(self, folder_path, load_preview):
+        """
+        在后台线程中扫描文件夹（大文件夹或网络共享上可能要几秒）
+        
+        找到第一张图片就先加载预览，扫描过程中更新计数，完成后再更新命名预览。
+        """
+        self._qr_scan_id += 1
+        scan_id = self._qr_scan_id
+        recursive = self.recursive_scan.get()
+        self.qr_index = None
+        self.qr_folder_label.configure(text=f"{os.path.basename(folder_path)} (扫描中…)", foreground="gray")
+        self.update_naming_preview()
+        
+        def on_progress(entries):
+            self.root.after(0, self.on_qr_scan_progress, scan_id, folder_path,
+                            len(entries), entries[0][0] if load_preview else None)
+        
+        def scan():
             try:
-                # 加载第一个二维码作为预览
-                first_qr = os.path.join(folder_path, qr_files[0])
-                self.qr_img = Image.open(first_qr).convert("RGBA")
-                self.qr_folder_str = folder_path
-                self.qr_folder_label.configure(text=f"{os.path.basename(folder_path)} ({len(qr_files)}张)", foreground="black")
-                
-                # 初始化二维码尺寸
-                self.qr_w = min(self.qr_img.width, 300)
-                self.qr_h = min(self.qr_img.height, 300)
-                self.original_aspect_ratio = self.qr_img.width / self.qr_img.height
-                
-                self.update_input_fields()
-                self.redraw_canvas()
-                self.check_ready()
-                self.save_state()
-                # ========== 添加这一行 ==========
-                self.update_naming_preview()  # 更新预览
-                # ================================
-            except Exception as e:
-                messagebox.showerror("错误", f"无法加载被替换的图片: {e}")
+                index = poster_engine.get_folder_index(folder_path, recursive, on_progress=on_progress)
+                error = None
+            except OSError as e:
+                index, error = None, str(e)
+            self.root.after(0, self.on_qr_scan_done, scan_id, folder_path, index, error, load_preview)
+        
+        threading.Thread(target=scan, daemon=True).start()
+    
+    def on_qr_scan_progress(self, scan_id, folder_path, count, first_name):
+        if scan_id != self._qr_scan_id:
+            return
+        self.qr_folder_label.configure(text=f"{os.path.basename(folder_path)} (扫描中… {count}张)", foreground="gray")
+        if first_name and count == 1:
+            self.load_first_qr(folder_path, first_name)
+    
+    def on_qr_scan_done(self, scan_id, folder_path, index, error, load_preview):
+        if scan_id != self._qr_scan_id:
+            return
+        if error:
+            self.qr_folder_label.configure(text="未选择", foreground="gray")
+            messagebox.showerror("错误", f"无法读取文件夹: {error}")
+            return
+        if not len(index):
+            self.qr_folder_label.configure(text=f"{os.path.basename(folder_path)} (0张)", foreground="orange")
+            messagebox.showwarning("警告", "文件夹中没有找到图片文件")
+            return
+        # 索引已缓存时不会触发进度回调，这里补上预览
+        if load_preview and self.qr_folder_str != folder_path:
+            self.load_first_qr(folder_path, index.names[0])
+        self.qr_index = index
+        self.qr_folder_label.configure(text=f"{os.path.basename(folder_path)} ({len(index)}张)", foreground="black")
+        self.update_naming_preview()
+    
+    def load_first_qr(self, folder_path, qr_filename):
+        """加载文件夹中的第一张图片作为预览，并初始化放置尺寸"""
+        try:
+            # 加载第一个二维码作为预览
+            first_qr = os.path.join(folder_path, qr_filename)
+            self.qr_img = Image.open(first_qr).convert("RGBA")
+            self.qr_pyramid = ImagePyramid(self.qr_img)
+            self.qr_folder_str = folder_path
+            
+            # 初始化二维码尺寸
+            self.qr_w = min(self.qr_img.width, 300)
+            self.qr_h = min(self.qr_img.height, 300)
+            self.original_aspect_ratio = self.qr_img.width / self.qr_img.height
+            
+            self.update_input_fields()
+            self.redraw_canvas()
+            self.check_ready()
+            self.save_state()
+            # ========== 添加这一行 ==========
+            self.update_naming_preview()  # 更新预览
+            # ================================
+        except Exception as e:
+            messagebox.showerror("错误", f"无法加载被替换的图片: {e}")
 
     def select_output_folder(self):
         folder_path = filedialog.askdirectory(title="选择输出文件夹")
@@ -880,15 +1054,23 @@ class InteractiveQRPosterGenerator:
         if not self.poster_img:
             return
         
-        # 取消之前的延迟调用，避免频繁重绘
-        if self._resize_after_id is not None:
-            self.root.after_cancel(self._resize_after_id)
-        
-        # 延迟100ms后执行，避免窗口调整过程中频繁重绘
-        self._resize_after_id = self.root.after(100, self.recalculate_and_redraw)
+        # 窗口调整过程中的多次事件由调度器合并为每帧一次
+        self.render_scheduler.request("refit", "canvas")
+
+    def render_frame(self, parts):
+        """调度器每帧调用一次，按需更新各部分"""
+        if "refit" in parts:
+            self.recalculate_view()
+        if "refit" in parts or "canvas" in parts:
+            self.draw_canvas()
+            parts.add("info")
+        if "info" in parts:
+            self.draw_info_display()
+        if "inputs" in parts:
+            self.write_input_fields()
 
-    def recalculate_and_redraw(self):
-        """重新计算缩放比例并重绘"""
+    def recalculate_view(self):
+        """自动适配模式下重新计算缩放比例和居中偏移"""
         if not self.poster_img or not self.auto_fit_enabled:
             return
         
@@ -907,15 +1089,95 @@ class InteractiveQRPosterGenerator:
         # 重新计算居中偏移
         self.canvas_offset_x = (canvas_w - self.poster_img.width * self.canvas_scale) / 2
         self.canvas_offset_y = (canvas_h - self.poster_img.height * self.canvas_scale) / 2
-        
-        # 重绘
-        self.redraw_canvas()
     
+    def ensure_canvas_items(self):
+        """创建常驻的画布图形项（只执行一次）"""
+        if self.canvas_items:
+            return
+        hidden = tk.HIDDEN
+        items = {}
+        items["poster"] = self.canvas.create_image(0, 0, anchor=tk.NW, tags="poster", state=hidden)
+        items["guide_v"] = self.canvas.create_line(0, 0, 0, 0, fill="#ff00ff", width=1, dash=(5, 5),
+                                                   tags="guide", state=hidden)
+        items["guide_h"] = self.canvas.create_line(0, 0, 0, 0, fill="#ff00ff", width=1, dash=(5, 5),
+                                                   tags="guide", state=hidden)
+        items["qr"] = self.canvas.create_image(0, 0, anchor=tk.NW, tags="qr", state=hidden)
+        items["qr_border"] = self.canvas.create_rectangle(0, 0, 0, 0, outline="#00ff00", width=2,
+                                                          tags="qr_border", state=hidden)
+        for tag in ["tl", "tr", "bl", "br"]:
+            items[f"handle_{tag}"] = self.canvas.create_rectangle(0, 0, 0, 0, fill="#00ff00", outline="white",
+                                                                  width=1, tags=f"handle_{tag}", state=hidden)
+        self.canvas_items = items
+
+    def set_item_visible(self, name, visible):
+        self.canvas.itemconfigure(self.canvas_items[name], state=tk.NORMAL if visible else tk.HIDDEN)
+
+    def update_image_item(self, name, layer, pyramid, dest_x, dest_y, dest_w, dest_h, canvas_w, canvas_h,
+                          draft_resample=None):
+        """更新一个图片项：只有缩放或可见范围超出缓存时才重新缩放，否则只移动"""
+        self.layer_geometry[name] = (layer, pyramid, (dest_x, dest_y, dest_w, dest_h, canvas_w, canvas_h))
+        result = layer.update(pyramid, dest_x, dest_y, dest_w, dest_h, canvas_w, canvas_h,
+                              draft_resample=draft_resample)
+        if result is None:
+            self.set_item_visible(name, False)
+            return
+        changed, x, y = result
+        item = self.canvas_items[name]
+        if changed:
+            self.canvas_photos[name] = ImageTk.PhotoImage(layer.image)
+            self.canvas.itemconfigure(item, image=self.canvas_photos[name])
+        self.canvas.coords(item, x, y)
+        self.set_item_visible(name, True)
+
+    def is_interacting(self):
+        """是否正在拖动、平移或滚轮缩放"""
+        return self.dragging or time.monotonic() < self.interacting_until
+
+    def schedule_refine(self):
+        """停止交互 refine_delay 毫秒后，在后台把快速预览换成高质量预览"""
+        if self._refine_after_id is not None:
+            self.root.after_cancel(self._refine_after_id)
+        self._refine_after_id = self.root.after(self.refine_delay, self.start_refine)
+
+    def start_refine(self):
+        self._refine_after_id = None
+        if self.is_interacting():
+            self.schedule_refine()
+            return
+        
+        names = [name for name, (layer, _, _) in self.layer_geometry.items() if layer.needs_refine]
+        if not names:
+            return
+        jobs = []
+        for name in names:
+            layer, pyramid, geometry = self.layer_geometry[name]
+            jobs.append(lambda layer=layer, pyramid=pyramid, geometry=geometry:
+                        layer.render(pyramid, *geometry, Image.Resampling.LANCZOS))
+        
+        def on_done(results):
+            for name, rendered in zip(names, results):
+                layer = self.layer_geometry[name][0]
+                # 渲染期间图片或显示尺寸又变了，结果作废
+                if rendered is not None and layer.needs_refine and layer.matches(rendered):
+                    layer.install(rendered)
+            self.redraw_canvas()
+        
+        self.preview_refiner.submit(jobs, on_done)
+
     def redraw_canvas(self):
-        self.canvas.delete("all")
+        """请求重绘画布（合并到下一帧）"""
+        self.render_scheduler.request("canvas")
+
+    def draw_canvas(self):
+        """按当前状态更新画布上的各个图形项"""
+        self.ensure_canvas_items()
         self.guide_lines = []
+        self.qr_display_rect = None
+        self.handle_centers = {}
         
         if not self.poster_img:
+            for name in self.canvas_items:
+                self.set_item_visible(name, False)
             return
         
         # 获取Canvas尺寸
@@ -940,11 +1202,16 @@ class InteractiveQRPosterGenerator:
         display_w = int(self.poster_img.width * self.canvas_scale)
         display_h = int(self.poster_img.height * self.canvas_scale)
         
-        if display_w > 0 and display_h > 0:
-            poster_resized = self.poster_img.resize((display_w, display_h), Image.Resampling.LANCZOS)
-            self.poster_photo = ImageTk.PhotoImage(poster_resized)
-            self.canvas.create_image(self.canvas_offset_x, self.canvas_offset_y, 
-                                    image=self.poster_photo, anchor=tk.NW, tags="poster")
+        # 交互过程中先用快速滤波，停下后再在后台换成 LANCZOS
+        interacting = self.is_interacting()
+        
+        # 只渲染画布内可见的部分（带预留边距），平移时通常只需移动图片项
+        self.update_image_item("poster", self.poster_layer, self.poster_pyramid,
+                               self.canvas_offset_x, self.canvas_offset_y,
+                               self.poster_img.width * self.canvas_scale,
+                               self.poster_img.height * self.canvas_scale,
+                               canvas_w, canvas_h,
+                               draft_resample=Image.Resampling.BILINEAR if interacting else None)
         
         # 绘制辅助线（中线）
         if self.snap_enabled.get() and self.poster_img:
@@ -952,21 +1219,24 @@ class InteractiveQRPosterGenerator:
             poster_center_y = self.canvas_offset_y + (self.poster_img.height / 2) * self.canvas_scale
             
             # 垂直中线
-            self.canvas.create_line(poster_center_x, self.canvas_offset_y,
-                                   poster_center_x, self.canvas_offset_y + display_h,
-                                   fill="#ff00ff", width=1, dash=(5, 5), tags="guide")
+            self.canvas.coords(self.canvas_items["guide_v"],
+                               poster_center_x, self.canvas_offset_y,
+                               poster_center_x, self.canvas_offset_y + display_h)
             
             # 水平中线
-            self.canvas.create_line(self.canvas_offset_x, poster_center_y,
-                                   self.canvas_offset_x + display_w, poster_center_y,
-                                   fill="#ff00ff", width=1, dash=(5, 5), tags="guide")
+            self.canvas.coords(self.canvas_items["guide_h"],
+                               self.canvas_offset_x, poster_center_y,
+                               self.canvas_offset_x + display_w, poster_center_y)
             
             self.guide_lines = [
                 ('v', self.poster_img.width / 2),  # 垂直中线
                 ('h', self.poster_img.height / 2)  # 水平中线
             ]
+        self.set_item_visible("guide_v", bool(self.guide_lines))
+        self.set_item_visible("guide_h", bool(self.guide_lines))
         
         # 绘制二维码
+        qr_visible = False
         if self.qr_img:
             qr_display_x = self.canvas_offset_x + self.qr_x * self.canvas_scale
             qr_display_y = self.canvas_offset_y + self.qr_y * self.canvas_scale
@@ -974,35 +1244,47 @@ class InteractiveQRPosterGenerator:
             qr_display_h = int(self.qr_h * self.canvas_scale)
             
             if qr_display_w > 0 and qr_display_h > 0:
-                qr_resized = self.qr_img.resize((qr_display_w, qr_display_h), Image.Resampling.LANCZOS)
-                self.qr_photo = ImageTk.PhotoImage(qr_resized)
-                self.canvas.create_image(qr_display_x, qr_display_y, 
-                                        image=self.qr_photo, anchor=tk.NW, tags="qr")
+                qr_visible = True
+                self.qr_display_rect = (qr_display_x, qr_display_y, qr_display_w, qr_display_h)
+                # 二维码是方块图案，最近邻缩放在预览里几乎看不出差别
+                self.update_image_item("qr", self.qr_layer, self.qr_pyramid,
+                                       qr_display_x, qr_display_y, qr_display_w, qr_display_h,
+                                       canvas_w, canvas_h,
+                                       draft_resample=Image.Resampling.NEAREST if interacting else None)
                 
-                # 绘制边框
-                self.canvas.create_rectangle(qr_display_x, qr_display_y,
-                                            qr_display_x + qr_display_w,
-                                            qr_display_y + qr_display_h,
-                                            outline="#00ff00", width=2, tags="qr_border")
+                # 边框
+                self.canvas.coords(self.canvas_items["qr_border"],
+                                   qr_display_x, qr_display_y,
+                                   qr_display_x + qr_display_w,
+                                   qr_display_y + qr_display_h)
                 
-                # 绘制四个角的缩放手柄
+                # 四个角的缩放手柄
                 handle_size = 10
-                handles = [
-                    (qr_display_x, qr_display_y, "tl"),  # 左上
-                    (qr_display_x + qr_display_w, qr_display_y, "tr"),  # 右上
-                    (qr_display_x, qr_display_y + qr_display_h, "bl"),  # 左下
-                    (qr_display_x + qr_display_w, qr_display_y + qr_display_h, "br")  # 右下
-                ]
+                self.handle_centers = {
+                    "tl": (qr_display_x, qr_display_y),  # 左上
+                    "tr": (qr_display_x + qr_display_w, qr_display_y),  # 右上
+                    "bl": (qr_display_x, qr_display_y + qr_display_h),  # 左下
+                    "br": (qr_display_x + qr_display_w, qr_display_y + qr_display_h)  # 右下
+                }
                 
-                for hx, hy, tag in handles:
-                    self.canvas.create_rectangle(hx - handle_size/2, hy - handle_size/2,
-                                                hx + handle_size/2, hy + handle_size/2,
-                                                fill="#00ff00", outline="white", width=1,
-                                                tags=f"handle_{tag}")
-        
-        self.update_info_display()
+                for tag, (hx, hy) in self.handle_centers.items():
+                    self.canvas.coords(self.canvas_items[f"handle_{tag}"],
+                                       hx - handle_size/2, hy - handle_size/2,
+                                       hx + handle_size/2, hy + handle_size/2)
+        
+        if not qr_visible:
+            self.set_item_visible("qr", False)
+        for name in ["qr_border", "handle_tl", "handle_tr", "handle_bl", "handle_br"]:
+            self.set_item_visible(name, qr_visible)
+        
+        if self.poster_layer.needs_refine or (qr_visible and self.qr_layer.needs_refine):
+            self.schedule_refine()
     
     def update_info_display(self):
+        """请求更新信息显示（合并到下一帧）"""
+        self.render_scheduler.request("info")
+    
+    def draw_info_display(self):
         """更新信息显示"""
         self.info_text.configure(state=tk.NORMAL)
         self.info_text.delete(1.0, tk.END)
@@ -1035,6 +1317,8 @@ class InteractiveQRPosterGenerator:
         self.canvas_offset_x = mouse_x - (mouse_x - self.canvas_offset_x) * (self.canvas_scale / old_scale)
         self.canvas_offset_y = mouse_y - (mouse_y - self.canvas_offset_y) * (self.canvas_scale / old_scale)
         
+        # 连续滚动时用快速预览
+        self.interacting_until = time.monotonic() + self.refine_delay / 1000
         self.redraw_canvas()
 
     
@@ -1052,6 +1336,7 @@ class InteractiveQRPosterGenerator:
         self.dragging = True
         self.drag_start_x = event.x
         self.drag_start_y = event.y
+        self.current_cursor = "fleur"
         self.canvas.configure(cursor="fleur")
     
     def on_pan_drag(self, event):
@@ -1073,38 +1358,43 @@ class InteractiveQRPosterGenerator:
         if self.drag_mode == "pan":
             self.drag_mode = None
             self.dragging = False
+            self.current_cursor = "arrow"
             self.canvas.configure(cursor="arrow")
+            self.redraw_canvas()
+    
+    def hit_test(self, x, y):
+        """
+        用最近一次绘制时缓存的几何信息做命中检测
+        
+        Returns:
+            "tl"/"tr"/"bl"/"br"（手柄）、"qr"（二维码区域）或 None
+        """
+        for tag in ["tl", "tr", "bl", "br"]:
+            if tag in self.handle_centers:
+                cx, cy = self.handle_centers[tag]
+                if abs(x - cx) < 15 and abs(y - cy) < 15:
+                    return tag
+        
+        if self.qr_display_rect:
+            qr_display_x, qr_display_y, qr_display_w, qr_display_h = self.qr_display_rect
+            if (qr_display_x <= x <= qr_display_x + qr_display_w and
+                qr_display_y <= y <= qr_display_y + qr_display_h):
+                return "qr"
+        return None
     
     def on_canvas_press(self, event):
         if not self.qr_img:
             return
         
-        # 检查是否点击了手柄
-        for tag in ["tl", "tr", "bl", "br"]:
-            items = self.canvas.find_withtag(f"handle_{tag}")
-            if items:
-                coords = self.canvas.coords(items[0])
-                cx = (coords[0] + coords[2]) / 2
-                cy = (coords[1] + coords[3]) / 2
-                if abs(event.x - cx) < 15 and abs(event.y - cy) < 15:
-                    self.drag_mode = f"resize_{tag}"
-                    self.dragging = True
-                    self.drag_start_x = event.x
-                    self.drag_start_y = event.y
-                    return
-        
-        # 检查是否点击了二维码区域
-        qr_display_x = self.canvas_offset_x + self.qr_x * self.canvas_scale
-        qr_display_y = self.canvas_offset_y + self.qr_y * self.canvas_scale
-        qr_display_w = self.qr_w * self.canvas_scale
-        qr_display_h = self.qr_h * self.canvas_scale
-        
-        if (qr_display_x <= event.x <= qr_display_x + qr_display_w and
-            qr_display_y <= event.y <= qr_display_y + qr_display_h):
-            self.drag_mode = "move"
-            self.dragging = True
-            self.drag_start_x = event.x
-            self.drag_start_y = event.y
+        hit = self.hit_test(event.x, event.y)
+        if hit is None:
+            return
+        
+        # 手柄：缩放；二维码区域：移动
+        self.drag_mode = "move" if hit == "qr" else f"resize_{hit}"
+        self.dragging = True
+        self.drag_start_x = event.x
+        self.drag_start_y = event.y
     
     def on_canvas_drag(self, event):
         if not self.dragging or self.drag_mode == "pan":
@@ -1210,42 +1500,32 @@ class InteractiveQRPosterGenerator:
             self.save_state()
             self.status_label.configure(text="就绪", foreground="blue")
         
+        was_dragging = self.dragging
         self.dragging = False
         self.drag_mode = None
+        if was_dragging:
+            # 松开后安排高质量渲染
+            self.redraw_canvas()
     
     def on_canvas_motion(self, event):
         # 改变鼠标光标
         if not self.qr_img:
             return
         
-        cursor = "arrow"
-        
-        # 检查手柄
-        for tag in ["tl", "tr", "bl", "br"]:
-            items = self.canvas.find_withtag(f"handle_{tag}")
-            if items:
-                coords = self.canvas.coords(items[0])
-                cx = (coords[0] + coords[2]) / 2
-                cy = (coords[1] + coords[3]) / 2
-                if abs(event.x - cx) < 15 and abs(event.y - cy) < 15:
-                    if tag in ["tl", "br"]:
-                        cursor = "size_nw_se"
-                    else:
-                        cursor = "size_ne_sw"
-                    break
-        
-        # 检查二维码区域
-        if cursor == "arrow":
-            qr_display_x = self.canvas_offset_x + self.qr_x * self.canvas_scale
-            qr_display_y = self.canvas_offset_y + self.qr_y * self.canvas_scale
-            qr_display_w = self.qr_w * self.canvas_scale
-            qr_display_h = self.qr_h * self.canvas_scale
-            
-            if (qr_display_x <= event.x <= qr_display_x + qr_display_w and
-                qr_display_y <= event.y <= qr_display_y + qr_display_h):
-                cursor = "fleur"
+        hit = self.hit_test(event.x, event.y)
+        if hit in ["tl", "br"]:
+            cursor = "size_nw_se"
+        elif hit in ["tr", "bl"]:
+            cursor = "size_ne_sw"
+        elif hit == "qr":
+            cursor = "fleur"
+        else:
+            cursor = "arrow"
         
-        self.canvas.configure(cursor=cursor)
+        # 光标没变时不重复设置
+        if cursor != self.current_cursor:
+            self.current_cursor = cursor
+            self.canvas.configure(cursor=cursor)
     
     def start_processing(self):
         self.progress['value'] = 0
@@ -1256,111 +1536,147 @@ class InteractiveQRPosterGenerator:
         thread.daemon = True
         thread.start()
 
+    def start_png_profile_measure(self):
+        """在当前设置下抽几个样本，试算各 PNG 压缩档位的编码耗时和大小"""
+        if not self.poster_img or not (self.qr_folder_str or self.payload_path):
+            messagebox.showwarning("警告", "请先选择海报和替换图片文件夹（或二维码清单）")
+            return
+        try:
+            job = self.build_batch_job()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        if self.payloads is not None:
+            total = len(self.payloads)
+        else:
+            total = len(self.qr_index) if self.qr_index is not None else None
+        
+        self.measure_png_btn.configure(state=tk.DISABLED)
+        self.status_label.configure(text="正在试算PNG压缩档位...", foreground="orange")
+        
+        def work():
+            try:
+                results = poster_engine.measure_png_profiles(job)
+                samples = next(iter(results.values()))["samples"]
+                text = f"{samples} 个样本的平均编码耗时和大小：\n\n" + poster_engine.format_png_profiles(results, total)
+                self.root.after(0, lambda: self.status_label.configure(text="试算完成", foreground="green"))
+                self.root.after(0, lambda: messagebox.showinfo("PNG压缩档位", text))
+            except Exception as ex:
+                error_msg = str(ex)
+                self.root.after(0, lambda: self.status_label.configure(text="❌ 试算失败", foreground="red"))
+                self.root.after(0, lambda: messagebox.showerror("错误", f"试算失败：{error_msg}"))
+            finally:
+                self.root.after(0, lambda: self.measure_png_btn.configure(state=tk.NORMAL))
+        
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    def start_packaging(self):
+        """把已有的输出文件夹并行打包为 ZIP（可分卷）"""
+        if not self.output_folder_str or not os.path.isdir(self.output_folder_str):
+            messagebox.showwarning("警告", "请先选择输出文件夹")
+            return
+        volume_text = self.archive_volume_var.get().strip()
+        try:
+            volume_size = poster_archive.parse_size(volume_text) if volume_text else None
+        except ValueError:
+            messagebox.showerror("错误", f"无法识别的分卷大小: {volume_text}")
+            return
+        
+        self.progress['value'] = 0
+        self.status_label.configure(text="正在打包...", foreground="orange")
+        self.package_btn.configure(state=tk.DISABLED)
+        
+        thread = threading.Thread(target=self.package_output_folder, args=(volume_size,))
+        thread.daemon = True
+        thread.start()
+    
+    def package_output_folder(self, volume_size):
+        try:
+            def on_progress(done, total):
+                self.root.after(0, lambda: (self.progress.configure(value=int(done / total * 100)),
+                                            self.status_label.configure(text=f"打包中 {done}/{total}")))
+            
+            volumes = poster_archive.build_zip_archive(
+                self.output_folder_str, max_workers=self.get_worker_count(), volume_size=volume_size,
+                progress_callback=on_progress)
+            summary = "已创建ZIP压缩包:\n" + "\n".join(volumes)
+            self.root.after(0, lambda: self.status_label.configure(text="✅ 打包完成!", foreground="green"))
+            self.root.after(0, lambda: messagebox.showinfo("完成", summary))
+        except Exception as ex:
+            error_msg = str(ex)
+            self.root.after(0, lambda: self.status_label.configure(text="❌ 打包失败", foreground="red"))
+            self.root.after(0, lambda: messagebox.showerror("错误", f"打包失败：{error_msg}"))
+        finally:
+            self.root.after(0, lambda: self.package_btn.configure(state=tk.NORMAL))
+            self.root.after(0, lambda: self.progress.configure(value=0))
+
+    def get_worker_count(self):
+        """读取并行数，留空或无效时返回 None（自动）"""
+        try:
+            value = int(self.worker_count_var.get())
+            return value if value > 0 else None
+        except ValueError:
+            return None
+
+    def build_batch_job(self):
+        """根据界面上的设置创建批量合成任务"""
+        return poster_engine.BatchJob(
+            self.poster_path_str, self.qr_folder_str, self.output_folder_str,
+            self.qr_x, self.qr_y, self.qr_w, self.qr_h,
+            output_format=self.output_format.get(),
+            jpeg_quality=self.quality_var.get(),
+            naming_pattern=self.get_naming_template(),
+            naming_start_number=self.naming_start_number.get(),
+            naming_prefix=self.naming_prefix.get(),
+            naming_suffix=self.naming_suffix.get(),
+            max_workers=self.get_worker_count(),
+            execution_mode=self.execution_mode.get(),
+            resume=self.resume_enabled.get(),
+            incremental=self.incremental_enabled.get(),
+            region_encoding=self.region_encoding_enabled.get(),
+            poster_image=self.poster_img,
+            recursive=self.recursive_scan.get(),
+            archive_format=self.get_archive_format(),
+            write_files=not (self.get_archive_format() and self.archive_only.get()),
+            deduplicate=self.dedup_enabled.get(),
+            payload_file=self.payload_path or None,
+            png_profile=self.png_profile.get()
+        )
+
+    def get_archive_format(self):
+        """界面选择的压缩包格式，不打包时返回 None"""
+        value = self.compress_option.get()
+        return None if value == "none" else value
+
     def process_images(self):
         error_msg = None
-        success_count = 0
         
         try:
-            qr_files = [f for f in os.listdir(self.qr_folder_str) 
-                    if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
-            
-            total = len(qr_files)
-            os.makedirs(self.output_folder_str, exist_ok=True)
+            job = self.build_batch_job()
             
-            output_format = self.output_format.get()
-            jpeg_quality = 95
+            def on_progress(current, total, rate, eta):
+                progress = int(current / total * 100)
+                self.root.after(0, self.update_progress, progress, current, total, rate, eta)
             
-            if output_format == "jpeg":
-                try:
-                    jpeg_quality = int(self.quality_var.get())
-                    jpeg_quality = max(1, min(100, jpeg_quality))
-                except ValueError:
-                    jpeg_quality = 95
-            
-            # 预处理
-            target_size = (int(self.qr_w), int(self.qr_h))
-            target_pos = (int(self.qr_x), int(self.qr_y))
-            
-            if output_format == "jpeg":
-                poster_base = self.poster_img.convert("RGB")
-            else:
-                poster_base = self.poster_img
-            
-            # 选择缩放算法
-            if output_format == "jpeg" and jpeg_quality < 85:
-                resample_method = Image.Resampling.BILINEAR
-            else:
-                resample_method = Image.Resampling.LANCZOS
-            
-            # ========== 多线程处理函数 ==========
-            def process_single_image(args):
-                i, qr_filename = args
-                try:
-                    qr_path = os.path.join(self.qr_folder_str, qr_filename)
-                    
-                    # base_name = os.path.splitext(qr_filename)[0]
-                    # if output_format == "png":
-                    #     output_filename = base_name + ".png"
-                    # else:
-                    #     output_filename = base_name + ".jpg"
-                    # 使用自定义命名规则生成文件名
-                    output_filename = self.generate_filename(qr_filename, i)
-
-                    output_path = os.path.join(self.output_folder_str, output_filename)
-                    
-                    # 加载和缩放
-                    qr = Image.open(qr_path)
-                    
-                    if qr.mode != "RGBA" and output_format == "png":
-                        qr = qr.convert("RGBA")
-                    elif qr.mode == "RGBA" and output_format == "jpeg":
-                        qr = qr.convert("RGB")
-                    
-                    qr_resized = qr.resize(target_size, resample_method)
-                    
-                    # 合成
-                    result = poster_base.copy()
-                    
-                    if output_format == "png" and qr_resized.mode == "RGBA":
-                        result.paste(qr_resized, target_pos, qr_resized)
-                    else:
-                        result.paste(qr_resized, target_pos)
-                    
-                    # 保存
-                    if output_format == "png":
-                        result.save(output_path, format='PNG', optimize=True)
-                    else:
-                        result.save(output_path, format='JPEG', quality=jpeg_quality, optimize=True)
-                    
-                    return True
-                    
-                except Exception as file_error:
-                    print(f"处理文件 {qr_filename} 时出错: {file_error}")
-                    return False
-            
-            # ========== 使用线程池并行处理 ==========
-            max_workers = min(multiprocessing.cpu_count(), 4)  # 最多4个线程
-            
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                futures = [executor.submit(process_single_image, (i, qr_filename)) 
-                        for i, qr_filename in enumerate(qr_files)]
-                
-                # 收集结果并更新进度
-                for i, future in enumerate(futures):
-                    if future.result():
-                        success_count += 1
-                    
-                    # 更新进度（每10个更新一次）
-                    if i % 10 == 0 or i == total - 1:
-                        progress = int((i + 1) / total * 100)
-                        self.root.after(0, self.update_progress, progress, i + 1, total)
+            result = poster_engine.run_batch(job, progress_callback=on_progress)
             
             # 显示完成信息
-            format_text = "PNG" if output_format == "png" else f"JPEG (质量{jpeg_quality})"
+            format_text = f"JPEG (质量{job.jpeg_quality})" if job.output_format == "jpeg" else job.output_format.upper()
+            summary = f"已成功合成 {result.success_count}/{result.total} 张图片！\n输出格式: {format_text}"
+            if result.worker_count < result.requested_workers:
+                summary += f"\n受可用内存限制，并行数从 {result.requested_workers} 降为 {result.worker_count}"
+            if result.skipped:
+                summary += f"\n其中 {result.skipped} 张上次已完成，已跳过"
+            if result.removed:
+                summary += f"\n已删除 {result.removed} 个不再对应任何输入的输出"
+            if result.deduplicated:
+                summary += f"\n其中 {result.deduplicated} 张与其它图片内容相同，直接复用了结果"
+            if result.archive_path:
+                summary += f"\n压缩包: {result.archive_path}"
             self.root.after(0, lambda: self.status_label.configure(text="✅ 处理完成!", foreground="green"))
-            self.root.after(0, lambda: messagebox.showinfo("完成", 
-                f"已成功合成 {success_count}/{total} 张图片！\n输出格式: {format_text}"))
+            self.root.after(0, lambda: self.show_run_report(summary, result.report, result.report_path))
             
         except Exception as ex:
             error_msg = str(ex)
@@ -1372,38 +1688,53 @@ class InteractiveQRPosterGenerator:
             self.root.after(0, lambda: self.progress.configure(value=0))
 
     
-    def update_progress(self, progress_value, current, total):
-        """更新进度条和状态"""
-        self.progress.configure(value=progress_value)
-        self.status_label.configure(text=f"处理中 {current}/{total}")
+    def show_run_report(self, summary, report, report_path):
+        """批量合成结束后的摘要面板：结果统计和每个阶段的耗时分布"""
+        panel = tk.Toplevel(self.root)
+        panel.title("完成")
+        panel.transient(self.root)
+        frame = ttk.Frame(panel, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(frame, text=summary, justify=tk.LEFT).pack(anchor=tk.W)
+        
+        if report["stages"]:
+            columns = ("count", "p50", "p95", "max", "share")
+            headings = ("次数", "p50 (ms)", "p95 (ms)", "最大 (ms)", "占比")
+            table = ttk.Treeview(frame, columns=columns, height=len(report["stages"]))
+            table.heading("#0", text="阶段")
+            table.column("#0", width=90)
+            for column, heading in zip(columns, headings):
+                table.heading(column, text=heading)
+                table.column(column, width=80, anchor=tk.E)
+            for stage, count, p50, p95, maximum, share in poster_metrics.summary_rows(report):
+                table.insert("", tk.END, text=stage,
+                             values=(count, f"{p50:.1f}", f"{p95:.1f}", f"{maximum:.1f}", f"{share:.1f}%"))
+            table.pack(fill=tk.X, pady=(10, 5))
+        
+        ttk.Label(frame, text=f"读取 {report['bytes_read'] / 1024 / 1024:.1f} MB  "
+                              f"写入 {report['bytes_written'] / 1024 / 1024:.1f} MB  "
+                              f"{report['images_per_second']:.1f} 张/秒  "
+                              f"用时 {poster_engine.format_duration(report['elapsed'])}").pack(anchor=tk.W)
+        ttk.Label(frame, text=f"运行报告: {report_path}", font=("Arial", 8),
+                  foreground="#666").pack(anchor=tk.W, pady=(5, 0))
+        ttk.Button(frame, text="确定", command=panel.destroy).pack(anchor=tk.E, pady=(10, 0))
     
-    def compress_output(self):
-        """压缩输出文件夹"""
-        try:
-            compress_type = self.compress_option.get()
-            output_folder = self.output_folder_str
-            
-            if compress_type == "zip":
-                zip_path = output_folder + ".zip"
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, dirs, files in os.walk(output_folder):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, os.path.dirname(output_folder))
-                            zipf.write(file_path, arcname)
-                print(f"已创建ZIP压缩包: {zip_path}")
-            
-            elif compress_type == "gzip":
-                tar_path = output_folder + ".tar.gz"
-                with tarfile.open(tar_path, "w:gz") as tar:
-                    tar.add(output_folder, arcname=os.path.basename(output_folder))
-                print(f"已创建TAR.GZ压缩包: {tar_path}")
-                
-        except Exception as e:
-            print(f"压缩时出错: {e}")
+    def update_progress(self, progress_value, current, total, rate=0.0, eta=None):
+        """更新进度条和状态（含吞吐量和预计剩余时间）"""
+        self.progress.configure(value=progress_value)
+        eta_text = poster_engine.format_duration(eta) if eta is not None else "--:--"
+        self.status_label.configure(text=f"处理中 {current}/{total}  {rate:.1f}张/秒  剩余{eta_text}")
 
 
 if __name__ == "__main__":
+    # 打包后的程序启动子进程时需要
+    multiprocessing.freeze_support()
+    
+    # 带参数启动时走命令行批处理，不创建任何窗口
+    if len(sys.argv) > 1:
+        sys.exit(poster_engine.main())
+    
     root = tk.Tk()
     app = InteractiveQRPosterGenerator(root)
     root.mainloop()
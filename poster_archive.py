@@ -0,0 +1,381 @@
+"""
+批量输出的打包
+
+合成结果在编码完成后直接写入压缩包，不必先落盘再整体读一遍打包。
+PNG/JPEG 本身已经压缩过，ZIP 中按存储（不压缩）方式写入。
+
+已经在磁盘上的输出文件夹用 build_zip_archive 并行打包：多个线程分别压缩条目，
+一个写入者按固定顺序把压缩好的数据追加到 ZIP 中，可以按大小分卷。
+也可以直接运行：
+
+    python poster_archive.py 输出文件夹 --volume-size 2G
+"""
+import io
+import os
+import sys
+import time
+import zlib
+import struct
+import fnmatch
+import tarfile
+import zipfile
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# zip：ZIP 压缩包；tar：不压缩的 tar；tar.gz：gzip 压缩的 tar
+ARCHIVE_FORMATS = ("zip", "tar", "tar.gz")
+ARCHIVE_EXTENSIONS = {"zip": ".zip", "tar": ".tar", "tar.gz": ".tar.gz"}
+# 已压缩的格式，再用 deflate 压缩几乎没有收益
+PRECOMPRESSED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".gif", ".zip", ".gz")
+# 打包文件夹时默认跳过的文件（通配符）：批处理的任务清单、运行报告、性能分析结果，
+# 以及中断时残留的临时文件
+PACKAGING_EXCLUDE = (".poster_manifest.jsonl", ".poster_report.json", ".poster_profile.*", "*.tmp")
+
+
+def default_archive_path(output_folder, archive_format):
+    """默认的压缩包路径：与输出文件夹同名，放在它旁边"""
+    return os.path.normpath(output_folder) + ARCHIVE_EXTENSIONS[archive_format]
+
+
+class ArchiveSink:
+    """
+    压缩包写入端
+
+    add 可以在多个线程中调用，条目按调用顺序依次写入；
+    压缩包内的路径为 "输出文件夹名/文件名"，与打包整个输出文件夹的结果一致。
+    """
+
+    def __init__(self, path, archive_format="zip", root_name=""):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"不支持的压缩包格式: {archive_format}")
+        self.path = path
+        self.archive_format = archive_format
+        self.root_name = root_name
+        self.entry_count = 0
+        self.bytes_written = 0  # 写入的条目原始大小之和
+        self._lock = threading.Lock()
+        if archive_format == "zip":
+            self._archive = zipfile.ZipFile(path, "w", allowZip64=True)
+        else:
+            self._archive = tarfile.open(path, "w:gz" if archive_format == "tar.gz" else "w")
+
+    @classmethod
+    def for_output_folder(cls, output_folder, archive_format, path=None):
+        return cls(path or default_archive_path(output_folder, archive_format), archive_format,
+                   os.path.basename(os.path.normpath(output_folder)))
+
+    def arcname(self, filename):
+        return f"{self.root_name}/{filename}" if self.root_name else filename
+
+    def add(self, filename, data):
+        """写入一个条目"""
+        name = self.arcname(filename)
+        with self._lock:
+            if self.archive_format == "zip":
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                if filename.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                self._archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                self._archive.addfile(info, io.BytesIO(data))
+            self.entry_count += 1
+            self.bytes_written += len(data)
+
+    def add_duplicate(self, filename, original_filename, data):
+        """
+        写入一个与已有条目内容相同的条目
+
+        tar 中写成指向原条目的硬链接，不重复存储数据；ZIP 没有链接条目，直接再写一份。
+        """
+        if self.archive_format == "zip":
+            self.add(filename, data)
+            return
+        info = tarfile.TarInfo(self.arcname(filename))
+        info.type = tarfile.LNKTYPE
+        info.linkname = self.arcname(original_filename)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        with self._lock:
+            self._archive.addfile(info)
+            self.entry_count += 1
+
+    def add_file(self, filename, path):
+        """把磁盘上已有的文件写入压缩包（断点续传跳过的文件）"""
+        with open(path, "rb") as f:
+            self.add(filename, f.read())
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+
+# ========== 并行打包 ==========
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+# 压缩后至少要比原始数据小这么多才保存压缩结果，否则按存储方式写入
+MIN_COMPRESSION_SAVING = 0.05
+
+
+def _dos_date_time(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # ZIP 时间最早为 1980 年
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class PreparedEntry:
+    """已经压缩好的 ZIP 条目，由工作线程生成，写入者直接追加"""
+
+    def __init__(self, arcname, data, method, crc, size, mtime):
+        self.arcname = arcname
+        self.data = data
+        self.method = method  # zipfile.ZIP_STORED / zipfile.ZIP_DEFLATED
+        self.crc = crc
+        self.size = size  # 原始大小
+        self.mtime = mtime
+
+
+def prepare_entry(path, arcname, level=6):
+    """
+    读取并压缩一个文件（在工作线程中执行，zlib 计算时会释放 GIL）
+
+    已压缩格式直接存储；其它文件压缩后节省不到 MIN_COMPRESSION_SAVING 时也改为存储。
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    crc = zlib.crc32(raw)
+    mtime = os.path.getmtime(path)
+    if level > 0 and not arcname.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(raw) + compressor.flush()
+        if len(data) <= len(raw) * (1 - MIN_COMPRESSION_SAVING):
+            return PreparedEntry(arcname, data, zipfile.ZIP_DEFLATED, crc, len(raw), mtime)
+    return PreparedEntry(arcname, raw, zipfile.ZIP_STORED, crc, len(raw), mtime)
+
+
+class ZipVolumeWriter:
+    """
+    把预先压缩好的条目写成一个 ZIP 文件（只在写入线程中使用）
+
+    大小或偏移超过 4GB、条目超过 65535 个时自动使用 ZIP64 扩展。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._file = open(path, "wb")
+        self._central = []
+        self._central_size = 0  # 中央目录大小的上限估计
+
+    @property
+    def entry_count(self):
+        return len(self._central)
+
+    @staticmethod
+    def entry_overhead(entry):
+        """一个条目在本地头和中央目录中占用的最大字节数（含 ZIP64 扩展）"""
+        return 30 + 20 + 46 + 28 + 2 * len(entry.arcname.encode("utf-8"))
+
+    @property
+    def projected_size(self):
+        """现在结束时文件的最大大小（含中央目录和 ZIP64 结束记录）"""
+        return self.offset + self._central_size + 56 + 20 + 22
+
+    def add(self, entry):
+        name = entry.arcname.encode("utf-8")
+        dos_time, dos_date = _dos_date_time(entry.mtime)
+        zip64 = entry.size >= ZIP64_LIMIT or len(entry.data) >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, entry.size, len(entry.data)) if zip64 else b""
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 45 if zip64 else 20, 0x800, entry.method,
+            dos_time, dos_date, entry.crc,
+            ZIP64_LIMIT if zip64 else len(entry.data), ZIP64_LIMIT if zip64 else entry.size,
+            len(name), len(extra))
+        self._file.write(header + name + extra)
+        self._file.write(entry.data)
+        self._central.append((name, entry, dos_time, dos_date, self.offset))
+        self._central_size += 46 + 28 + len(name)
+        self.offset += len(header) + len(name) + len(extra) + len(entry.data)
+
+    def close(self):
+        central_offset = self.offset
+        for name, entry, dos_time, dos_date, offset in self._central:
+            # ZIP64 扩展字段只包含超出 32 位的那几项，顺序固定
+            fields = []
+            size, compressed = entry.size, len(entry.data)
+            if size >= ZIP64_LIMIT:
+                fields.append(size)
+                size = ZIP64_LIMIT
+            if compressed >= ZIP64_LIMIT:
+                fields.append(compressed)
+                compressed = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = struct.pack(f"<HH{len(fields)}Q", 1, len(fields) * 8, *fields) if fields else b""
+            version = 45 if fields else 20
+            record = struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, 0x800, entry.method,
+                dos_time, dos_date, entry.crc, compressed, size,
+                len(name), len(extra), 0, 0, 0, 0o644 << 16, offset)
+            self._file.write(record + name + extra)
+            self.offset += len(record) + len(name) + len(extra)
+
+        central_size = self.offset - central_offset
+        count = len(self._central)
+        if count > ZIP_MAX_ENTRIES or central_offset >= ZIP64_LIMIT or central_size >= ZIP64_LIMIT:
+            zip64_end = self.offset
+            self._file.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0,
+                                         count, count, central_size, central_offset))
+            self._file.write(struct.pack("<IIQI", 0x07064b50, 0, zip64_end, 1))
+            # 超出范围的字段写成全 1，读取方改用 ZIP64 记录
+            short_count = count if count <= ZIP_MAX_ENTRIES else 0xFFFF
+            self._file.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, short_count, short_count,
+                                         min(central_size, ZIP64_LIMIT), min(central_offset, ZIP64_LIMIT), 0))
+        else:
+            self._file.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count,
+                                         central_size, central_offset, 0))
+        self._file.close()
+
+
+def volume_path(archive_path, number):
+    """分卷文件名：out.zip -> out.part001.zip"""
+    base, extension = os.path.splitext(archive_path)
+    return f"{base}.part{number:03d}{extension}"
+
+
+def collect_folder_files(folder, exclude=PACKAGING_EXCLUDE):
+    """
+    按固定顺序列出文件夹中的文件，返回 [(路径, 压缩包内路径)]，压缩包内路径以文件夹名开头
+
+    Args:
+        exclude: 跳过的文件名通配符
+    """
+    folder = os.path.normpath(folder)
+    parent = os.path.dirname(folder)
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+                continue
+            path = os.path.join(root, name)
+            files.append((path, os.path.relpath(path, parent).replace(os.sep, "/")))
+    return files
+
+
+def build_zip_archive(folder, archive_path=None, max_workers=None, level=6,
+                      volume_size=None, exclude=PACKAGING_EXCLUDE, progress_callback=None):
+    """
+    并行打包文件夹
+
+    工作线程读取并压缩条目，写入者按文件顺序依次追加，输出与线程数无关。
+    在途条目数限制为线程数×2，内存占用与文件夹大小无关。
+
+    Args:
+        volume_size: 可选，每卷的最大字节数；超过时开始新的一卷，每卷都是独立完整的 ZIP
+            （单个条目比卷还大时独占一卷）
+        exclude: 不打包的文件名通配符，默认跳过批处理自己的记录文件和临时文件
+        progress_callback: 可选，callback(done, total)
+
+    Returns:
+        生成的 ZIP 文件路径列表
+    """
+    archive_path = archive_path or default_archive_path(folder, "zip")
+    files = collect_folder_files(folder, exclude)
+    workers = max_workers or os.cpu_count() or 1
+
+    volumes = []
+    writer = None
+
+    def write(entry):
+        nonlocal writer
+        entry_bytes = ZipVolumeWriter.entry_overhead(entry) + len(entry.data)
+        if writer is not None and volume_size and writer.entry_count and \
+                writer.projected_size + entry_bytes > volume_size:
+            writer.close()
+            writer = None
+        if writer is None:
+            path = volume_path(archive_path, len(volumes) + 1) if volume_size else archive_path
+            writer = ZipVolumeWriter(path)
+            volumes.append(path)
+        writer.add(entry)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tasks = iter(files)
+            pending = deque()
+
+            def submit_next():
+                for path, arcname in tasks:
+                    pending.append(executor.submit(prepare_entry, path, arcname, level))
+                    return True
+                return False
+
+            while len(pending) < workers * 2 and submit_next():
+                pass
+            done = 0
+            while pending:
+                # 按提交顺序取结果，保证条目顺序稳定
+                write(pending.popleft().result())
+                submit_next()
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(files))
+    finally:
+        if writer is None and not volumes:
+            writer = ZipVolumeWriter(archive_path)
+            volumes.append(archive_path)
+        if writer is not None:
+            writer.close()
+    return volumes
+
+
+def parse_size(text):
+    """把 500M、2G 之类的大小转换为字节数"""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="poster_archive", description="并行打包输出文件夹为 ZIP")
+    parser.add_argument("folder", help="要打包的文件夹")
+    parser.add_argument("--output", default=None, help="ZIP 路径（默认：文件夹名.zip）")
+    parser.add_argument("--workers", type=int, default=None, help="压缩线程数（默认：CPU核数）")
+    parser.add_argument("--level", type=int, default=6, help="deflate 压缩级别 0-9（0 表示全部存储）")
+    parser.add_argument("--volume-size", default=None, help="分卷大小，如 700M、2G")
+    args = parser.parse_args(argv)
+
+    try:
+        volume_size = parse_size(args.volume_size) if args.volume_size else None
+    except ValueError:
+        print(f"参数错误: 无法识别的分卷大小 {args.volume_size}", file=sys.stderr)
+        return 2
+
+    def report(done, total):
+        print(f"\r打包中 {done}/{total}", end="", flush=True)
+
+    volumes = build_zip_archive(args.folder, args.output, args.workers, args.level,
+                                volume_size, progress_callback=report)
+    print()
+    for path in volumes:
+        print(f"已创建ZIP压缩包: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+"""
+海报批量合成用的专用编码器
+
+批量输出的每张图片都是同一张海报，只有二维码所在的那一条区域不同。
+这里的编码器把不变部分只压缩一次，每张输出只重新编码变化的区域，
+再按格式规范把各段数据拼接成完整的文件。
+
+印刷尺寸的海报用分条写入器：按行条依次送入、边编码边写出，
+内存中只有当前这一条，而不是整张图片。
+"""
+import io
+import re
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK_SIZE = 1024 * 1024  # 预先生成的 IDAT 块最大长度
+ADLER_BASE = 65521
+RST_MARKER = re.compile(rb"\xff[\xd0-\xd7]")
+
+
+# ========== PNG 编码档位 ==========
+# 行滤波始终由 Pillow 逐行自适应选择，档位调整的是之后的 zlib 压缩：
+# compress_level: zlib 压缩级别；strategies: zlib 策略（Pillow 的 compress_type），
+# 有多个时逐个尝试并保留最小的结果；optimize: Pillow 的 optimize 选项。
+# smallest 与之前固定使用的 optimize=True 完全相同（Pillow 对 PNG 默认使用 Z_FILTERED）。
+PNG_PROFILES = {
+    "fastest": {"compress_level": 1, "strategies": (zlib.Z_RLE,), "optimize": False},
+    "balanced": {"compress_level": 6, "strategies": (zlib.Z_DEFAULT_STRATEGY,), "optimize": False},
+    "smallest": {"compress_level": 9, "strategies": (zlib.Z_FILTERED,), "optimize": True},
+    "archival": {"compress_level": 9, "strategies": (zlib.Z_FILTERED, zlib.Z_DEFAULT_STRATEGY, zlib.Z_RLE),
+                 "optimize": True},
+}
+DEFAULT_PNG_PROFILE = "smallest"
+
+
+def encode_png(image, profile=DEFAULT_PNG_PROFILE):
+    """按档位把整张图片编码为 PNG 字节"""
+    settings = PNG_PROFILES[profile]
+    best = None
+    for strategy in settings["strategies"]:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=settings["compress_level"], compress_type=strategy,
+                   optimize=settings["optimize"])
+        if best is None or buffer.tell() < len(best):
+            best = buffer.getvalue()
+    return best
+
+
+def png_chunk(chunk_type, data):
+    """生成一个带 CRC 的 PNG 块"""
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def iter_png_chunks(data):
+    """依次返回 PNG 文件中的 (块类型, 块数据)"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("不是 PNG 数据")
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        chunk_type = data[pos + 4:pos + 8]
+        yield chunk_type, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def adler32_combine(adler1, adler2, len2):
+    """合并两段数据的 Adler-32（与 zlib 的 adler32_combine 相同）"""
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - rem
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum2 >= (ADLER_BASE << 1):
+        sum2 -= (ADLER_BASE << 1)
+    if sum2 >= ADLER_BASE:
+        sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def png_filtered_rows(image, icc_profile=None):
+    """
+    用 Pillow 的自适应滤波得到图片的 PNG 滤波后行数据
+
+    第一行改写为 None 滤波（直接存原始像素），使这一段不依赖上一段的最后一行，
+    可以和任意其它段首尾相接。
+
+    Returns:
+        (header_chunks, filtered): IDAT 之前的块列表 [(类型, 数据)]，以及滤波后的字节
+    """
+    if image.mode not in ("RGBA", "RGB", "LA", "L"):
+        raise ValueError(f"不支持的图片模式: {image.mode}")
+
+    # compress_level=0 只做滤波和存储，几乎不花压缩时间
+    buffer = io.BytesIO()
+    if icc_profile:
+        image.save(buffer, format="PNG", compress_level=0, icc_profile=icc_profile)
+    else:
+        image.save(buffer, format="PNG", compress_level=0)
+
+    header_chunks = []
+    idat = []
+    for chunk_type, data in iter_png_chunks(buffer.getvalue()):
+        if chunk_type == b"IDAT":
+            idat.append(data)
+        elif not idat and chunk_type != b"IEND":
+            header_chunks.append((chunk_type, data))
+    filtered = zlib.decompress(b"".join(idat))
+
+    stride = len(filtered) // image.height
+    first_row = image.crop((0, 0, image.width, 1)).tobytes()
+    filtered = b"\x00" + first_row + filtered[stride:]
+    return header_chunks, filtered
+
+
+class _DeflateSegment:
+    """一段独立压缩的 raw deflate 数据及其 Adler-32"""
+
+    def __init__(self, raw, level, final, strategy=zlib.Z_DEFAULT_STRATEGY):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, strategy)
+        self.data = compressor.compress(raw) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        self.adler = zlib.adler32(raw)
+        self.length = len(raw)
+
+
+def _idat_chunks(data):
+    return b"".join(png_chunk(b"IDAT", data[i:i + IDAT_CHUNK_SIZE])
+                    for i in range(0, len(data), IDAT_CHUNK_SIZE))
+
+
+class PngRegionEncoder:
+    """
+    只重新压缩变化行的 PNG 编码器
+
+    海报在 band_top 之上和 band_bottom 之下的行对每张输出都相同，
+    这两段在创建时各压缩一次；每张输出只压缩 [band_top, band_bottom) 这一条，
+    各段 deflate 数据以 Z_SYNC_FLUSH 结尾、字节对齐后直接拼接，
+    最后用 adler32_combine 算出整个数据流的校验和。
+    """
+
+    def __init__(self, poster, band_top, band_bottom, compress_level=9, strategy=zlib.Z_DEFAULT_STRATEGY):
+        if not 0 <= band_top < band_bottom <= poster.height:
+            raise ValueError("变化区域超出海报范围")
+        self.width, self.height = poster.size
+        self.mode = poster.mode
+        self.band_top = band_top
+        self.band_bottom = band_bottom
+        self.compress_level = compress_level
+        self.strategy = strategy
+        self.has_bottom = band_bottom < self.height
+
+        # 文件头：沿用 Pillow 生成的块（含 ICC 配置），把 IHDR 的高度改为整图高度
+        top_image = poster.crop((0, 0, self.width, max(band_top, 1)))
+        header_chunks, top_rows = png_filtered_rows(top_image, poster.info.get("icc_profile"))
+        header = PNG_SIGNATURE
+        for chunk_type, data in header_chunks:
+            if chunk_type == b"IHDR":
+                data = data[:4] + struct.pack(">I", self.height) + data[8:]
+            header += png_chunk(chunk_type, data)
+
+        self.adler = 1  # 空数据的 Adler-32
+        prefix = zlib.compress(b"", compress_level)[:2]  # zlib 头
+        if band_top > 0:
+            top = _DeflateSegment(top_rows, compress_level, final=False, strategy=strategy)
+            prefix += top.data
+            self.adler = top.adler
+        self.prefix = header + _idat_chunks(prefix)
+
+        self.suffix = b""
+        self.suffix_adler = 1
+        self.suffix_length = 0
+        if self.has_bottom:
+            _, bottom_rows = png_filtered_rows(poster.crop((0, band_bottom, self.width, self.height)))
+            bottom = _DeflateSegment(bottom_rows, compress_level, final=True, strategy=strategy)
+            self.suffix = _idat_chunks(bottom.data)
+            self.suffix_adler = bottom.adler
+            self.suffix_length = bottom.length
+
+    def encode(self, band):
+        """
+        编码一张输出
+
+        Args:
+            band: 该输出中 [band_top, band_bottom) 行的图片，模式和宽度与海报相同
+
+        Returns:
+            完整的 PNG 文件字节
+        """
+        if band.size != (self.width, self.band_bottom - self.band_top) or band.mode != self.mode:
+            raise ValueError("区域图片的尺寸或模式与海报不一致")
+
+        _, band_rows = png_filtered_rows(band)
+        segment = _DeflateSegment(band_rows, self.compress_level, final=not self.has_bottom, strategy=self.strategy)
+
+        adler = adler32_combine(self.adler, segment.adler, segment.length)
+        if self.has_bottom:
+            adler = adler32_combine(adler, self.suffix_adler, self.suffix_length)
+
+        return b"".join([
+            self.prefix,
+            png_chunk(b"IDAT", segment.data),
+            self.suffix,
+            png_chunk(b"IDAT", struct.pack(">I", adler)),
+            png_chunk(b"IEND", b""),
+        ])
+
+
+def _sof_offset(header):
+    """JPEG 头中 SOF0 段数据的起始位置"""
+    pos = 2
+    while pos + 4 <= len(header):
+        marker = header[pos + 1]
+        length, = struct.unpack(">H", header[pos + 2:pos + 4])
+        if marker == 0xC0:
+            return pos + 4
+        pos += 2 + length
+    raise ValueError("没有找到 SOF0 段")
+
+
+def split_jpeg_scan(data):
+    """
+    拆分基线 JPEG
+
+    Returns:
+        (header, intervals, sof): SOS 段（含）之前的全部字节、按 RST 标记拆开的熵编码段列表、
+        SOF 段数据（用于读取尺寸和采样因子）
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("不是 JPEG 数据")
+    pos = 2
+    sof = None
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("JPEG 段结构错误")
+        marker = data[pos + 1]
+        length, = struct.unpack(">H", data[pos + 2:pos + 4])
+        if marker == 0xC0:
+            sof = data[pos + 4:pos + 2 + length]
+        elif 0xC1 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise ValueError("只支持基线 JPEG")
+        if marker == 0xDA:
+            header_end = pos + 2 + length
+            if not data.endswith(b"\xff\xd9"):
+                raise ValueError("JPEG 数据不完整")
+            return data[:header_end], RST_MARKER.split(data[header_end:-2]), sof
+        pos += 2 + length
+    raise ValueError("没有找到图像数据")
+
+
+class JpegRegionEncoder:
+    """
+    只重新编码二维码所在 MCU 行的 JPEG 编码器
+
+    海报用标准 Huffman 表、每个 MCU 行一个重启间隔（RST 标记）编码一次。
+    重启间隔之间互不依赖（DC 预测在 RST 处归零），同一行像素编码出的字节完全相同，
+    所以每张输出只需编码覆盖二维码、对齐到 MCU 网格的那几行，
+    替换对应的重启间隔并重新编号 RST 标记即可。
+    输出与整张图用同样参数编码的结果逐字节相同，二维码以外的区域没有任何额外损失。
+    """
+
+    def __init__(self, poster, qr_top, qr_bottom, quality=95):
+        if poster.mode != "RGB":
+            raise ValueError("JPEG 区域编码需要 RGB 海报")
+        self.width, self.height = poster.size
+        self.quality = quality
+
+        header, intervals, sof = split_jpeg_scan(self._encode(poster, poster.info.get("icc_profile")))
+        self.header = header
+        self.intervals = intervals
+
+        # MCU 高度 = 最大垂直采样因子 × 8
+        components = sof[5]
+        max_v = max(sof[6 + i * 3 + 1] & 0x0F for i in range(components))
+        self.mcu_height = max_v * 8
+        if len(intervals) != -(-self.height // self.mcu_height):
+            raise ValueError("重启间隔数量与 MCU 行数不一致")
+
+        qr_top = min(max(0, qr_top), self.height - 1)
+        qr_bottom = max(min(self.height, qr_bottom), qr_top + 1)
+        self.band_top = qr_top // self.mcu_height * self.mcu_height
+        self.band_bottom = min(self.height, -(-qr_bottom // self.mcu_height) * self.mcu_height)
+        self.first_row = self.band_top // self.mcu_height
+        self.last_row = -(-self.band_bottom // self.mcu_height)
+
+    def _encode(self, image, icc_profile=None):
+        buffer = io.BytesIO()
+        options = {"quality": self.quality, "restart_marker_rows": 1}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        image.save(buffer, format="JPEG", **options)
+        return buffer.getvalue()
+
+    def encode(self, band):
+        """
+        编码一张输出
+
+        Args:
+            band: 该输出中 [band_top, band_bottom) 行的 RGB 图片
+
+        Returns:
+            完整的 JPEG 文件字节
+        """
+        if band.size != (self.width, self.band_bottom - self.band_top) or band.mode != "RGB":
+            raise ValueError("区域图片的尺寸或模式与海报不一致")
+
+        _, band_intervals, _ = split_jpeg_scan(self._encode(band))
+        if len(band_intervals) != self.last_row - self.first_row:
+            raise ValueError("区域编码的重启间隔数量不正确")
+
+        intervals = self.intervals[:self.first_row] + band_intervals + self.intervals[self.last_row:]
+        parts = [self.header]
+        for i, interval in enumerate(intervals):
+            if i:
+                parts.append(bytes((0xFF, 0xD0 + (i - 1) % 8)))
+            parts.append(interval)
+        parts.append(b"\xff\xd9")
+        return b"".join(parts)
+
+
+# ========== 分条写入器 ==========
+# 用法相同：writer = XxxStripWriter(out, width, height, ...)；按从上到下的顺序多次 write(strip)；最后 close()。
+# 除最后一条外每条的行数必须相同（JPEG 还要是 MCU 高度的整数倍）。
+
+class PngStripWriter:
+    """
+    分条写入 PNG
+
+    每条用 Pillow 的自适应滤波得到滤波后的行，送进同一个 zlib 压缩流，IDAT 攒够一块就写出。
+    """
+
+    def __init__(self, out, width, height, mode="RGBA", icc_profile=None, compress_level=9,
+                 strategy=zlib.Z_DEFAULT_STRATEGY):
+        self.out = out
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.icc_profile = icc_profile
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 8, strategy)
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, strip):
+        if strip.size[0] != self.width or strip.mode != self.mode:
+            raise ValueError("条带的宽度或模式与图片不一致")
+        header_chunks, filtered = png_filtered_rows(strip, self.icc_profile if not self.rows_written else None)
+        if not self.rows_written:
+            self.out.write(PNG_SIGNATURE)
+            for chunk_type, data in header_chunks:
+                if chunk_type == b"IHDR":
+                    data = data[:4] + struct.pack(">I", self.height) + data[8:]
+                self.out.write(png_chunk(chunk_type, data))
+        self.rows_written += strip.height
+        self._emit(self._compressor.compress(filtered))
+
+    def _emit(self, data, final=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= IDAT_CHUNK_SIZE or (final and self._pending_size):
+            self.out.write(png_chunk(b"IDAT", b"".join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError("写入的行数与图片高度不一致")
+        self._emit(self._compressor.flush(), final=True)
+        self.out.write(png_chunk(b"IEND", b""))
+
+
+class JpegStripWriter:
+    """
+    分条写入基线 JPEG
+
+    原理与 JpegRegionEncoder 相同：每条用标准 Huffman 表、每个 MCU 行一个重启间隔单独编码，
+    各条的重启间隔直接首尾相接并统一重新编号；文件头取自第一条，把 SOF 中的高度改为整图高度。
+    """
+
+    def __init__(self, out, width, height, quality=95, icc_profile=None):
+        self.out = out
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.icc_profile = icc_profile
+        self.rows_written = 0
+        self._intervals = 0
+        self._mcu_rows = None
+
+    def write(self, strip):
+        if strip.size[0] != self.width or strip.mode != "RGB":
+            raise ValueError("条带的宽度或模式与图片不一致")
+        buffer = io.BytesIO()
+        options = {"quality": self.quality, "restart_marker_rows": 1}
+        if self.icc_profile and not self.rows_written:
+            options["icc_profile"] = self.icc_profile
+        strip.save(buffer, format="JPEG", **options)
+        header, intervals, sof = split_jpeg_scan(buffer.getvalue())
+
+        if not self.rows_written:
+            offset = _sof_offset(header)
+            header = header[:offset + 1] + struct.pack(">H", self.height) + header[offset + 3:]
+            self.out.write(header)
+            self._mcu_rows = max(sof[6 + i * 3 + 1] & 0x0F for i in range(sof[5])) * 8
+        elif self.rows_written % self._mcu_rows:
+            raise ValueError("只有最后一条的行数可以不是 MCU 高度的整数倍")
+
+        for interval in intervals:
+            if self._intervals:
+                self.out.write(bytes((0xFF, 0xD0 + (self._intervals - 1) % 8)))
+            self.out.write(interval)
+            self._intervals += 1
+        self.rows_written += strip.height
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError("写入的行数与图片高度不一致")
+        self.out.write(b"\xff\xd9")
+
+
+class TiffStripWriter:
+    """
+    分条写入 TIFF（每条一个 Deflate 压缩的 strip）
+
+    条带数据依次写出，IFD 写在文件末尾，最后回到文件头填入 IFD 的位置，所以 out 必须可以 seek。
+    """
+
+    def __init__(self, out, width, height, mode="RGBA", icc_profile=None, compress_level=6):
+        if mode not in ("RGB", "RGBA"):
+            raise ValueError(f"TIFF 分条写入不支持的模式: {mode}")
+        self.out = out
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.icc_profile = icc_profile
+        self.compress_level = compress_level
+        self.rows_written = 0
+        self.rows_per_strip = None
+        self._start = out.tell()
+        self._offsets = []
+        self._byte_counts = []
+        out.write(b"II*\x00\x00\x00\x00\x00")  # 小端，IFD 位置稍后填入
+
+    def _tell(self):
+        return self.out.tell() - self._start
+
+    def write(self, strip):
+        if strip.size[0] != self.width or strip.mode != self.mode:
+            raise ValueError("条带的宽度或模式与图片不一致")
+        if self.rows_per_strip is None:
+            self.rows_per_strip = strip.height
+        elif self.rows_written % self.rows_per_strip:
+            raise ValueError("只有最后一条的行数可以不同")
+        data = zlib.compress(strip.tobytes(), self.compress_level)
+        self._offsets.append(self._tell())
+        self._byte_counts.append(len(data))
+        self.out.write(data)
+        if len(data) % 2:
+            self.out.write(b"\x00")  # 保持字对齐
+        self.rows_written += strip.height
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError("写入的行数与图片高度不一致")
+        samples = len(self.mode)
+        SHORT, LONG, UNDEFINED = 3, 4, 7
+        tags = [
+            (256, LONG, [self.width]),
+            (257, LONG, [self.height]),
+            (258, SHORT, [8] * samples),
+            (259, SHORT, [8]),  # Adobe Deflate
+            (262, SHORT, [2]),  # RGB
+            (273, LONG, self._offsets),
+            (277, SHORT, [samples]),
+            (278, LONG, [self.rows_per_strip or self.height]),
+            (279, LONG, self._byte_counts),
+            (284, SHORT, [1]),
+        ]
+        if self.mode == "RGBA":
+            tags.append((338, SHORT, [2]))  # 非预乘 alpha
+        if self.icc_profile:
+            tags.append((34675, UNDEFINED, self.icc_profile))
+
+        # 超过 4 字节的值放在 IFD 之后
+        ifd_offset = self._tell()
+        if ifd_offset >= 1 << 32:
+            raise ValueError("TIFF 超过 4GB")
+        extra_offset = ifd_offset + 2 + len(tags) * 12 + 4
+        entries = b""
+        extra = b""
+        for tag, field_type, values in tags:
+            if field_type == UNDEFINED:
+                payload = bytes(values)
+            else:
+                payload = struct.pack("<%d%s" % (len(values), "H" if field_type == SHORT else "I"), *values)
+            if len(payload) <= 4:
+                value = payload.ljust(4, b"\x00")
+            else:
+                value = struct.pack("<I", extra_offset + len(extra))
+                extra += payload + (b"\x00" if len(payload) % 2 else b"")
+            entries += struct.pack("<HHI", tag, field_type, len(values)) + value
+        self.out.write(struct.pack("<H", len(tags)) + entries + struct.pack("<I", 0) + extra)
+
+        end = self.out.tell()
+        self.out.seek(self._start + 4)
+        self.out.write(struct.pack("<I", ifd_offset))
+        self.out.seek(end)
@@ -0,0 +1,1719 @@
+"""
+海报批量合成引擎（无界面）
+
+把二维码批量合成到海报上的全部逻辑都在这里，不依赖 tkinter，
+既可以被 poster.py 的界面调用，也可以在没有显示器的服务器上通过命令行运行：
+
+    python poster_engine.py 海报.png 二维码文件夹 输出文件夹 --x 100 --y 100 --w 300 --h 300
+
+第二个参数也可以是二维码内容清单（.csv/.json），二维码在内存中生成后直接合成。
+印刷尺寸的大海报按行条流式合成和编码，每张输出只占用几条的内存。
+"""
+import os
+import io
+import sys
+import math
+import copy
+import shutil
+import json
+import mmap
+import hashlib
+import argparse
+import time
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+
+from PIL import Image, ImageChops
+
+from poster_codecs import (PngRegionEncoder, JpegRegionEncoder,
+                           PngStripWriter, JpegStripWriter, TiffStripWriter,
+                           PNG_PROFILES, DEFAULT_PNG_PROFILE, encode_png)
+from poster_archive import ArchiveSink, ARCHIVE_FORMATS, parse_size
+from poster_qrgen import QrPayload, load_payloads, qr_modules, is_payload_file, ERROR_CORRECTION_LEVELS
+from poster_metrics import (StageClock, RunReport, PROFILERS, PROFILE_FILENAMES, format_report,
+                            run_profiled, require_profiler)
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+OUTPUT_FORMATS = ("png", "jpeg", "tiff")
+OUTPUT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "tiff": ".tif"}
+# thread: 线程池（默认，启动快）；process: 进程池（不受GIL限制，适合多核机器）
+EXECUTION_MODES = ("thread", "process")
+# 缩小解码时保留的余量：先缩到不小于目标尺寸的这个倍数，再做高质量缩放
+REDUCING_GAP = 2.0
+# 二维码的模块数范围：版本 1（21）到版本 40（177）加上静区
+QR_MIN_MODULES = 21
+QR_MAX_MODULES = 200
+# 定位图形（每个模块一个像素，255 为深色）：7×7 深色外框、一圈浅色、3×3 深色中心
+FINDER_PATTERN = bytes(0 if max(abs(row - 3), abs(column - 3)) == 2 else 255
+                       for row in range(7) for column in range(7))
+# 分条合成：每条的行数（JPEG 的 MCU 高度 16 的整数倍），以及自动启用的海报像素数（约 300dpi 的 A3）
+STRIP_ROWS = 256
+STRIP_STREAMING_PIXELS = 16_000_000
+# 默认内存预算：启动时可用内存的这个比例
+MEMORY_BUDGET_FRACTION = 0.7
+# 每个子进程本身（解释器、Pillow）占用的内存
+PROCESS_OVERHEAD = 80 * 1024 * 1024
+# 编码后大小相对原始像素的估计比例（偏保守）
+ENCODED_RATIO = {"png": 0.5, "jpeg": 0.15, "tiff": 0.6}
+
+
+class FolderIndex:
+    """
+    图片文件夹索引
+
+    用 os.scandir 扫描一次（可选递归），记录每个图片的相对路径、大小和修改时间，
+    以及每个目录的修改时间。增删文件会改变所在目录的修改时间，
+    之后只需 stat 各个目录就能判断索引是否过期，不必重新列出整个文件夹。
+    原地修改的文件不会被发现，但这只影响记录的大小（用于排序），
+    续传和增量更新仍以处理时的 os.stat 为准。
+    """
+
+    def __init__(self, folder, recursive=False):
+        self.folder = folder
+        self.recursive = recursive
+        self.entries = []  # [(相对路径, 大小, 修改时间ns)]，按相对路径排序
+        self.complete = False  # 是否已完整扫描过
+        self._dir_mtimes = {}  # 相对路径 -> 修改时间ns
+        self._digests = {}  # 相对路径 -> (大小, 修改时间ns, SHA-256)
+        self._lock = threading.Lock()  # 同一时间只有一个线程扫描，其余线程等待并复用结果
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def names(self):
+        return [entry[0] for entry in self.entries]
+
+    def largest_first(self):
+        """按文件大小从大到小排列的下标，批处理先提交大文件，避免最后只剩一个大文件在跑"""
+        return sorted(range(len(self.entries)), key=lambda i: -self.entries[i][1])
+
+    def size_collisions(self):
+        """大小与其它文件相同的文件名：只有它们可能内容相同，去重时只需哈希这些文件"""
+        counts = {}
+        for _, size, _ in self.entries:
+            counts[size] = counts.get(size, 0) + 1
+        return [name for name, size, _ in self.entries if counts[size] > 1]
+
+    def digests(self, names, max_workers=4):
+        """
+        计算文件内容的 SHA-256
+
+        结果按文件的大小和修改时间缓存，再次运行时没变的文件不重新读取。
+
+        Returns:
+            {相对路径: SHA-256}，无法读取的文件不在结果中
+        """
+        def digest(name):
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+                cached = self._digests.get(name)
+                if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                    return name, cached[2]
+                value = file_sha256(path)
+            except OSError:
+                return name, None
+            self._digests[name] = (stat.st_size, stat.st_mtime_ns, value)
+            return name, value
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return {name: value for name, value in executor.map(digest, names) if value is not None}
+
+    def is_stale(self):
+        """目录有增删（修改时间变化）或已不存在时返回 True"""
+        if not self.complete:
+            return True
+        for relative, mtime_ns in self._dir_mtimes.items():
+            try:
+                if os.stat(os.path.join(self.folder, relative)).st_mtime_ns != mtime_ns:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self, on_progress=None):
+        """过期时重新扫描，返回自身"""
+        with self._lock:
+            if self.is_stale():
+                self._scan(on_progress)
+        return self
+
+    def _scan(self, on_progress=None, batch_size=500):
+        """
+        扫描文件夹
+
+        Args:
+            on_progress: 可选，on_progress(entries)，找到第一个文件时和之后每 batch_size 个文件调用一次，
+                entries 为目前为止的结果（只读），用于边扫描边显示
+        """
+        entries = []
+        dir_mtimes = {}
+        pending = [""]
+        while pending:
+            relative = pending.pop(0)
+            path = os.path.join(self.folder, relative)
+            try:
+                dir_mtimes[relative] = os.stat(path).st_mtime_ns
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                if self.recursive:
+                                    pending.append(os.path.join(relative, entry.name))
+                            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                                stat = entry.stat()
+                                entries.append((os.path.join(relative, entry.name),
+                                                stat.st_size, stat.st_mtime_ns))
+                                if on_progress and (len(entries) == 1 or len(entries) % batch_size == 0):
+                                    on_progress(entries)
+                        except OSError:
+                            continue
+            except OSError as e:
+                if not relative:
+                    raise
+                print(f"无法读取文件夹 {path}: {e}")
+
+        # os.scandir 的顺序随文件系统而定，增删文件后可能整体变化；
+        # 按相对路径排序，使 {number} 编号只取决于文件名
+        entries.sort(key=lambda entry: entry[0])
+        self.entries = entries
+        self._dir_mtimes = dir_mtimes
+        self.complete = True
+
+
+# 进程内共享的文件夹索引：界面预览、选择文件夹和批处理都用同一份
+_folder_indexes = {}
+_folder_indexes_lock = threading.Lock()
+
+
+def get_folder_index(folder, recursive=False, refresh=True, on_progress=None):
+    """
+    返回文件夹的共享索引
+
+    Args:
+        refresh: 是否先按目录修改时间检查并在需要时重新扫描
+        on_progress: 重新扫描时传给 FolderIndex.refresh
+    """
+    key = (os.path.abspath(folder), bool(recursive))
+    with _folder_indexes_lock:
+        index = _folder_indexes.get(key)
+        if index is None:
+            index = _folder_indexes[key] = FolderIndex(folder, recursive)
+    if refresh:
+        index.refresh(on_progress)
+    return index
+
+
+def open_scaled(path, target_size, reduced_decoding=True):
+    """
+    打开图片，源图远大于目标尺寸时直接以缩小的尺寸解码
+
+    JPEG 用 draft 在 DCT 阶段按 1/2、1/4、1/8 缩小解码，解码时间和内存都成倍减少；
+    其它格式解码后由 resize 的 reducing_gap 先用 reduce() 整数倍缩小。
+    两种方式都保留不小于目标尺寸 REDUCING_GAP 倍的图片，最后的高质量缩放仍有足够的像素。
+    """
+    image = Image.open(path)
+    if reduced_decoding and image.format == "JPEG":
+        width, height = target_size
+        image.draft(image.mode, (int(width * REDUCING_GAP), int(height * REDUCING_GAP)))
+    return image
+
+
+def _change_positions(image, axis):
+    """沿 axis（0 为 x，1 为 y）方向像素发生变化的位置：与前一列/行不同的列/行下标"""
+    width, height = image.size
+    if axis == 0:
+        if width < 2:
+            return []
+        diff = ImageChops.difference(image.crop((1, 0, width, height)), image.crop((0, 0, width - 1, height)))
+    else:
+        if height < 2:
+            return []
+        diff = ImageChops.difference(image.crop((0, 1, width, height)), image.crop((0, 0, width, height - 1)))
+    return [i + 1 for i, changed in enumerate(diff.getprojection()[axis]) if changed]
+
+
+def _has_finder_patterns(modules):
+    """
+    每个模块一个像素的网格（"L" 模式）是否为二维码：深色模块范围的左上、右上、左下三个角上都是定位图形
+
+    两种颜色轮流当作深色，反色的二维码也能识别。
+    """
+    for dark in {value for _, value in modules.getcolors(2)}:
+        mask = modules.point(lambda value: 255 if value == dark else 0)
+        box = mask.getbbox()
+        if box is None:
+            continue
+        left, top, right, bottom = box
+        if right - left < QR_MIN_MODULES or bottom - top < QR_MIN_MODULES:
+            continue
+        corners = ((left, top), (right - 7, top), (left, bottom - 7))
+        if all(mask.crop((x, y, x + 7, y + 7)).tobytes() == FINDER_PATTERN for x, y in corners):
+            return True
+    return False
+
+
+def detect_module_grid(image):
+    """
+    判断图片是否为两种颜色、按整数像素对齐的模块网格（二维码）
+
+    模块边长取横竖各三条线上颜色变化位置和图片宽高的最大公约数（只读几行像素），
+    再把图片按模块最近邻缩小、放大回原尺寸，与原图比较一次确认。
+    两种颜色已知，比较只在它们不同的一个通道上进行。
+    最后要求三个角上有定位图形，两色图标之类恰好对齐网格的图片仍走普通缩放。
+
+    Returns:
+        (列数, 行数)；不是模块网格时返回 None
+    """
+    colors = image.getcolors(2)
+    if not colors or len(colors) != 2:
+        return None
+    if len(image.getbands()) > 1:
+        (_, first), (_, second) = colors
+        channel = image.getchannel(next(i for i in range(len(first)) if first[i] != second[i]))
+    elif image.mode != "L":
+        channel = image.convert("L")
+    else:
+        channel = image
+
+    width, height = channel.size
+    positions = []
+    for k in (1, 2, 3):
+        y, x = height * k // 4, width * k // 4
+        positions += _change_positions(channel.crop((0, y, width, y + 1)), 0)
+        positions += _change_positions(channel.crop((x, 0, x + 1, height)), 1)
+    if not positions:
+        return None
+    module = math.gcd(width, height, *positions)
+    columns, rows = width // module, height // module
+    if not (QR_MIN_MODULES <= columns <= QR_MAX_MODULES and QR_MIN_MODULES <= rows <= QR_MAX_MODULES):
+        return None
+    modules = channel
+    if module > 1:
+        modules = channel.resize((columns, rows), Image.Resampling.NEAREST)
+        restored = modules.resize(channel.size, Image.Resampling.NEAREST)
+        if ImageChops.difference(channel, restored).getbbox() is not None:
+            return None
+    if not _has_finder_patterns(modules):
+        return None
+    return columns, rows
+
+
+def clamp_quality(value, default=95):
+    """把 JPEG 质量转换为 1-100 的整数"""
+    try:
+        return max(1, min(100, int(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_duration(seconds):
+    """把秒数格式化为 mm:ss 或 h:mm:ss"""
+    seconds = int(max(0, seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def generate_filename(original_filename, index, pattern="{original}", start_number=1,
+                      prefix="", suffix="", output_format="png"):
+    """
+    根据命名模板生成输出文件名
+
+    Args:
+        original_filename: 原始文件名（图片文件名，或内容清单中的名称）
+        index: 当前文件索引（从0开始）
+        pattern: 命名模板，可用变量 {original} {number} {prefix} {suffix} {date} {time}
+
+    Returns:
+        生成的文件名（含扩展名）
+    """
+    # 只去掉图片扩展名：清单中的名称可能本身带点（如 store.beijing）
+    base_name, input_extension = os.path.splitext(original_filename)
+    if input_extension.lower() not in IMAGE_EXTENSIONS:
+        base_name = original_filename
+    extension = OUTPUT_EXTENSIONS[output_format]
+
+    number = start_number + index
+    now = datetime.now()
+    filename = pattern.format(
+        original=base_name,
+        number=number,
+        prefix=prefix,
+        suffix=suffix,
+        date=now.strftime("%Y%m%d"),
+        time=now.strftime("%H%M%S")
+    )
+
+    # 清理非法字符
+    illegal_chars = '<>:"/\\|?*'
+    for char in illegal_chars:
+        filename = filename.replace(char, '_')
+
+    return filename + extension
+
+
+class BatchJob:
+    """一次批量合成任务的全部设置"""
+
+    def __init__(self, poster_path, qr_folder, output_folder,
+                 qr_x, qr_y, qr_w, qr_h,
+                 output_format="png", jpeg_quality=95,
+                 naming_pattern="{original}", naming_start_number=1,
+                 naming_prefix="", naming_suffix="",
+                 max_workers=None, execution_mode="thread", max_in_flight=None,
+                 resume=False, incremental=False, region_encoding=False,
+                 poster_image=None, recursive=False, largest_first=True,
+                 archive_format=None, archive_path=None, write_files=True,
+                 reduced_decoding=True, module_scaling=True,
+                 deduplicate=True, hardlink_duplicates=False,
+                 payload_file=None, qr_border=4, qr_error_correction="M",
+                 strip_streaming=None, memory_budget=None,
+                 report_path=None, profiler=None, profile_path=None,
+                 png_profile=DEFAULT_PNG_PROFILE):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"不支持的并行方式: {execution_mode}")
+        if max_workers is not None and int(max_workers) <= 0:
+            raise ValueError("并行数必须大于0")
+        if max_in_flight is not None and int(max_in_flight) <= 0:
+            raise ValueError("同时提交的任务数必须大于0")
+        if int(qr_w) <= 0 or int(qr_h) <= 0:
+            raise ValueError("宽度和高度必须大于0")
+        if archive_format is not None and archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"不支持的压缩包格式: {archive_format}")
+        if not write_files and archive_format is None:
+            raise ValueError("不保存单独文件时必须指定压缩包格式")
+        if qr_error_correction not in ERROR_CORRECTION_LEVELS:
+            raise ValueError(f"不支持的纠错等级: {qr_error_correction}")
+        if memory_budget is not None and int(memory_budget) <= 0:
+            raise ValueError("内存预算必须大于0")
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"不支持的分析器: {profiler}")
+        if png_profile not in PNG_PROFILES:
+            raise ValueError(f"不支持的 PNG 编码档位: {png_profile}")
+
+        self.poster_path = poster_path
+        self.qr_folder = qr_folder
+        self.output_folder = output_folder
+        self.qr_x = qr_x
+        self.qr_y = qr_y
+        self.qr_w = qr_w
+        self.qr_h = qr_h
+        self.output_format = output_format
+        self.jpeg_quality = clamp_quality(jpeg_quality)
+        self.naming_pattern = naming_pattern
+        self.naming_start_number = naming_start_number
+        self.naming_prefix = naming_prefix
+        self.naming_suffix = naming_suffix
+        self.max_workers = max_workers
+        self.execution_mode = execution_mode
+        self.max_in_flight = max_in_flight
+        self.resume = resume  # 跳过清单中已完成且输入、设置都没变的文件
+        # 增量更新：按内容哈希判断是否需要重新合成，并删除输入已被移除的输出
+        self.incremental = incremental
+        # 只重新编码二维码所在的区域，海报其余部分每批只压缩一次
+        self.region_encoding = region_encoding
+        # 界面已经加载过海报时直接复用，避免再次解码
+        self.poster_image = poster_image
+        self.recursive = recursive  # 包含子文件夹中的图片
+        self.largest_first = largest_first  # 先提交大文件（输出编号仍按文件顺序）
+        # 编码结果直接写入压缩包（zip/tar/tar.gz），默认路径为 输出文件夹 + 扩展名
+        self.archive_format = archive_format
+        self.archive_path = archive_path
+        self.write_files = write_files  # 是否同时保存单独的输出文件
+        # 源图远大于放置尺寸时缩小解码（JPEG draft / reduce），再从缩小后的图高质量缩放
+        self.reduced_decoding = reduced_decoding
+        # 两色模块网格（二维码）按模块最近邻放大，边缘锐利且几乎不花时间
+        self.module_scaling = module_scaling
+        # 内容相同的输入只合成一次，其余输出复制（或硬链接）第一份的结果
+        self.deduplicate = deduplicate
+        self.hardlink_duplicates = hardlink_duplicates
+        # 内容清单（CSV/JSON）：不读取二维码图片，按清单在内存中生成
+        self.payload_file = payload_file
+        self.qr_border = qr_border  # 静区宽度（模块数）
+        self.qr_error_correction = qr_error_correction
+        self.payloads = None  # 名称 -> 内容，run_batch 读取清单后设置
+        # 按行条流式合成和编码，不为每个工作者复制整张海报；None 表示海报足够大时自动启用
+        self.strip_streaming = strip_streaming
+        # 内存预算（字节），None 表示按可用内存自动确定；并行数和在途任务数都不会超出预算
+        self.memory_budget = memory_budget
+        self.memory_plan = None  # run_batch 按海报尺寸设置
+        # 运行报告（JSON）路径，默认为输出文件夹中的 RunReport.FILENAME
+        self.report_path = report_path
+        # 用 cprofile / pyinstrument 分析第一个实际合成的任务，结果写到 profile_path
+        self.profiler = profiler
+        self.profile_path = profile_path
+        # PNG 编码档位（fastest/balanced/smallest/archival），只影响文件大小和速度，不影响像素
+        self.png_profile = png_profile
+
+    @property
+    def target_size(self):
+        return (int(self.qr_w), int(self.qr_h))
+
+    @property
+    def target_pos(self):
+        return (int(self.qr_x), int(self.qr_y))
+
+    @property
+    def requested_workers(self):
+        """设置的并行数：线程池默认最多4个，进程池默认每个CPU一个"""
+        if self.max_workers:
+            return int(self.max_workers)
+        if self.execution_mode == "process":
+            return multiprocessing.cpu_count()
+        return min(multiprocessing.cpu_count(), 4)
+
+    @property
+    def worker_count(self):
+        """实际使用的并行数：设置的并行数，再受内存预算限制"""
+        workers = self.requested_workers
+        if self.memory_plan is not None and self.memory_plan.max_workers is not None:
+            workers = min(workers, self.memory_plan.max_workers)
+        return workers
+
+    @property
+    def in_flight_limit(self):
+        """同时提交给执行器的任务上限，默认每个工作者排队4个，再受内存预算限制"""
+        workers = self.worker_count
+        limit = int(self.max_in_flight) if self.max_in_flight else workers * 4
+        if self.memory_plan is not None:
+            budget_limit = self.memory_plan.max_in_flight(workers)
+            if budget_limit is not None:
+                limit = min(limit, budget_limit)
+        return limit
+
+    def plan_memory(self, poster_size):
+        """按海报尺寸和内存预算确定并行数（设置 memory_plan）"""
+        budget = self.memory_budget
+        if budget is None:
+            available = available_memory()
+            budget = int(available * MEMORY_BUDGET_FRACTION) if available else None
+        self.memory_plan = MemoryPlan(self, poster_size, budget)
+        return self.memory_plan
+
+    @property
+    def resample_method(self):
+        """选择缩放算法：低质量 JPEG 用更快的 BILINEAR"""
+        if self.output_format == "jpeg" and self.jpeg_quality < 85:
+            return Image.Resampling.BILINEAR
+        return Image.Resampling.LANCZOS
+
+    def output_filename(self, qr_filename, index):
+        return generate_filename(qr_filename, index, self.naming_pattern,
+                                 self.naming_start_number, self.naming_prefix,
+                                 self.naming_suffix, self.output_format)
+
+    def output_collisions(self, qr_files):
+        """
+        映射到同一个输出文件的输入（按不区分大小写比较，Windows 和 macOS 的文件系统都不区分）
+
+        Returns:
+            [(输出文件名, [输入文件名, ...])]
+        """
+        outputs = {}
+        for i, qr_filename in enumerate(qr_files):
+            output_filename = self.output_filename(qr_filename, i)
+            outputs.setdefault(output_filename.lower(), (output_filename, []))[1].append(qr_filename)
+        return [(output_filename, inputs) for output_filename, inputs in outputs.values() if len(inputs) > 1]
+
+    def uses_strips(self, poster_size):
+        """这张海报是否按行条流式合成（区域编码优先）"""
+        if self.region_encoding and self.output_format in ("png", "jpeg"):
+            return False
+        if self.strip_streaming is not None:
+            return self.strip_streaming
+        return poster_size[0] * poster_size[1] >= STRIP_STREAMING_PIXELS
+
+    def report_file(self):
+        return self.report_path or os.path.join(self.output_folder, RunReport.FILENAME)
+
+    def profile_file(self):
+        return self.profile_path or os.path.join(self.output_folder, PROFILE_FILENAMES[self.profiler])
+
+    def poster_size(self):
+        """海报尺寸（只读取文件头）"""
+        if self.poster_image is not None:
+            return self.poster_image.size
+        with Image.open(self.poster_path) as poster:
+            return poster.size
+
+    def load_poster(self):
+        """加载海报（RGBA）"""
+        if self.poster_image is not None:
+            return self.poster_image
+        return Image.open(self.poster_path).convert("RGBA")
+
+    def settings_dict(self, poster_sha256):
+        """影响输出像素的全部设置，用于判断上次的结果能否复用"""
+        settings = {
+            "poster_sha256": poster_sha256,
+            "qr_x": self.target_pos[0],
+            "qr_y": self.target_pos[1],
+            "qr_w": self.target_size[0],
+            "qr_h": self.target_size[1],
+            "output_format": self.output_format,
+            "jpeg_quality": self.jpeg_quality if self.output_format == "jpeg" else None,
+            "resample": self.resample_method.name,
+            "reduced_decoding": self.reduced_decoding,
+            "module_scaling": self.module_scaling,
+        }
+        if self.payload_file:
+            settings.update({"qr_border": self.qr_border, "qr_error_correction": self.qr_error_correction})
+        return settings
+
+    def qr_source(self, qr_filename):
+        """一个输入的来源：清单模式下为 QrPayload，否则为图片路径"""
+        if self.payloads is not None:
+            return QrPayload(qr_filename, self.payloads[qr_filename])
+        return os.path.join(self.qr_folder, qr_filename)
+
+    def for_worker_process(self):
+        """发送给子进程的副本：不携带已解码的海报，子进程从共享缓冲区读取"""
+        job = copy.copy(self)
+        job.poster_image = None
+        return job
+
+
+class BatchResult:
+    """批量合成的结果统计"""
+
+    def __init__(self, total):
+        self.total = total
+        self.success_count = 0
+        self.failed = []  # 处理失败的文件名
+        self.skipped = 0  # 断点续传/增量更新时跳过的文件数
+        self.removed = 0  # 增量更新时删除的过期输出数
+        self.archive_path = None  # 生成的压缩包路径
+        self.deduplicated = 0  # 与其它输入内容相同、直接复用结果的文件数
+        self.deduplicated_bytes = 0  # 复用结果省下的编码输出字节数
+        self.worker_count = None  # 实际使用的并行数
+        self.requested_workers = None  # 设置的并行数（受内存预算限制时大于 worker_count）
+        self.memory_plan = None
+        self.report = None  # RunReport.to_dict() 的结果
+        self.report_path = None
+
+
+# ========== 内存预算 ==========
+def _cgroup_memory_available():
+    """容器（cgroup v2）内剩余可用的内存，没有限制时返回 None"""
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit == "max":
+            return None
+        with open("/sys/fs/cgroup/memory.current") as f:
+            return max(0, int(limit) - int(f.read()))
+    except (OSError, ValueError):
+        return None
+
+
+def available_memory():
+    """当前可用的物理内存（字节），无法获取时返回 None"""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+
+    if available is None and sys.platform == "win32":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            available = status.ullAvailPhys
+    elif available is None:
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            pass
+
+    cgroup = _cgroup_memory_available()
+    if cgroup is not None:
+        available = cgroup if available is None else min(available, cgroup)
+    return available
+
+
+class MemoryPlan:
+    """
+    按内存预算决定并行数和在途任务数
+
+    按海报尺寸、画布模式和输出格式估计三部分内存：所有工作者共用的（解码后的海报等）、
+    每个工作者常驻的（画布或条带、编码缓冲区、子进程本身），以及每个已完成但还没写入压缩包的结果。
+    预算放不下设置的并行数时减少并行数（至少 1 个），而不是让系统开始换页。
+
+    Args:
+        budget: 字节数，None 表示不限制
+    """
+
+    def __init__(self, job, poster_size, budget=None):
+        width, height = poster_size
+        channels = 3 if job.output_format == "jpeg" else 4
+        raw = width * height * channels
+        encoded = int(raw * ENCODED_RATIO[job.output_format])
+        qr_w, qr_h = job.target_size
+        # 缩小解码后的源图（不超过目标尺寸的 REDUCING_GAP 倍）、缩放结果和格式转换的副本
+        qr = int(qr_w * qr_h * 4 * (REDUCING_GAP ** 2 + 2))
+
+        self.budget = budget
+        self.strips = job.uses_strips(poster_size)
+        self.shared = width * height * 4  # 解码后的 RGBA 海报
+        if self.strips:
+            # 取出、转换、滤波各一份条带；不直接写文件时输出在内存中
+            working = STRIP_ROWS * width * channels * 3 + (0 if job.write_files else encoded * 2)
+        elif job.region_encoding:
+            # 区域编码器初始化时临时复制上下两部分，之后常驻预先编码的字节
+            band = min(height, qr_h + 16)
+            working = band * width * channels * 3 + encoded * 2
+            setup = raw + encoded
+            if job.execution_mode == "process":
+                working += setup  # 每个子进程各自初始化一个编码器
+            else:
+                self.shared += setup
+        else:
+            working = raw + encoded * 2  # 每个工作者的画布，以及编码输出和它的副本
+        self.per_worker = working + qr
+        if job.execution_mode == "process":
+            self.per_worker += PROCESS_OVERHEAD
+        # 打包时已完成的结果带着编码后的字节，等待收集线程写入压缩包
+        self.per_result = encoded if job.archive_format else 0
+
+    @property
+    def max_workers(self):
+        """预算内最多能同时运行的工作者数，不限制时为 None"""
+        if self.budget is None:
+            return None
+        return max(1, (self.budget - self.shared) // self.per_worker)
+
+    def max_in_flight(self, workers):
+        """预算内最多的在途任务数（不少于工作者数），不限制时为 None"""
+        if self.budget is None or not self.per_result:
+            return None
+        spare = self.budget - self.shared - workers * self.per_worker
+        return workers + max(0, spare // self.per_result)
+
+    def estimate(self, workers, in_flight):
+        """按给定的并行数和在途任务数估计的峰值内存（字节）"""
+        return self.shared + workers * self.per_worker + max(0, in_flight - workers) * self.per_result
+
+
+class SharedPosterBuffer:
+    """
+    只读共享的海报像素缓冲区
+
+    解码后的 RGBA 像素写入一个原始像素文件，各进程用 mmap 只读映射，
+    操作系统只保留一份物理内存，子进程也不需要再解码海报。
+    """
+
+    STRIP_ROWS = 256  # 分条写入，避免 tobytes() 再占用一份整图内存
+
+    def __init__(self, path, mode, size, info=None, owner=False):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.info = info or {}  # 需要随像素一起保留的元数据（ICC 配置）
+        self.owner = owner
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def create(cls, image, folder=None):
+        """把图片写入临时文件并返回缓冲区（调用方负责 release）"""
+        fd, path = tempfile.mkstemp(prefix="poster_", suffix=".raw", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for top in range(0, image.height, cls.STRIP_ROWS):
+                    bottom = min(top + cls.STRIP_ROWS, image.height)
+                    f.write(image.crop((0, top, image.width, bottom)).tobytes())
+        except Exception:
+            os.remove(path)
+            raise
+        info = {key: image.info[key] for key in ("icc_profile",) if image.info.get(key)}
+        return cls(path, image.mode, image.size, info, owner=True)
+
+    @property
+    def descriptor(self):
+        """可以传给子进程的描述信息"""
+        return (self.path, self.mode, self.size, self.info)
+
+    @classmethod
+    def attach(cls, descriptor):
+        return cls(*descriptor)
+
+    def open_image(self):
+        """返回直接映射共享内存的只读图片（不复制像素）"""
+        if self._mmap is None:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        image = Image.frombuffer(self.mode, self.size, self._mmap, "raw", self.mode, 0, 1)
+        image.info = dict(self.info)
+        return image
+
+    def release(self):
+        """关闭映射；创建者同时删除文件。需要先释放所有由 open_image 得到的图片"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class JobManifest:
+    """
+    批量任务清单（JSON Lines，保存在输出文件夹中）
+
+    第一行记录任务设置，之后每完成一个文件追加一行：输入文件、大小和修改时间、
+    输出文件、状态和输出的 SHA-256。中途崩溃或关闭窗口后，
+    续传时跳过输入和设置都没变、输出文件仍然完好的条目。
+
+    增量更新模式下每条记录还带有内容键（海报、二维码内容和全部输出设置的哈希），
+    只有键变化的条目才重新合成。
+    """
+
+    FILENAME = ".poster_manifest.jsonl"
+
+    def __init__(self, path, settings, entries=None):
+        self.path = path
+        self.settings = settings
+        self.entries = entries or {}  # 输入文件名 -> 最后一条记录
+        self.previous_outputs = set()  # 打开时旧记录中的全部输出文件名，增量更新时据此清理
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def open(cls, job):
+        """
+        打开任务清单
+
+        续传模式下如果旧清单的设置与本次一致，则保留旧记录并继续追加；
+        增量模式总是保留旧记录（逐条比较内容键）；其余情况重新开始一份新清单。
+        """
+        path = os.path.join(job.output_folder, cls.FILENAME)
+        poster_sha256 = file_sha256(job.poster_path) if job.poster_path else None
+        settings = job.settings_dict(poster_sha256)
+
+        manifest = cls(path, settings)
+        previous_settings = None
+        if (job.resume or job.incremental) and os.path.exists(path):
+            previous_settings, entries = cls.read(path)
+            # 增量模式按内容键逐条比较，设置变了也要保留旧记录以便清理过期输出
+            if previous_settings == settings or job.incremental:
+                manifest.entries = entries
+                manifest.previous_outputs = {entry.get("output") for entry in entries.values()
+                                             if entry.get("output")}
+
+        if manifest.entries and previous_settings == settings:
+            manifest._file = open(path, "a", encoding="utf-8")
+        else:
+            manifest._rewrite()
+        return manifest
+
+    @staticmethod
+    def read(path):
+        """
+        读取清单，返回 (settings, entries)
+
+        最后一行可能因崩溃而不完整；无法解析的行和缺少必要字段的记录都直接忽略。
+        """
+        settings = None
+        entries = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                if record.get("type") == "job":
+                    settings = record.get("settings")
+                elif record.get("type") == "file" and isinstance(record.get("input"), str):
+                    entries[record["input"]] = record
+        return settings, entries
+
+    @staticmethod
+    def input_signature(qr_path):
+        stat = os.stat(qr_path)
+        return {"input_size": stat.st_size, "input_mtime_ns": stat.st_mtime_ns}
+
+    def content_key(self, qr_sha256):
+        """内容键：本次任务设置（含海报哈希）加上二维码内容哈希"""
+        digest = hashlib.sha256(json.dumps(self.settings, sort_keys=True).encode("utf-8"))
+        digest.update(qr_sha256.encode("ascii"))
+        return digest.hexdigest()
+
+    def is_done(self, qr_filename, signature, output_filename, output_folder):
+        """
+        该输入是否已经以相同的输入和设置完成过
+
+        签名中带内容键时按内容键比较，否则按文件大小和修改时间比较。
+        """
+        entry = self.entries.get(qr_filename)
+        if not entry or entry.get("status") != "done":
+            return False
+        if entry.get("output") != output_filename:
+            return False
+        if "key" in signature:
+            if entry.get("key") != signature["key"]:
+                return False
+        elif (entry.get("input_size"), entry.get("input_mtime_ns")) != \
+                (signature["input_size"], signature["input_mtime_ns"]):
+            return False
+        output_path = os.path.join(output_folder, output_filename)
+        try:
+            return os.path.getsize(output_path) == entry.get("output_size")
+        except OSError:
+            return False
+
+    def record(self, qr_filename, signature, outcome):
+        """追加一条文件记录并立即写盘"""
+        entry = {"type": "file", "input": qr_filename}
+        entry.update(signature)
+        entry.update({
+            "output": outcome["output"],
+            "status": "done" if outcome["ok"] else "failed",
+            "output_size": outcome.get("output_size"),
+            "sha256": outcome.get("sha256"),
+        })
+        if outcome.get("error"):
+            entry["error"] = outcome["error"]
+        self.entries[qr_filename] = entry
+        self._write_line(entry)
+
+    def remove_stale(self, current_inputs, output_folder):
+        """
+        删除输入已不存在的条目，以及上次记录过、但已不对应任何输入的输出文件
+
+        后者包括输出名称变了的输入留下的旧文件：按编号命名（{number}）时，
+        删除一个输入会让之后的编号整体前移，原来编号最大的文件就不再属于任何输入。
+
+        Returns:
+            删除的输出文件数
+        """
+        for name in [name for name in self.entries if name not in current_inputs]:
+            del self.entries[name]
+        live_outputs = {entry.get("output") for entry in self.entries.values()}
+        removed = 0
+        for output in sorted(self.previous_outputs - live_outputs):
+            output_path = os.path.join(output_folder, output)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+                removed += 1
+        return removed
+
+    def _rewrite(self):
+        """用当前设置和记录重写整个清单（先写临时文件再替换）"""
+        if self._file is not None:
+            self._file.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "job", "settings": self.settings,
+                                "created": datetime.now().isoformat(timespec="seconds")},
+                               ensure_ascii=False) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def compact(self):
+        """重写清单，只保留每个输入的最后一条记录"""
+        with self._lock:
+            self._rewrite()
+
+    def _write_line(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProgressTracker:
+    """按完成数量和时间节流进度回调，并计算吞吐量和剩余时间"""
+
+    def __init__(self, total, callback=None, interval=0.2):
+        self.total = total
+        self.callback = callback
+        self.interval = interval  # 两次回调之间的最短间隔（秒）
+        self.completed = 0
+        self.start_time = time.monotonic()
+        self._last_report = 0.0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    @property
+    def rate(self):
+        """每秒完成的图片数"""
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """预计剩余秒数，尚无法估计时为 None"""
+        rate = self.rate
+        if rate <= 0:
+            return None
+        return (self.total - self.completed) / rate
+
+    def advance(self, count=1):
+        self.completed += count
+        now = time.monotonic()
+        if self.callback and (self.completed >= self.total or now - self._last_report >= self.interval):
+            self._last_report = now
+            self.callback(self.completed, self.total, self.rate, self.eta)
+
+
+class PosterCompositor:
+    """
+    把单张二维码合成到海报上，同一个实例可被多个线程同时调用
+
+    海报本身只读共享。每个工作线程只保留一张可写的画布，
+    每次合成前用海报原始像素把上一次贴过的区域恢复，而不是整张复制海报。
+    启用区域编码时连画布也不需要，只合成二维码所在的那几行并交给区域编码器。
+    分条合成时同样没有画布：海报按 STRIP_ROWS 行一条条取出，贴上二维码后直接送进编码器写出。
+    """
+
+    def __init__(self, job, poster_base):
+        self.job = job
+        self.poster_base = poster_base
+        self.canvas_mode = "RGB" if job.output_format == "jpeg" else "RGBA"
+
+        x, y = job.target_pos
+        w, h = job.target_size
+        self.background_patch = poster_base.crop((x, y, x + w, y + h))
+        if self.background_patch.mode != self.canvas_mode:
+            self.background_patch = self.background_patch.convert(self.canvas_mode)
+        self._local = threading.local()
+
+        self.strip_streaming = job.uses_strips(poster_base.size)
+        self.region_encoder = None
+        if job.region_encoding and job.output_format in ("png", "jpeg"):
+            if job.output_format == "png":
+                top = min(max(0, y), poster_base.height - 1)
+                bottom = max(min(poster_base.height, y + h), top + 1)
+                # 预先压缩的上下两段和每张的区域都只压缩一遍，使用档位的第一个策略
+                settings = PNG_PROFILES[job.png_profile]
+                self.region_encoder = PngRegionEncoder(poster_base, top, bottom, settings["compress_level"],
+                                                       settings["strategies"][0])
+            else:
+                rgb_poster = poster_base.convert("RGB")
+                rgb_poster.info = dict(poster_base.info)
+                self.region_encoder = JpegRegionEncoder(rgb_poster, y, y + h, job.jpeg_quality)
+            encoder = self.region_encoder
+            self.band_box = (0, encoder.band_top, poster_base.width, encoder.band_bottom)
+
+    def _worker_canvas(self):
+        """当前线程的可写画布（第一次使用时从海报复制一次）"""
+        canvas = getattr(self._local, "canvas", None)
+        if canvas is None:
+            if self.poster_base.mode == self.canvas_mode:
+                canvas = self.poster_base.copy()
+            else:
+                canvas = self.poster_base.convert(self.canvas_mode)
+            self._local.canvas = canvas
+        return canvas
+
+    def load_qr(self, qr_path, clock=None):
+        """加载二维码并缩放到目标尺寸；qr_path 为 QrPayload 时直接生成"""
+        clock = clock or StageClock()
+        qr = self._decode_qr(qr_path, clock)
+        clock.lap("decode")
+        qr = self._resize_qr(qr, isinstance(qr_path, QrPayload))
+        clock.lap("resize")
+        return qr
+
+    def _decode_qr(self, qr_path, clock):
+        job = self.job
+        if isinstance(qr_path, QrPayload):
+            clock.bytes_read += len(qr_path.data.encode("utf-8"))
+            return qr_modules(qr_path.data, job.qr_border, job.qr_error_correction)
+        clock.bytes_read += os.path.getsize(qr_path)
+        qr = open_scaled(qr_path, job.target_size, job.reduced_decoding)
+        qr.load()
+
+        if qr.mode != "RGBA" and self.canvas_mode == "RGBA":
+            qr = qr.convert("RGBA")
+        elif qr.mode == "RGBA" and self.canvas_mode == "RGB":
+            qr = qr.convert("RGB")
+        return qr
+
+    def _resize_qr(self, qr, generated):
+        job = self.job
+        if generated:
+            # 生成的模块矩阵，每个模块一个像素；放置尺寸小于模块数时最近邻缩放会丢掉整行整列模块
+            if job.target_size[0] < qr.width or job.target_size[1] < qr.height:
+                raise ValueError(f"放置尺寸 {job.target_size[0]}×{job.target_size[1]} 小于二维码的模块数 "
+                                 f"{qr.width}×{qr.height}（含静区），生成的二维码无法扫描")
+            qr = qr.resize(job.target_size, Image.Resampling.NEAREST)
+            return qr.convert("RGBA") if self.canvas_mode == "RGBA" else qr
+
+        # 二维码：先取每个模块一个像素，再最近邻放大到目标尺寸（每个模块不小于 1 像素时）
+        if job.module_scaling:
+            grid = detect_module_grid(qr)
+            if grid is not None and job.target_size[0] >= grid[0] and job.target_size[1] >= grid[1]:
+                modules = qr.resize(grid, Image.Resampling.NEAREST)
+                return modules.resize(job.target_size, Image.Resampling.NEAREST)
+
+        if job.reduced_decoding:
+            return qr.resize(job.target_size, job.resample_method, reducing_gap=REDUCING_GAP)
+        return qr.resize(job.target_size, job.resample_method)
+
+    def _paste(self, target, qr_resized, position):
+        if self.canvas_mode == "RGBA" and qr_resized.mode == "RGBA":
+            target.paste(qr_resized, position, qr_resized)
+        else:
+            target.paste(qr_resized, position)
+
+    def render(self, qr_path, clock=None):
+        """返回合成后的整张图片（当前线程的画布，下一次 render 前有效）"""
+        clock = clock or StageClock()
+        qr_resized = self.load_qr(qr_path, clock)
+        result = self._worker_canvas()
+        result.paste(self.background_patch, self.job.target_pos)
+        self._paste(result, qr_resized, self.job.target_pos)
+        clock.lap("composite")
+        return result
+
+    def render_band(self, qr_path, clock=None):
+        """只合成二维码覆盖的那几行（区域编码用）"""
+        clock = clock or StageClock()
+        qr_resized = self.load_qr(qr_path, clock)
+        band = self.poster_base.crop(self.band_box)
+        if band.mode != self.canvas_mode:
+            band = band.convert(self.canvas_mode)
+        x, y = self.job.target_pos
+        self._paste(band, qr_resized, (x, y - self.band_box[1]))
+        clock.lap("composite")
+        return band
+
+    def write_strips(self, qr_path, out, clock=None):
+        """按行条合成并写入 out，只有与二维码相交的条需要粘贴"""
+        clock = clock or StageClock()
+        qr_resized = self.load_qr(qr_path, clock)
+        poster = self.poster_base
+        width, height = poster.size
+        icc_profile = poster.info.get("icc_profile")
+        if self.job.output_format == "png":
+            # 分条写入时只能压缩一遍，使用档位的第一个策略
+            settings = PNG_PROFILES[self.job.png_profile]
+            writer = PngStripWriter(out, width, height, self.canvas_mode, icc_profile,
+                                    settings["compress_level"], settings["strategies"][0])
+        elif self.job.output_format == "jpeg":
+            writer = JpegStripWriter(out, width, height, self.job.jpeg_quality, icc_profile)
+        else:
+            writer = TiffStripWriter(out, width, height, self.canvas_mode, icc_profile)
+
+        x, y = self.job.target_pos
+        for top in range(0, height, STRIP_ROWS):
+            bottom = min(height, top + STRIP_ROWS)
+            strip = poster.crop((0, top, width, bottom))
+            if strip.mode != self.canvas_mode:
+                strip = strip.convert(self.canvas_mode)
+            if top < y + qr_resized.height and bottom > y:
+                self._paste(strip, qr_resized, (x, y - top))
+            clock.lap("composite")
+            writer.write(strip)
+            clock.lap("encode")
+        writer.close()
+        clock.lap("encode")
+
+    def render_and_encode(self, qr_path, clock=None):
+        """合成一张输出并返回编码后的字节"""
+        clock = clock or StageClock()
+        if self.region_encoder is not None:
+            data = self.region_encoder.encode(self.render_band(qr_path, clock))
+        elif self.strip_streaming:
+            buffer = io.BytesIO()
+            self.write_strips(qr_path, buffer, clock)
+            data = buffer.getvalue()
+        else:
+            data = self.encode(self.render(qr_path, clock))
+        clock.lap("encode")
+        return data
+
+    def encode(self, result):
+        """把合成结果编码为输出格式的字节"""
+        if self.job.output_format == "png":
+            return encode_png(result, self.job.png_profile)
+        buffer = io.BytesIO()
+        if self.job.output_format == "jpeg":
+            result.save(buffer, format='JPEG', quality=self.job.jpeg_quality, optimize=True)
+        else:
+            result.save(buffer, format='TIFF', compression="tiff_adobe_deflate")
+        return buffer.getvalue()
+
+    def process(self, index, qr_filename, profile=False):
+        """
+        合成并保存一张图片
+
+        Args:
+            profile: 在 job.profiler 下执行这一个任务，分析结果写到 job.profile_file()
+
+        Returns:
+            dict: ok, output（输出文件名）, output_size, sha256, timings（StageClock.to_dict()）, error；
+            打包模式下还带有 data（编码后的字节），由收集结果的线程写入压缩包
+        """
+        if profile:
+            outcome = run_profiled(self.job.profiler, self.job.profile_file(), self._process, index, qr_filename)
+            outcome["profile"] = self.job.profile_file()
+            return outcome
+        return self._process(index, qr_filename)
+
+    def _process(self, index, qr_filename):
+        output_filename = None
+        clock = StageClock()
+        try:
+            qr_path = self.job.qr_source(qr_filename)
+            output_filename = self.job.output_filename(qr_filename, index)
+            output_path = os.path.join(self.job.output_folder, output_filename)
+            if self.strip_streaming and self.job.write_files:
+                # 边合成边写入临时文件，内存中不保留整张输出
+                with open(output_path + ".tmp", "wb") as f:
+                    self.write_strips(qr_path, f, clock)
+                os.replace(output_path + ".tmp", output_path)
+                clock.lap("write")
+                output_size = os.path.getsize(output_path)
+                sha256 = file_sha256(output_path)
+                clock.lap("hash")
+                data = None
+                if self.job.archive_format:
+                    with open(output_path, "rb") as f:
+                        data = f.read()
+                    clock.skip()
+            else:
+                data = self.render_and_encode(qr_path, clock)
+                if self.job.write_files:
+                    # 先写临时文件再替换：不会留下半个文件，也不会改写硬链接到这里的其它输出
+                    with open(output_path + ".tmp", "wb") as f:
+                        f.write(data)
+                    os.replace(output_path + ".tmp", output_path)
+                    clock.lap("write")
+                output_size = len(data)
+                sha256 = hashlib.sha256(data).hexdigest()
+                clock.lap("hash")
+            if self.job.write_files:
+                clock.bytes_written += output_size
+
+            outcome = {"ok": True, "output": output_filename, "output_size": output_size,
+                       "sha256": sha256, "timings": clock.to_dict()}
+            if data is not None and self.job.archive_format:
+                outcome["data"] = data
+            return outcome
+        except Exception as file_error:
+            print(f"处理文件 {qr_filename} 时出错: {file_error}")
+            if output_filename is not None:
+                # 分条写入中途失败时会留下临时文件
+                temp_path = os.path.join(self.job.output_folder, output_filename) + ".tmp"
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return {"ok": False, "output": output_filename, "error": str(file_error)}
+
+
+# ========== 进程池 ==========
+# 每个子进程在初始化时映射一次共享海报，之后的任务都复用这个合成器
+_worker_compositor = None
+_worker_buffer = None
+
+
+def _init_process_worker(job, buffer_descriptor):
+    global _worker_compositor, _worker_buffer
+    _worker_buffer = SharedPosterBuffer.attach(buffer_descriptor)
+    _worker_compositor = PosterCompositor(job, _worker_buffer.open_image())
+
+
+def _process_in_worker(index, qr_filename, profile=False):
+    return _worker_compositor.process(index, qr_filename, profile)
+
+
+def create_executor(job, shared_buffer=None):
+    """
+    按任务设置创建执行器
+
+    Args:
+        shared_buffer: 进程池模式下必须提供的 SharedPosterBuffer
+
+    Returns:
+        (executor, process_func)，process_func(index, qr_filename, profile=False) 用于提交任务
+    """
+    if job.execution_mode == "process":
+        executor = ProcessPoolExecutor(max_workers=job.worker_count,
+                                       initializer=_init_process_worker,
+                                       initargs=(job.for_worker_process(), shared_buffer.descriptor))
+        return executor, _process_in_worker
+
+    # 线程共享同一张已解码的海报
+    compositor = PosterCompositor(job, job.load_poster())
+    return ThreadPoolExecutor(max_workers=job.worker_count), compositor.process
+
+
+def run_batch(job, progress_callback=None):
+    """
+    执行批量合成
+
+    Args:
+        job: BatchJob
+        progress_callback: 可选，callback(current, total, rate, eta)，在调用线程中执行；
+            rate 为每秒完成张数，eta 为预计剩余秒数（无法估计时为 None）
+
+    Returns:
+        BatchResult
+    """
+    if job.payload_file:
+        # 清单模式：内容本身就是去重和增量更新用的哈希来源
+        payloads = load_payloads(job.payload_file)
+        job.payloads = {payload.name: payload.data for payload in payloads}
+        qr_files = [payload.name for payload in payloads]
+        order = range(len(qr_files))
+        digests = {payload.name: hashlib.sha256(payload.data.encode("utf-8")).hexdigest()
+                   for payload in payloads}
+    else:
+        index = get_folder_index(job.qr_folder, job.recursive)
+        qr_files = index.names
+        order = index.largest_first() if job.largest_first else range(len(qr_files))
+        # 只有大小相同的文件才可能内容相同；增量模式本来就要哈希全部文件
+        digests = {}
+        if job.incremental:
+            digests = index.digests(qr_files, job.worker_count)
+        elif job.deduplicate:
+            digests = index.digests(index.size_collisions(), job.worker_count)
+    collisions = job.output_collisions(qr_files)
+    if collisions:
+        output_filename, inputs = collisions[0]
+        raise ValueError(f"{len(collisions)} 个输出文件名重复，后写入的会覆盖先写入的"
+                         f"（如 {'、'.join(inputs)} 都输出为 {output_filename}），请修改命名模板或输入名称")
+    if job.profiler:
+        require_profiler(job.profiler)
+    result = BatchResult(len(qr_files))
+    poster_size = job.poster_size()
+    result.memory_plan = job.plan_memory(poster_size)
+    result.worker_count = job.worker_count
+    result.requested_workers = job.requested_workers
+    os.makedirs(job.output_folder, exist_ok=True)
+
+    settings = job.settings_dict(None)
+    del settings["poster_sha256"]
+    settings.update(poster_size=list(poster_size), execution_mode=job.execution_mode,
+                    workers=job.worker_count, in_flight=job.in_flight_limit,
+                    memory_budget=result.memory_plan.budget, strip_streaming=job.uses_strips(poster_size),
+                    region_encoding=job.region_encoding, archive_format=job.archive_format, inputs=len(qr_files))
+    if job.output_format == "png":
+        settings["png_profile"] = job.png_profile
+    report = RunReport(settings)
+
+    # 先打开清单：它失败时还没有创建任何需要清理的东西
+    manifest = JobManifest.open(job)
+    shared_buffer = None
+    sink = None
+    try:
+        if job.execution_mode == "process":
+            shared_buffer = SharedPosterBuffer.create(job.load_poster())
+        if job.archive_format:
+            sink = ArchiveSink.for_output_folder(job.output_folder, job.archive_format, job.archive_path)
+            result.archive_path = sink.path
+        executor, process_func = create_executor(job, shared_buffer)
+        _collect_results(executor, process_func, job, ((i, qr_files[i]) for i in order), result, manifest,
+                         ProgressTracker(result.total, progress_callback), sink, digests, report)
+        if job.incremental:
+            result.removed = manifest.remove_stale(set(qr_files), job.output_folder)
+            manifest.compact()
+        report.finish(succeeded=result.success_count, failed=len(result.failed), skipped=result.skipped,
+                      deduplicated=result.deduplicated, removed=result.removed)
+        result.report = report.to_dict()
+        result.report_path = report.save(job.report_file())
+    finally:
+        manifest.close()
+        if sink is not None:
+            sink.close()
+        if shared_buffer is not None:
+            shared_buffer.release()
+
+    return result
+
+
+def _collect_results(executor, process_func, job, tasks, result, manifest, tracker, sink=None, digests=None,
+                     report=None):
+    """
+    有界提交窗口：最多 job.in_flight_limit 个任务在途，按完成顺序收集结果并写入清单
+
+    去重时内容相同的输入只提交第一个，它完成后其余输出直接复用它的结果。
+
+    Args:
+        tasks: 按提交顺序排列的 (文件下标, 文件名)
+        sink: 可选的 ArchiveSink，编码结果按完成顺序写入
+        digests: {文件名: SHA-256}，增量更新和去重使用
+        report: 可选的 RunReport，汇总每个任务的分阶段计时
+    """
+    digests = digests or {}
+    report = report or RunReport()
+    profile_pending = [bool(job.profiler)]  # 只分析第一个实际提交的任务
+    tasks = list(tasks)
+    groups = {}  # SHA-256 -> 内容相同的 [(文件下标, 文件名)]，第一个负责合成
+    if job.deduplicate:
+        for i, qr_filename in tasks:
+            if qr_filename in digests:
+                groups.setdefault(digests[qr_filename], []).append((i, qr_filename))
+    pending = {}  # future -> (文件下标, 文件名, 输入签名)
+    task_iter = iter(tasks)
+
+    def signature_for(qr_filename):
+        if job.payloads is not None:
+            # 清单条目没有文件可以 stat，按内容键判断
+            return {"key": manifest.content_key(digests[qr_filename])}
+        qr_path = os.path.join(job.qr_folder, qr_filename)
+        signature = JobManifest.input_signature(qr_path)
+        if job.incremental:
+            sha256 = digests.get(qr_filename) or file_sha256(qr_path)
+            signature["key"] = manifest.content_key(sha256)
+        return signature
+
+    def skip_if_done(qr_filename, signature, output_filename):
+        if not (job.resume or job.incremental) or not manifest.is_done(
+                qr_filename, signature, output_filename, job.output_folder):
+            return False
+        # 上次的输出仍在，压缩包里也要有它
+        if sink is not None:
+            sink.add_file(output_filename, os.path.join(job.output_folder, output_filename))
+        result.success_count += 1
+        result.skipped += 1
+        tracker.advance()
+        return True
+
+    def duplicates_of(qr_filename):
+        group = groups.get(digests.get(qr_filename), ())
+        return group[1:] if len(group) > 1 and group[0][1] == qr_filename else ()
+
+    def finish_duplicates(qr_filename, outcome, data):
+        """合成（或跳过）一组中的第一个之后，处理同组的其余文件"""
+        duplicates = duplicates_of(qr_filename)
+        if not duplicates:
+            return
+        source = outcome["output"]
+        if data is None and sink is not None and outcome["ok"]:
+            with open(os.path.join(job.output_folder, source), "rb") as f:
+                data = f.read()
+        for i, duplicate in duplicates:
+            signature = signature_for(duplicate)
+            output_filename = job.output_filename(duplicate, i)
+            if skip_if_done(duplicate, signature, output_filename):
+                continue
+            duplicate_outcome = dict(outcome, output=output_filename)
+            if outcome["ok"]:
+                try:
+                    _write_duplicate(job, source, output_filename, data, sink)
+                    result.success_count += 1
+                    result.deduplicated += 1
+                    result.deduplicated_bytes += outcome.get("output_size") or 0
+                except OSError as e:
+                    print(f"复制文件 {output_filename} 时出错: {e}")
+                    duplicate_outcome = {"ok": False, "output": output_filename, "error": str(e)}
+                    result.failed.append(duplicate)
+            else:
+                result.failed.append(duplicate)
+            manifest.record(duplicate, signature, duplicate_outcome)
+            tracker.advance()
+
+    def submit_next():
+        for i, qr_filename in task_iter:
+            digest = digests.get(qr_filename)
+            if job.deduplicate and digest in groups and groups[digest][0][1] != qr_filename:
+                continue  # 由同组的第一个文件负责
+            signature = signature_for(qr_filename)
+            output_filename = job.output_filename(qr_filename, i)
+            if skip_if_done(qr_filename, signature, output_filename):
+                finish_duplicates(qr_filename, {"ok": True, "output": output_filename,
+                                                "output_size": manifest.entries[qr_filename].get("output_size"),
+                                                "sha256": manifest.entries[qr_filename].get("sha256")}, None)
+                continue
+            pending[executor.submit(process_func, i, qr_filename, profile_pending[0])] = (qr_filename, signature)
+            profile_pending[0] = False
+            return True
+        return False
+
+    with executor:
+        while len(pending) < job.in_flight_limit and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                qr_filename, signature = pending.pop(future)
+                outcome = future.result()
+                data = outcome.pop("data", None)
+                timings = outcome.pop("timings", None)
+                if timings is not None:
+                    report.add_task(timings)
+                if outcome.get("profile"):
+                    report.profile_path = outcome.pop("profile")
+                if sink is not None and data is not None:
+                    started = time.perf_counter()
+                    sink.add(outcome["output"], data)
+                    report.add_stage("archive", time.perf_counter() - started)
+                manifest.record(qr_filename, signature, outcome)
+                if outcome["ok"]:
+                    result.success_count += 1
+                else:
+                    result.failed.append(qr_filename)
+                finish_duplicates(qr_filename, outcome, data)
+                submit_next()
+            tracker.advance(len(done))
+
+
+def _write_duplicate(job, source, output_filename, data, sink):
+    """把一组中第一个输出的结果复用为另一个输出：复制或硬链接文件，并写入压缩包"""
+    if job.write_files and source != output_filename:
+        source_path = os.path.join(job.output_folder, source)
+        output_path = os.path.join(job.output_folder, output_filename)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        linked = False
+        if job.hardlink_duplicates:
+            try:
+                os.link(source_path, output_path)
+                linked = True
+            except OSError:
+                pass  # 文件系统不支持硬链接时改为复制
+        if not linked:
+            shutil.copyfile(source_path, output_path)
+    if sink is not None:
+        sink.add_duplicate(output_filename, source, data)
+
+
+def measure_png_profiles(job, sample_size=8, profiles=None):
+    """
+    在批量任务的一小批样本上试算各 PNG 编码档位
+
+    样本在全部输入中均匀抽取；每个档位按正式运行相同的路径（整张、区域编码或分条）
+    编码同一批样本，只统计编码阶段的耗时。
+
+    Returns:
+        {档位: {"encode_seconds": 平均每张编码秒数, "bytes": 平均每张字节数, "samples": 样本数}}
+    """
+    payloads = None
+    if job.payload_file:
+        payloads = {payload.name: payload.data for payload in load_payloads(job.payload_file)}
+        names = list(payloads)
+    else:
+        names = get_folder_index(job.qr_folder, job.recursive).names
+    if not names:
+        raise ValueError("没有可以试算的输入")
+    sample = names[::max(1, len(names) // sample_size)][:sample_size]
+
+    poster = job.load_poster()
+    results = {}
+    for profile in profiles or PNG_PROFILES:
+        trial = copy.copy(job)
+        trial.output_format = "png"
+        trial.png_profile = profile
+        trial.payloads = payloads
+        compositor = PosterCompositor(trial, poster)
+        seconds = 0.0
+        size = 0
+        for name in sample:
+            clock = StageClock()
+            size += len(compositor.render_and_encode(trial.qr_source(name), clock))
+            seconds += clock.stages.get("encode", 0.0)
+        results[profile] = {"encode_seconds": seconds / len(sample), "bytes": size / len(sample),
+                            "samples": len(sample)}
+    return results
+
+
+def format_png_profiles(results, total=None):
+    """试算结果的文字表格；给出 total 时附上整批的预计编码时间"""
+    baseline = results.get(DEFAULT_PNG_PROFILE) or next(iter(results.values()))
+    lines = []
+    for profile, measured in results.items():
+        line = (f"{profile:<10}{measured['encode_seconds'] * 1000:>9.1f} ms/张"
+                f"{measured['bytes'] / 1024:>10.1f} KB/张"
+                f"{(measured['bytes'] / baseline['bytes'] - 1) * 100:>+8.1f}% 大小")
+        if total:
+            line += f"   整批约 {format_duration(measured['encode_seconds'] * total)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# ========== 命令行入口 ==========
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="poster_engine",
+        description="海报批量合成工具（命令行版）：把文件夹中的每张图片合成到海报的指定位置"
+    )
+    parser.add_argument("poster", help="海报图片路径")
+    parser.add_argument("qr_folder", help="被替换图片所在文件夹，或二维码内容清单（.csv/.json）")
+    parser.add_argument("output_folder", help="输出文件夹")
+    parser.add_argument("--x", type=int, required=True, help="放置位置 X（海报原图像素）")
+    parser.add_argument("--y", type=int, required=True, help="放置位置 Y（海报原图像素）")
+    parser.add_argument("--w", type=int, required=True, help="放置宽度")
+    parser.add_argument("--h", type=int, required=True, help="放置高度")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="png", help="输出格式")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG质量 (1-100)")
+    parser.add_argument("--naming", default="{original}",
+                        help="命名模板，可用变量 {original} {number} {prefix} {suffix} {date} {time}")
+    parser.add_argument("--start-number", type=int, default=1, help="序号起始值")
+    parser.add_argument("--prefix", default="", help="前缀")
+    parser.add_argument("--suffix", default="", help="后缀")
+    parser.add_argument("--mode", choices=EXECUTION_MODES, default="thread",
+                        help="并行方式：thread 线程池，process 进程池")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="并行数（默认：线程池最多4个，进程池等于CPU核数）")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="同时提交的任务上限（默认：并行数×4）")
+    parser.add_argument("--memory-budget", default=None,
+                        help="内存预算，如 4G、1500M（默认：可用内存的 70%%）；并行数和在途任务数不会超出预算")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续传：跳过任务清单中已完成且输入和设置都没变的文件")
+    parser.add_argument("--region-encode", action="store_true",
+                        help="只重新编码二维码所在的行（JPEG 按 MCU 行），海报其余部分每批只编码一次")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量更新：按内容哈希只重新合成有变化的文件，并删除输入已移除的输出")
+    parser.add_argument("--recursive", action="store_true", help="包含子文件夹中的图片")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS, default=None,
+                        help="把输出直接写入压缩包（PNG/JPEG 以存储方式写入 ZIP）")
+    parser.add_argument("--archive-path", default=None,
+                        help="压缩包路径（默认：输出文件夹 + 扩展名）")
+    parser.add_argument("--archive-only", action="store_true",
+                        help="只生成压缩包，不保存单独的输出文件（需要同时指定 --archive）")
+    parser.add_argument("--full-decode", action="store_true",
+                        help="总是以原尺寸解码再缩放（默认源图远大于放置尺寸时缩小解码）")
+    parser.add_argument("--smooth-qr", action="store_true",
+                        help="二维码也用 LANCZOS/BILINEAR 缩放（默认两色模块网格按模块最近邻缩放）")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="不合并内容相同的输入（默认只合成一次，其余输出复制结果）")
+    parser.add_argument("--hardlink-duplicates", action="store_true",
+                        help="内容相同的输入的输出用硬链接代替复制")
+    parser.add_argument("--qr-border", type=int, default=4, help="生成二维码时的静区宽度（模块数）")
+    parser.add_argument("--qr-ec", choices=ERROR_CORRECTION_LEVELS, default="M",
+                        help="生成二维码时的纠错等级")
+    parser.add_argument("--keep-order", action="store_true",
+                        help="按文件顺序提交任务（默认先提交大文件）")
+    parser.add_argument("--png-profile", choices=tuple(PNG_PROFILES), default=DEFAULT_PNG_PROFILE,
+                        help="PNG 编码档位：fastest 最快，balanced 折中，smallest 最小（默认），archival 逐个尝试取最小")
+    parser.add_argument("--measure-png-profiles", type=int, nargs="?", const=8, default=None, metavar="N",
+                        help="在 N 个样本（默认 8 个）上试算各 PNG 档位的编码耗时和大小，然后退出")
+    parser.add_argument("--report", default=None,
+                        help=f"运行报告（JSON）的路径（默认：输出文件夹/{RunReport.FILENAME}）")
+    parser.add_argument("--profile", choices=PROFILERS, default=None,
+                        help="用 cProfile 或 pyinstrument 分析第一个实际合成的任务")
+    parser.add_argument("--profile-path", default=None,
+                        help="分析结果路径（默认：输出文件夹/.poster_profile.prof 或 .html）")
+    strips = parser.add_mutually_exclusive_group()
+    strips.add_argument("--strips", dest="strip_streaming", action="store_true", default=None,
+                        help="按行条流式合成和编码（默认海报超过约 1600 万像素时自动启用）")
+    strips.add_argument("--no-strips", dest="strip_streaming", action="store_false",
+                        help="总是整张合成后再编码")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+
+    try:
+        memory_budget = parse_size(args.memory_budget) if args.memory_budget else None
+    except ValueError:
+        print(f"参数错误: 无法识别的内存预算 {args.memory_budget}", file=sys.stderr)
+        return 2
+
+    try:
+        job = BatchJob(
+            args.poster, args.qr_folder, args.output_folder,
+            args.x, args.y, args.w, args.h,
+            output_format=args.format, jpeg_quality=args.quality,
+            naming_pattern=args.naming, naming_start_number=args.start_number,
+            naming_prefix=args.prefix, naming_suffix=args.suffix,
+            max_workers=args.workers, execution_mode=args.mode,
+            max_in_flight=args.max_in_flight, resume=args.resume,
+            incremental=args.incremental, region_encoding=args.region_encode,
+            recursive=args.recursive, largest_first=not args.keep_order,
+            archive_format=args.archive, archive_path=args.archive_path,
+            write_files=not args.archive_only, reduced_decoding=not args.full_decode,
+            module_scaling=not args.smooth_qr, deduplicate=not args.no_dedup,
+            hardlink_duplicates=args.hardlink_duplicates,
+            payload_file=args.qr_folder if is_payload_file(args.qr_folder) else None,
+            qr_border=args.qr_border, qr_error_correction=args.qr_ec,
+            strip_streaming=args.strip_streaming, memory_budget=memory_budget,
+            report_path=args.report, profiler=args.profile, profile_path=args.profile_path,
+            png_profile=args.png_profile
+        )
+    except ValueError as e:
+        print(f"参数错误: {e}", file=sys.stderr)
+        return 2
+
+    if args.measure_png_profiles:
+        try:
+            results = measure_png_profiles(job, args.measure_png_profiles)
+        except Exception as e:
+            print(f"试算失败：{e}", file=sys.stderr)
+            return 1
+        print(f"PNG 编码档位试算（{next(iter(results.values()))['samples']} 个样本）:")
+        print(format_png_profiles(results))
+        return 0
+
+    def report(current, total, rate, eta):
+        eta_text = format_duration(eta) if eta is not None else "--:--"
+        print(f"\r处理中 {current}/{total}  {rate:.1f} 张/秒  剩余 {eta_text}", end="", flush=True)
+
+    try:
+        result = run_batch(job, progress_callback=report)
+    except Exception as e:
+        print(f"\n处理失败：{e}", file=sys.stderr)
+        return 1
+
+    print(f"\n已成功合成 {result.success_count}/{result.total} 张图片")
+    if result.worker_count < result.requested_workers:
+        print(f"受内存预算（{result.memory_plan.budget / 1024 / 1024:.0f} MB）限制，"
+              f"并行数从 {result.requested_workers} 降为 {result.worker_count}")
+    if result.skipped:
+        print(f"其中 {result.skipped} 张在上次运行中已完成，已跳过")
+    if result.removed:
+        print(f"已删除 {result.removed} 个不再对应任何输入的输出文件")
+    if result.deduplicated:
+        print(f"其中 {result.deduplicated} 张与其它输入内容相同，直接复用了结果"
+              f"（省去 {result.deduplicated} 次合成和编码，{result.deduplicated_bytes / 1024 / 1024:.1f} MB 输出）")
+    if result.archive_path:
+        print(f"已写入压缩包: {result.archive_path}")
+    if result.report["stages"]:
+        print(format_report(result.report))
+    print(f"运行报告: {result.report_path}")
+    if result.report["profile"]:
+        print(f"性能分析: {result.report['profile']}")
+    return 0 if not result.failed else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
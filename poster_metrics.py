@@ -0,0 +1,214 @@
+"""
+批量合成的分阶段计时和运行报告
+
+每个任务在工作者中按阶段计时（解码、缩放、合成、编码、写盘……），
+连同读写字节数随结果一起返回；收集线程把它们汇总为每个阶段的
+直方图和 p50/p95/最大值，最后输出为 JSON 报告。
+"""
+import os
+import json
+import math
+import time
+import bisect
+from datetime import datetime
+
+
+# decode: 读取并解码二维码（或由内容生成模块矩阵）；resize: 缩放到放置尺寸；
+# composite: 恢复背景并粘贴；encode: 编码（分条合成时包含写入临时文件）；
+# write: 写盘；hash: 计算输出的 SHA-256；archive: 写入压缩包（收集线程中）
+STAGES = ("decode", "resize", "composite", "encode", "write", "hash", "archive")
+# 直方图的桶上界（秒），大致按 1-2.5-5 递增，最后一个桶收纳其余
+HISTOGRAM_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILERS = ("cprofile", "pyinstrument")
+# 分析结果的默认文件名（放在输出文件夹中）
+PROFILE_FILENAMES = {"cprofile": ".poster_profile.prof", "pyinstrument": ".poster_profile.html"}
+
+
+class StageClock:
+    """
+    一个任务的分阶段计时
+
+    lap(stage) 把上一次 lap（或创建）以来的时间记到 stage 上，
+    同一阶段多次 lap 会累加（分条合成时每一条都分别记到 composite 和 encode）。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def skip(self):
+        """丢弃上一次 lap 以来的时间（不属于任何阶段）"""
+        self._last = time.perf_counter()
+
+    def to_dict(self):
+        return {"stages": self.stages, "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+
+class StageStats:
+    """一个阶段的全部耗时样本"""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        """最近秩百分位数：排序后第 ceil(fraction * n) 个样本"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+        return ordered[rank]
+
+    def histogram(self):
+        """[(上界, 数量)]，上界为 None 的最后一桶收纳超过最大上界的样本"""
+        counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for seconds in self.samples:
+            counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        return list(zip(HISTOGRAM_BOUNDS + (None,), counts))
+
+    def to_dict(self):
+        total = sum(self.samples)
+        return {
+            "count": len(self.samples),
+            "total": total,
+            "mean": total / len(self.samples) if self.samples else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "max": max(self.samples) if self.samples else 0.0,
+            "histogram": [{"le": bound, "count": count} for bound, count in self.histogram() if count],
+        }
+
+
+class RunReport:
+    """
+    一次批量合成的运行报告
+
+    add_task 收集工作者返回的计时，add_stage 记录收集线程自己的阶段（写入压缩包）。
+    """
+
+    FILENAME = ".poster_report.json"
+
+    def __init__(self, settings=None):
+        self.settings = dict(settings or {})
+        self.started = datetime.now()
+        self.start_time = time.monotonic()
+        self.elapsed = None
+        self.stages = {stage: StageStats() for stage in STAGES}
+        self.tasks = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.counts = {}
+        self.profile_path = None
+
+    def add_task(self, timings):
+        self.tasks += 1
+        for stage, seconds in timings["stages"].items():
+            self.add_stage(stage, seconds)
+        self.bytes_read += timings["bytes_read"]
+        self.bytes_written += timings["bytes_written"]
+
+    def add_stage(self, stage, seconds):
+        self.stages.setdefault(stage, StageStats()).add(seconds)
+
+    def finish(self, **counts):
+        """结束计时，counts 为成功、失败、跳过等数量"""
+        self.elapsed = time.monotonic() - self.start_time
+        self.counts.update(counts)
+
+    def to_dict(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self.start_time
+        completed = self.counts.get("succeeded", self.tasks)
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "elapsed": elapsed,
+            "images_per_second": completed / elapsed if elapsed > 0 else 0.0,
+            "tasks_encoded": self.tasks,
+            "counts": self.counts,
+            "settings": self.settings,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "stages": {stage: stats.to_dict() for stage, stats in self.stages.items() if stats.samples},
+            "profile": self.profile_path,
+        }
+
+    def save(self, path):
+        """写入 JSON 报告（先写临时文件再替换）"""
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+
+def summary_rows(report):
+    """
+    报告中每个阶段一行，供界面和命令行显示
+
+    Args:
+        report: RunReport.to_dict() 的结果（或读回的 JSON）
+
+    Returns:
+        [(阶段, 次数, p50 毫秒, p95 毫秒, 最大毫秒, 占全部阶段耗时的百分比)]，按总耗时从大到小
+    """
+    stages = report["stages"]
+    total = sum(stats["total"] for stats in stages.values()) or 1.0
+    rows = [(stage, stats["count"], stats["p50"] * 1000, stats["p95"] * 1000, stats["max"] * 1000,
+             stats["total"] / total * 100) for stage, stats in stages.items()]
+    rows.sort(key=lambda row: -row[5])
+    return rows
+
+
+def format_report(report):
+    """报告的文字摘要（命令行输出用）"""
+    # 中文表头每个字占两列宽
+    lines = [f"{'阶段':<10}{'次数':>5}{'p50 ms':>10}{'p95 ms':>10}{'最大 ms':>8}{'占比':>6}"]
+    for stage, count, p50, p95, maximum, share in summary_rows(report):
+        lines.append(f"{stage:<12}{count:>7}{p50:>10.1f}{p95:>10.1f}{maximum:>10.1f}{share:>7.1f}%")
+    lines.append(f"读取 {report['bytes_read'] / 1024 / 1024:.1f} MB，写入 {report['bytes_written'] / 1024 / 1024:.1f} MB，"
+                 f"{report['images_per_second']:.1f} 张/秒")
+    return "\n".join(lines)
+
+
+def run_profiled(profiler, path, func, *args):
+    """
+    在分析器下执行 func(*args)，把结果写到 path
+
+    cprofile 写 pstats 文件（python -m pstats 或 snakeviz 查看），pyinstrument 写 HTML。
+    """
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            return func(*args)
+        finally:
+            profile.stop()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profile.output_html())
+
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        profile.dump_stats(path)
+
+
+def require_profiler(profiler):
+    """检查分析器是否可用，不可用时报错（在任务开始前调用）"""
+    if profiler not in PROFILERS:
+        raise ValueError(f"不支持的分析器: {profiler}")
+    if profiler == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            raise RuntimeError("使用 pyinstrument 分析需要先运行: pip install pyinstrument")
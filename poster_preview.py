@@ -0,0 +1,273 @@
+"""
+预览画布的图片渲染（与 tkinter 无关）
+
+交互编辑时需要在每次拖动、平移、缩放后重新生成预览图，
+这里的工具保证每次重绘的开销只与画布大小有关，而与海报原图大小无关。
+"""
+import math
+import threading
+import time
+
+from PIL import Image
+
+
+class ImagePyramid:
+    """
+    预览用的多级缩略图（mipmap）
+
+    第 0 级是原图，之后每级宽高减半，直到长边小于 MIN_SIZE。
+    绘制时从不小于目标尺寸的最小一级开始缩放，而不是每次都缩放原图。
+    """
+
+    MIN_SIZE = 256
+    FILTER_MARGIN = 8  # 裁剪时为缩放滤波器保留的边距（像素）
+
+    def __init__(self, image):
+        self.image = image
+        self.levels = [image]
+        level = image
+        while max(level.size) // 2 >= self.MIN_SIZE:
+            level = level.reduce(2)
+            self.levels.append(level)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def level_for(self, target_w, target_h):
+        """返回宽高都不小于目标尺寸的最小一级"""
+        for level in reversed(self.levels):
+            if level.width >= target_w and level.height >= target_h:
+                return level
+        return self.image
+
+    def render_clipped(self, dest_x, dest_y, dest_w, dest_h, clip_w, clip_h,
+                       resample=Image.Resampling.LANCZOS):
+        """
+        把整张图拉伸到画布矩形 (dest_x, dest_y, dest_w, dest_h) 上，只渲染画布内可见的部分
+
+        放大查看时只裁剪并缩放可见区域，开销与画布大小成正比，而不是原图尺寸×缩放倍数的平方。
+
+        Args:
+            clip_w, clip_h: 画布尺寸
+
+        Returns:
+            (image, x, y)：可见部分的图片及其在画布上的左上角坐标；完全不可见时返回 None
+        """
+        if dest_w <= 0 or dest_h <= 0:
+            return None
+        x0 = max(0, math.floor(dest_x))
+        y0 = max(0, math.floor(dest_y))
+        x1 = min(clip_w, math.ceil(dest_x + dest_w))
+        y1 = min(clip_h, math.ceil(dest_y + dest_h))
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        level = self.level_for(math.ceil(dest_w), math.ceil(dest_h))
+        sx = level.width / dest_w
+        sy = level.height / dest_h
+        box = (max(0.0, (x0 - dest_x) * sx), max(0.0, (y0 - dest_y) * sy),
+               min(level.width, (x1 - dest_x) * sx), min(level.height, (y1 - dest_y) * sy))
+
+        # 先裁出可见区域（带滤波边距），否则 RGBA 缩放会先对整级图片做预乘
+        margin = self.FILTER_MARGIN
+        left = max(0, math.floor(box[0]) - margin)
+        top = max(0, math.floor(box[1]) - margin)
+        right = min(level.width, math.ceil(box[2]) + margin)
+        bottom = min(level.height, math.ceil(box[3]) + margin)
+        region = level.crop((left, top, right, bottom))
+        box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+        return region.resize((x1 - x0, y1 - y0), resample, box=box), x0, y0
+
+
+class PreviewLayer:
+    """
+    画布上一张图片的渲染缓存（与 tkinter 无关）
+
+    每次渲染覆盖可见区域外加一圈预留边距。图片和显示尺寸不变、
+    新的可见区域仍在已渲染范围内时（拖动、平移），只需要移动画布上的图片项，不重新缩放。
+
+    交互过程中可以用快速滤波（draft_resample）先出图，之后再用 render + install
+    在后台换成高质量结果；needs_refine 表示当前图片还不是高质量的。
+    """
+
+    def __init__(self, overscan=0.5):
+        self.overscan = overscan  # 预留边距，按画布尺寸的比例
+        self.image = None  # 最近一次渲染的图片
+        self.resample = None  # 最近一次渲染使用的滤波
+        self.needs_refine = False
+        self._source = None
+        self._key = None
+        self._region = None  # 已渲染范围，在目标矩形坐标系中 (x0, y0, x1, y1)
+        self._installed = False  # install 之后还没有被 update 取走
+
+    def invalidate(self):
+        self.image = None
+        self.resample = None
+        self.needs_refine = False
+        self._source = None
+        self._key = None
+        self._region = None
+        self._installed = False
+
+    def _visible(self, dest_x, dest_y, dest_w, dest_h, clip_w, clip_h):
+        """可见区域（目标矩形坐标系），完全不可见时返回 None"""
+        if dest_w <= 0 or dest_h <= 0:
+            return None
+        vx0 = max(0, math.floor(-dest_x))
+        vy0 = max(0, math.floor(-dest_y))
+        vx1 = min(math.ceil(dest_w), math.ceil(clip_w - dest_x))
+        vy1 = min(math.ceil(dest_h), math.ceil(clip_h - dest_y))
+        if vx1 <= vx0 or vy1 <= vy0:
+            return None
+        return vx0, vy0, vx1, vy1
+
+    def render(self, pyramid, dest_x, dest_y, dest_w, dest_h, clip_w, clip_h,
+               resample=Image.Resampling.LANCZOS):
+        """
+        渲染可见区域加预留边距，不修改缓存（可以在后台线程中调用）
+
+        Returns:
+            交给 install 的渲染结果；完全不可见时返回 None
+        """
+        visible = self._visible(dest_x, dest_y, dest_w, dest_h, clip_w, clip_h)
+        if visible is None:
+            return None
+        vx0, vy0, vx1, vy1 = visible
+        margin_x = int(clip_w * self.overscan)
+        margin_y = int(clip_h * self.overscan)
+        region = (max(0, vx0 - margin_x), max(0, vy0 - margin_y),
+                  min(math.ceil(dest_w), vx1 + margin_x), min(math.ceil(dest_h), vy1 + margin_y))
+        rendered = pyramid.render_clipped(-region[0], -region[1], dest_w, dest_h,
+                                          region[2] - region[0], region[3] - region[1], resample)
+        if rendered is None:
+            return None
+        return rendered[0], pyramid, (dest_w, dest_h), region, resample
+
+    def install(self, rendered, final=True):
+        """
+        换上 render 的结果
+
+        Args:
+            final: 是否为高质量结果
+        """
+        self.image, self._source, self._key, self._region, self.resample = rendered
+        self.needs_refine = not final
+        self._installed = True
+
+    def matches(self, rendered):
+        """渲染结果是否仍对应当前的图片和显示尺寸"""
+        return rendered[1] is self._source and rendered[2] == self._key
+
+    def update(self, pyramid, dest_x, dest_y, dest_w, dest_h, clip_w, clip_h,
+               resample=Image.Resampling.LANCZOS, draft_resample=None):
+        """
+        按新的位置和尺寸更新图层
+
+        Args:
+            draft_resample: 交互过程中使用的快速滤波，需要重新渲染时用它代替 resample，
+                并标记 needs_refine；等待替换的快速结果在位置变化时照常复用
+
+        Returns:
+            (changed, x, y)：changed 表示 self.image 是否重新渲染过，(x, y) 为图片在画布上的左上角；
+            完全不可见时返回 None
+        """
+        visible = self._visible(dest_x, dest_y, dest_w, dest_h, clip_w, clip_h)
+        if visible is None:
+            return None
+        vx0, vy0, vx1, vy1 = visible
+
+        region = self._region
+        covered = (self._source is pyramid and self._key == (dest_w, dest_h) and region is not None and
+                   region[0] <= vx0 and region[1] <= vy0 and region[2] >= vx1 and region[3] >= vy1 and
+                   (self.needs_refine or self.resample == resample))
+        changed = self._installed
+        if not covered:
+            rendered = self.render(pyramid, dest_x, dest_y, dest_w, dest_h, clip_w, clip_h,
+                                   resample if draft_resample is None else draft_resample)
+            if rendered is None:
+                return None
+            self.install(rendered, final=draft_resample is None or draft_resample == resample)
+            region = self._region
+            changed = True
+        self._installed = False
+        return changed, dest_x + region[0], dest_y + region[1]
+
+
+class BackgroundRefiner:
+    """
+    在后台线程中生成高质量预览
+
+    每次提交都会让之前尚未完成的任务作废；结果通过 root.after 回到主线程，
+    只有最新一次提交的结果会交给回调。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.generation = 0
+
+    def submit(self, jobs, on_done):
+        """
+        Args:
+            jobs: 无参数的渲染函数列表，在后台线程中依次执行
+            on_done: on_done(results)，在主线程中调用
+        """
+        self.generation += 1
+        generation = self.generation
+
+        def work():
+            results = [job() for job in jobs]
+            self.root.after(0, lambda: generation == self.generation and on_done(results))
+
+        threading.Thread(target=work, daemon=True).start()
+
+
+class FrameScheduler:
+    """
+    预览画布的渲染调度器
+
+    鼠标事件只标记需要更新的部分，真正的渲染在空闲时执行，每帧最多一次，
+    并受帧率上限约束；两帧之间的多次请求合并为一次，中间状态直接丢弃。
+
+    Args:
+        root: 提供 after(ms, func) 和 after_idle(func) 的对象（如 tk.Tk）
+        render: render(parts)，parts 为本帧需要更新的部分名称集合
+        max_fps: 帧率上限
+    """
+
+    def __init__(self, root, render, max_fps=60):
+        self.root = root
+        self.render = render
+        self.frame_interval = 1.0 / max_fps
+        self._pending = set()
+        self._scheduled = False
+        self._last_frame = 0.0
+
+    def request(self, *parts):
+        """标记需要更新的部分（默认 "canvas"），并安排下一帧"""
+        self._pending.update(parts or ("canvas",))
+        if self._scheduled:
+            return
+        self._scheduled = True
+        wait = self.frame_interval - (time.monotonic() - self._last_frame)
+        if wait > 0:
+            self.root.after(int(wait * 1000) + 1, lambda: self.root.after_idle(self._run))
+        else:
+            self.root.after_idle(self._run)
+
+    def _run(self):
+        self._scheduled = False
+        if not self._pending:
+            return
+        parts = self._pending
+        self._pending = set()
+        self._last_frame = time.monotonic()
+        self.render(parts)
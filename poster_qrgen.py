@@ -0,0 +1,126 @@
+"""
+从内容清单直接生成二维码
+
+清单是 CSV 或 JSON，每条包含二维码内容（通常是网址）和输出名称。
+二维码在内存中编码为模块矩阵，直接按放置尺寸最近邻放大后合成，
+不再经过“生成 PNG → 写盘 → 读取 → 解码”这一轮。
+
+编码使用可选依赖 qrcode（pip install qrcode）。
+"""
+import os
+import csv
+import json
+
+from PIL import Image
+
+
+PAYLOAD_EXTENSIONS = (".csv", ".json")
+# 识别为“内容”和“名称”的列名/键名（不区分大小写）
+DATA_KEYS = ("url", "data", "payload", "content", "link", "网址", "内容", "链接")
+NAME_KEYS = ("name", "filename", "output", "id", "名称", "文件名")
+ERROR_CORRECTION_LEVELS = ("L", "M", "Q", "H")
+
+
+def is_payload_file(path):
+    return bool(path) and os.path.isfile(path) and path.lower().endswith(PAYLOAD_EXTENSIONS)
+
+
+class QrPayload:
+    """清单中的一条：输出名称和二维码内容"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+def _pick(record, keys):
+    lowered = {str(key).strip().lower(): value for key, value in record.items()}
+    for key in keys:
+        value = lowered.get(key)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def _read_csv(path):
+    # utf-8-sig 兼容 Excel 导出的带 BOM 的 CSV
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [row for row in csv.reader(f) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    if any(key in header for key in DATA_KEYS):
+        return [(_pick(dict(zip(header, row)), NAME_KEYS), _pick(dict(zip(header, row)), DATA_KEYS))
+                for row in rows[1:]]
+    # 没有表头：第一列为内容，第二列（可选）为名称
+    return [(row[1].strip() if len(row) > 1 and row[1].strip() else None, row[0].strip()) for row in rows]
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        content = json.load(f)
+    if isinstance(content, dict):
+        # {"名称": "内容", ...}
+        return [(str(name), str(data)) for name, data in content.items()]
+    records = []
+    for item in content:
+        if isinstance(item, dict):
+            records.append((_pick(item, NAME_KEYS), _pick(item, DATA_KEYS)))
+        else:
+            records.append((None, str(item)))
+    return records
+
+
+def load_payloads(path):
+    """
+    读取内容清单
+
+    CSV：带表头时按列名识别（url/data/内容 …，name/filename/名称 …），
+    没有表头时第一列为内容、第二列为名称。
+    JSON：对象列表 [{"url": ..., "name": ...}]、字符串列表，或 {"名称": "内容"}。
+    没有名称的条目按序号命名。
+
+    Returns:
+        [QrPayload]，按清单顺序
+    """
+    if path.lower().endswith(".json"):
+        records = _read_json(path)
+    else:
+        records = _read_csv(path)
+
+    payloads = []
+    seen = set()
+    width = len(str(len(records)))
+    for number, (name, data) in enumerate(records, start=1):
+        if not data:
+            raise ValueError(f"第 {number} 条没有二维码内容")
+        name = name or str(number).zfill(width)
+        if name in seen:
+            raise ValueError(f"名称重复: {name}")
+        seen.add(name)
+        payloads.append(QrPayload(name, data))
+    return payloads
+
+
+def qr_modules(data, border=4, error_correction="M"):
+    """
+    把内容编码为二维码，返回每个模块一个像素的图片（"L" 模式，黑 0 白 255，含静区）
+    """
+    try:
+        import qrcode
+    except ImportError:
+        raise RuntimeError("生成二维码需要 qrcode 库，请先运行: pip install qrcode")
+
+    levels = {
+        "L": qrcode.constants.ERROR_CORRECT_L,
+        "M": qrcode.constants.ERROR_CORRECT_M,
+        "Q": qrcode.constants.ERROR_CORRECT_Q,
+        "H": qrcode.constants.ERROR_CORRECT_H,
+    }
+    code = qrcode.QRCode(border=border, error_correction=levels[error_correction])
+    code.add_data(data)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    size = len(matrix)
+    pixels = bytes(0 if dark else 255 for row in matrix for dark in row)
+    return Image.frombytes("L", (size, size), pixels)
@@ -0,0 +1,116 @@
+"""poster_archive 并行打包的往返测试：生成的每一卷都要能被 zipfile 完整读回"""
+import os
+import random
+import struct
+import zipfile
+
+from poster_archive import PreparedEntry, ZipVolumeWriter, ZIP_MAX_ENTRIES, build_zip_archive
+
+
+def make_folder(root):
+    """
+    一个输出文件夹：可压缩的文本、已压缩的图片、随机数据、空文件、子文件夹，
+    以及打包时应跳过的记录文件和临时文件
+
+    Returns:
+        {压缩包内路径: 内容}，只含应该打包的文件
+    """
+    rng = random.Random(7)
+    folder = os.path.join(root, "out")
+    os.makedirs(os.path.join(folder, "sub"))
+    files = {
+        "notes.txt": b"poster batch\n" * 400,
+        "a.png": rng.randbytes(3000),
+        "random.bin": rng.randbytes(5000),
+        "empty.txt": b"",
+        "sub/b.jpg": rng.randbytes(1200),
+        "sub/海报.txt": "中文名称\n".encode("utf-8") * 50,
+    }
+    skipped = [".poster_manifest.jsonl", ".poster_report.json", ".poster_profile.prof", "a.png.tmp"]
+    for name, data in files.items():
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(data)
+    for name in skipped:
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(b"{}")
+    return folder, {"out/" + name: data for name, data in files.items()}
+
+
+def read_volumes(volumes):
+    """检查每一卷并返回 {压缩包内路径: 内容}"""
+    contents = {}
+    for volume in volumes:
+        with zipfile.ZipFile(volume) as archive:
+            assert archive.testzip() is None
+            for name in archive.namelist():
+                assert name not in contents
+                contents[name] = archive.read(name)
+    return contents
+
+
+def test_single_archive_round_trip(tmp_path):
+    folder, expected = make_folder(str(tmp_path))
+    volumes = build_zip_archive(folder, str(tmp_path / "out.zip"), max_workers=3)
+    assert volumes == [str(tmp_path / "out.zip")]
+    assert read_volumes(volumes) == expected
+
+    with zipfile.ZipFile(volumes[0]) as archive:
+        methods = {info.filename: info.compress_type for info in archive.infolist()}
+    assert methods["out/notes.txt"] == zipfile.ZIP_DEFLATED
+    assert methods["out/a.png"] == zipfile.ZIP_STORED
+    assert methods["out/random.bin"] == zipfile.ZIP_STORED
+
+
+def test_split_volumes_round_trip(tmp_path):
+    folder, expected = make_folder(str(tmp_path))
+    volume_size = 4096
+    volumes = build_zip_archive(folder, str(tmp_path / "out.zip"), max_workers=2, volume_size=volume_size)
+    assert len(volumes) > 1
+    assert read_volumes(volumes) == expected
+    # 单个条目比卷还大时独占一卷，其余每卷都不超过分卷大小
+    for volume in volumes:
+        with zipfile.ZipFile(volume) as archive:
+            if len(archive.namelist()) > 1:
+                assert os.path.getsize(volume) <= volume_size
+
+
+def test_output_does_not_depend_on_worker_count(tmp_path):
+    folder, _ = make_folder(str(tmp_path))
+    one = build_zip_archive(folder, str(tmp_path / "one.zip"), max_workers=1)
+    four = build_zip_archive(folder, str(tmp_path / "four.zip"), max_workers=4)
+    with open(one[0], "rb") as a, open(four[0], "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_empty_folder_gives_valid_archive(tmp_path):
+    folder = tmp_path / "empty"
+    folder.mkdir()
+    volumes = build_zip_archive(str(folder), str(tmp_path / "empty.zip"))
+    assert read_volumes(volumes) == {}
+
+
+def test_zip64_end_record_for_many_entries(tmp_path):
+    path = str(tmp_path / "many.zip")
+    writer = ZipVolumeWriter(path)
+    count = ZIP_MAX_ENTRIES + 2
+    for i in range(count):
+        data = str(i).encode("ascii")
+        writer.add(PreparedEntry(f"{i:06d}.txt", data, zipfile.ZIP_STORED, zipfile.crc32(data), len(data), 0))
+    writer.close()
+
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        assert len(infos) == count
+        assert archive.testzip() is None
+        assert archive.read(infos[-1]) == str(count - 1).encode("ascii")
+
+    # zipfile 按中央目录大小读取，不依赖条目数，所以另外检查 ZIP64 结束记录和定位器
+    with open(path, "rb") as f:
+        data = f.read()
+    locator = data[-22 - 20:-22]
+    signature, _, zip64_end, _ = struct.unpack("<IIQI", locator)
+    assert signature == 0x07064b50
+    record = struct.unpack("<IQHHIIQQQQ", data[zip64_end:zip64_end + 56])
+    assert record[0] == 0x06064b50
+    assert record[6] == record[7] == count
+    assert struct.unpack("<H", data[-22 + 10:-22 + 12])[0] == 0xFFFF
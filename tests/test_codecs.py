@@ -0,0 +1,247 @@
+"""
+poster_codecs 中各编码器的往返测试
+
+每个编码器的输出都要能被 Pillow（以及 zlib 的校验）正常读回，
+解码后的像素与把整张图片交给 Pillow 编码的结果相同。
+"""
+import io
+import random
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+import poster_codecs
+from poster_codecs import (PngRegionEncoder, JpegRegionEncoder,
+                           PngStripWriter, JpegStripWriter, TiffStripWriter)
+
+
+def noise_image(size, mode="RGBA", seed=1):
+    """固定种子的随机像素（最难压缩，也最容易暴露拼接错误）"""
+    rng = random.Random(seed)
+    return Image.frombytes(mode, size, rng.randbytes(size[0] * size[1] * len(mode)))
+
+
+def pasted(poster, band, top):
+    """把 band 贴到 poster 的第 top 行开始处，返回新图片"""
+    image = poster.copy()
+    image.paste(band, (0, top))
+    return image
+
+
+def decoded_png_stream(data):
+    """检查每个块的 CRC，并用 zlib 解压全部 IDAT（同时校验 Adler-32），返回滤波后的行数据"""
+    assert data.startswith(poster_codecs.PNG_SIGNATURE)
+    pos = len(poster_codecs.PNG_SIGNATURE)
+    idat = []
+    chunk_type = None
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        chunk_type = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        crc, = struct.unpack(">I", data[pos + 8 + length:pos + 12 + length])
+        assert crc == zlib.crc32(chunk_type + body) & 0xffffffff, chunk_type
+        if chunk_type == b"IDAT":
+            idat.append(body)
+        pos += 12 + length
+    assert chunk_type == b"IEND"
+    return zlib.decompress(b"".join(idat))
+
+
+def jpeg_bytes(image, quality=95, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, restart_marker_rows=1, **options)
+    return buffer.getvalue()
+
+
+def write_strips(writer, image, rows):
+    """按 rows 行一条把 image 从上到下送入写入器"""
+    for top in range(0, image.height, rows):
+        writer.write(image.crop((0, top, image.width, min(image.height, top + rows))))
+    writer.close()
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+# 变化区域在海报中的位置：贴上边、贴下边、整张、中间、第一行、最后一行
+PLACEMENTS = ("top", "bottom", "whole", "middle", "first_row", "last_row")
+
+
+def band_rows(placement, height):
+    return {
+        "top": (0, height // 3),
+        "bottom": (height - height // 3, height),
+        "whole": (0, height),
+        "middle": (height // 3, height // 3 + 7),
+        "first_row": (0, 1),
+        "last_row": (height - 1, height),
+    }[placement]
+
+
+# ========== PNG 区域编码 ==========
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("size", [(97, 61), (64, 33)])
+@pytest.mark.parametrize("placement", PLACEMENTS)
+def test_png_region_matches_full_image(mode, size, placement):
+    width, height = size
+    top, bottom = band_rows(placement, height)
+    poster = noise_image(size, mode, seed=1)
+    encoder = PngRegionEncoder(poster, top, bottom)
+    for seed in (2, 3):
+        band = noise_image((width, bottom - top), mode, seed=seed)
+        data = encoder.encode(band)
+
+        decoded_png_stream(data)
+        image = decode(data)
+        assert image.size == size and image.mode == mode
+        assert image.tobytes() == pasted(poster, band, top).tobytes()
+
+
+def test_png_region_keeps_icc_profile():
+    poster = Image.new("RGBA", (120, 90), (200, 40, 40, 255))
+    poster.info["icc_profile"] = b"not a real profile"
+    band = noise_image((120, 10), "RGBA")
+    encoder = PngRegionEncoder(poster, 40, 50, compress_level=6)
+    data = encoder.encode(band)
+
+    image = decode(data)
+    assert image.info.get("icc_profile") == b"not a real profile"
+    assert image.tobytes() == pasted(poster, band, 40).tobytes()
+
+
+def test_png_region_rejects_mismatched_band():
+    encoder = PngRegionEncoder(noise_image((50, 40)), 10, 20)
+    with pytest.raises(ValueError):
+        encoder.encode(noise_image((50, 11)))
+    with pytest.raises(ValueError):
+        encoder.encode(noise_image((50, 10), "RGB"))
+    with pytest.raises(ValueError):
+        PngRegionEncoder(noise_image((50, 40)), 30, 41)
+
+
+# ========== JPEG 区域编码 ==========
+@pytest.mark.parametrize("size", [(101, 77), (64, 48), (40, 200)])
+@pytest.mark.parametrize("placement", PLACEMENTS)
+@pytest.mark.parametrize("quality", [95, 60])
+def test_jpeg_region_is_identical_to_full_encode(size, placement, quality):
+    width, height = size
+    qr_top, qr_bottom = band_rows(placement, height)
+    poster = noise_image(size, "RGB", seed=1)
+    encoder = JpegRegionEncoder(poster, qr_top, qr_bottom, quality)
+    assert encoder.band_top <= qr_top and qr_bottom <= encoder.band_bottom
+
+    qr = noise_image((width, qr_bottom - qr_top), "RGB", seed=2)
+    expected = pasted(poster, qr, qr_top)
+    data = encoder.encode(expected.crop((0, encoder.band_top, width, encoder.band_bottom)))
+
+    # 与整张图用同样参数编码的结果逐字节相同，解码后自然也相同
+    assert data == jpeg_bytes(expected, quality)
+    image = decode(data)
+    assert image.size == size
+
+
+def test_jpeg_region_renumbers_restart_markers_past_eight_rows():
+    # 30 个 MCU 行，RST 编号要循环好几轮
+    poster = noise_image((48, 480), "RGB", seed=4)
+    encoder = JpegRegionEncoder(poster, 250, 270)
+    qr = noise_image((48, 20), "RGB", seed=5)
+    expected = pasted(poster, qr, 250)
+    data = encoder.encode(expected.crop((0, encoder.band_top, 48, encoder.band_bottom)))
+    assert data == jpeg_bytes(expected)
+
+
+def test_jpeg_region_rejects_mismatched_band():
+    encoder = JpegRegionEncoder(noise_image((64, 64), "RGB"), 20, 30)
+    with pytest.raises(ValueError):
+        encoder.encode(noise_image((64, 10), "RGB"))
+    with pytest.raises(ValueError):
+        JpegRegionEncoder(noise_image((64, 64), "RGBA"), 20, 30)
+
+
+# ========== 分条写入器 ==========
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("size", [(97, 61), (33, 256)])
+@pytest.mark.parametrize("rows", [16, 7, 1, 1000])
+def test_png_strips_match_full_image(mode, size, rows):
+    image = noise_image(size, mode)
+    out = io.BytesIO()
+    write_strips(PngStripWriter(out, size[0], size[1], mode), image, rows)
+
+    decoded_png_stream(out.getvalue())
+    decoded = decode(out.getvalue())
+    assert decoded.size == size and decoded.mode == mode
+    assert decoded.tobytes() == image.tobytes()
+
+
+def test_png_strips_split_idat_and_keep_icc_profile(monkeypatch):
+    monkeypatch.setattr(poster_codecs, "IDAT_CHUNK_SIZE", 100)
+    image = noise_image((300, 200), "RGB")
+    out = io.BytesIO()
+    write_strips(PngStripWriter(out, 300, 200, "RGB", icc_profile=b"not a real profile", compress_level=1),
+                 image, 16)
+
+    assert out.getvalue().count(b"IDAT") > 1
+    decoded_png_stream(out.getvalue())
+    decoded = decode(out.getvalue())
+    assert decoded.info.get("icc_profile") == b"not a real profile"
+    assert decoded.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize("size", [(101, 77), (64, 48), (40, 200)])
+@pytest.mark.parametrize("rows", [16, 32, 256])
+def test_jpeg_strips_are_identical_to_full_encode(size, rows):
+    image = noise_image(size, "RGB")
+    out = io.BytesIO()
+    write_strips(JpegStripWriter(out, size[0], size[1], quality=90), image, rows)
+
+    assert out.getvalue() == jpeg_bytes(image, 90)
+    assert decode(out.getvalue()).size == size
+
+
+def test_jpeg_strips_reject_unaligned_strips():
+    writer = JpegStripWriter(io.BytesIO(), 64, 64)
+    writer.write(noise_image((64, 10), "RGB"))
+    with pytest.raises(ValueError):
+        writer.write(noise_image((64, 16), "RGB"))
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("size", [(97, 61), (33, 256)])
+@pytest.mark.parametrize("rows", [16, 7, 1000])
+def test_tiff_strips_match_full_image(mode, size, rows):
+    image = noise_image(size, mode)
+    out = io.BytesIO()
+    out.write(b"prefix")  # 写入器的偏移相对于自己的起始位置
+    write_strips(TiffStripWriter(out, size[0], size[1], mode), image, rows)
+
+    decoded = decode(out.getvalue()[len(b"prefix"):])
+    assert decoded.size == size and decoded.mode == mode
+    assert decoded.tobytes() == image.tobytes()
+
+
+def test_tiff_strips_keep_icc_profile():
+    image = noise_image((20, 20), "RGB")
+    out = io.BytesIO()
+    write_strips(TiffStripWriter(out, 20, 20, "RGB", icc_profile=b"odd-length profile"), image, 8)
+    decoded = decode(out.getvalue())
+    assert decoded.info.get("icc_profile") == b"odd-length profile"
+    assert decoded.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize("make_writer", [
+    lambda out: PngStripWriter(out, 30, 20, "RGB"),
+    lambda out: JpegStripWriter(out, 30, 20),
+    lambda out: TiffStripWriter(out, 30, 20, "RGB"),
+])
+def test_strip_writers_check_shape_and_row_count(make_writer):
+    writer = make_writer(io.BytesIO())
+    with pytest.raises(ValueError):
+        writer.write(noise_image((31, 10), "RGB"))
+    writer.write(noise_image((30, 16), "RGB"))
+    with pytest.raises(ValueError):
+        writer.close()
@@ -0,0 +1,246 @@
+"""poster_engine 的批量合成：二维码识别、续传、增量更新和去重"""
+import os
+import shutil
+
+import pytest
+from PIL import Image, ImageDraw, ImageOps
+
+import poster_engine
+
+
+def qr_grid(modules=21, border=4, seed=0):
+    """每个模块一个像素的类二维码网格（"L"，黑 0 白 255）：三个角上是定位图形，其余模块按种子交替"""
+    size = modules + border * 2
+    grid = Image.new("L", (size, size), 255)
+    draw = ImageDraw.Draw(grid)
+    for row in range(modules):
+        for column in range(modules):
+            if (row * 7 + column * 3 + seed) % 5 < 2:
+                draw.point((border + column, border + row), 0)
+    for top, left in ((0, 0), (0, modules - 7), (modules - 7, 0)):
+        x, y = border + left, border + top
+        draw.rectangle((x - 1, y - 1, x + 7, y + 7), fill=255)
+        draw.rectangle((x, y, x + 6, y + 6), fill=0)
+        draw.rectangle((x + 1, y + 1, x + 5, y + 5), fill=255)
+        draw.rectangle((x + 2, y + 2, x + 4, y + 4), fill=0)
+    return grid
+
+
+def scaled(grid, module_pixels, mode="RGBA"):
+    size = (grid.width * module_pixels, grid.height * module_pixels)
+    return grid.resize(size, Image.Resampling.NEAREST).convert(mode)
+
+
+# ========== 二维码模块网格识别 ==========
+@pytest.mark.parametrize("module_pixels", [1, 3, 10])
+@pytest.mark.parametrize("mode", ["RGBA", "RGB", "L", "1"])
+def test_detects_qr_module_grid(module_pixels, mode):
+    assert poster_engine.detect_module_grid(scaled(qr_grid(), module_pixels, mode)) == (29, 29)
+
+
+def test_detects_inverted_and_transparent_qr():
+    grid = qr_grid()
+    assert poster_engine.detect_module_grid(scaled(ImageOps.invert(grid), 4, "L")) == (29, 29)
+    transparent = Image.new("RGBA", (29 * 4, 29 * 4), (0, 0, 0, 0))
+    transparent.paste((0, 0, 0, 255), mask=ImageOps.invert(scaled(grid, 4, "L")))
+    assert poster_engine.detect_module_grid(transparent) == (29, 29)
+
+
+def test_rejects_two_colour_images_that_are_not_qr_codes():
+    circle = Image.new("L", (120, 120), 255)
+    ImageDraw.Draw(circle).ellipse((10, 10, 110, 110), fill=0)
+    assert poster_engine.detect_module_grid(circle) is None
+    assert poster_engine.detect_module_grid(scaled(circle, 2, "L")) is None
+
+    no_finder = qr_grid()
+    ImageDraw.Draw(no_finder).rectangle((4, 4, 10, 10), fill=255)
+    assert poster_engine.detect_module_grid(scaled(no_finder, 5)) is None
+
+    noisy = scaled(qr_grid(), 5)
+    noisy.putpixel((52, 53), (128, 128, 128, 255))
+    assert poster_engine.detect_module_grid(noisy) is None
+
+
+# ========== 续传、增量更新和去重 ==========
+# 这些路径会删除或覆盖用户文件夹中的输出，用很小的海报和二维码跑真实的批处理
+def write_qr(path, seed):
+    scaled(qr_grid(seed=seed), 3, "RGB").save(path)
+
+
+@pytest.fixture
+def batch(tmp_path):
+    """海报、4 个二维码（q0.png … q3.png）和输出文件夹；返回按需创建 BatchJob 的函数"""
+    poster_path = str(tmp_path / "poster.png")
+    Image.new("RGB", (160, 200), (230, 120, 40)).save(poster_path)
+    qr_folder = tmp_path / "qr"
+    qr_folder.mkdir()
+    for seed in range(4):
+        write_qr(str(qr_folder / f"q{seed}.png"), seed)
+    output_folder = str(tmp_path / "out")
+
+    def make_job(**options):
+        options.setdefault("max_workers", 1)
+        return poster_engine.BatchJob(poster_path, str(qr_folder), output_folder, 30, 40, 90, 90, **options)
+
+    make_job.qr_folder = qr_folder
+    make_job.output_folder = output_folder
+    return make_job
+
+
+def output_state(folder):
+    """{输出文件名: (修改时间ns, 内容)}，不含清单和报告"""
+    state = {}
+    for name in sorted(os.listdir(folder)):
+        if not name.startswith("."):
+            path = os.path.join(folder, name)
+            with open(path, "rb") as f:
+                state[name] = (os.stat(path).st_mtime_ns, f.read())
+    return state
+
+
+def bump_mtime(path):
+    """把修改时间往后推，不依赖文件系统的时间精度"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000_000))
+
+
+def test_resume_skips_unchanged_inputs(batch):
+    first = poster_engine.run_batch(batch(resume=True))
+    assert first.success_count == 4 and first.skipped == 0
+    before = output_state(batch.output_folder)
+    assert sorted(before) == ["q0.png", "q1.png", "q2.png", "q3.png"]
+
+    again = poster_engine.run_batch(batch(resume=True))
+    assert again.success_count == 4 and again.skipped == 4
+    assert output_state(batch.output_folder) == before
+
+    # 输入被改写（大小或修改时间变化）后只重新合成这一个
+    write_qr(str(batch.qr_folder / "q2.png"), 9)
+    bump_mtime(str(batch.qr_folder / "q2.png"))
+    changed = poster_engine.run_batch(batch(resume=True))
+    assert changed.skipped == 3 and not changed.failed
+    after = output_state(batch.output_folder)
+    assert [name for name in after if after[name] != before[name]] == ["q2.png"]
+
+
+def test_resume_redoes_missing_or_truncated_outputs(batch):
+    poster_engine.run_batch(batch(resume=True))
+    os.remove(os.path.join(batch.output_folder, "q0.png"))
+    with open(os.path.join(batch.output_folder, "q1.png"), "r+b") as f:
+        f.truncate(10)
+
+    result = poster_engine.run_batch(batch(resume=True))
+    assert result.skipped == 2 and result.success_count == 4
+    with Image.open(os.path.join(batch.output_folder, "q1.png")) as image:
+        image.load()
+
+
+def test_incremental_rerenders_only_changed_content(batch):
+    poster_engine.run_batch(batch(incremental=True))
+    before = output_state(batch.output_folder)
+
+    # 只改修改时间、内容不变：按内容哈希判断，不重新合成
+    bump_mtime(str(batch.qr_folder / "q0.png"))
+    touched = poster_engine.run_batch(batch(incremental=True))
+    assert touched.skipped == 4
+    assert output_state(batch.output_folder) == before
+
+    write_qr(str(batch.qr_folder / "q3.png"), 7)
+    changed = poster_engine.run_batch(batch(incremental=True))
+    assert changed.skipped == 3 and changed.success_count == 4
+    after = output_state(batch.output_folder)
+    assert [name for name in after if after[name] != before[name]] == ["q3.png"]
+
+
+def test_incremental_removes_outputs_of_removed_inputs(batch):
+    poster_engine.run_batch(batch(incremental=True))
+    os.remove(str(batch.qr_folder / "q1.png"))
+
+    result = poster_engine.run_batch(batch(incremental=True))
+    assert result.removed == 1
+    assert sorted(output_state(batch.output_folder)) == ["q0.png", "q2.png", "q3.png"]
+
+
+def test_incremental_removes_orphaned_numbered_outputs(batch):
+    poster_engine.run_batch(batch(incremental=True, naming_pattern="p{number}"))
+    before = output_state(batch.output_folder)
+    assert sorted(before) == ["p1.png", "p2.png", "p3.png", "p4.png"]
+
+    # 删除 q1 后 q2、q3 的编号前移，原来的 p4 不再属于任何输入
+    os.remove(str(batch.qr_folder / "q1.png"))
+    result = poster_engine.run_batch(batch(incremental=True, naming_pattern="p{number}"))
+    after = output_state(batch.output_folder)
+    assert sorted(after) == ["p1.png", "p2.png", "p3.png"]
+    assert result.removed == 1
+    assert after["p1.png"] == before["p1.png"]
+    assert after["p2.png"][1] == before["p3.png"][1]
+    assert after["p3.png"][1] == before["p4.png"][1]
+
+    again = poster_engine.run_batch(batch(incremental=True, naming_pattern="p{number}"))
+    assert again.skipped == 3 and again.removed == 0
+
+
+def test_numbering_is_stable_when_inputs_are_added(batch):
+    poster_engine.run_batch(batch(incremental=True, naming_pattern="p{number}"))
+    before = output_state(batch.output_folder)
+
+    # 排在最后的新文件只增加一个编号，已有的输出都不变
+    write_qr(str(batch.qr_folder / "q9.png"), 9)
+    result = poster_engine.run_batch(batch(incremental=True, naming_pattern="p{number}"))
+    assert result.skipped == 4
+    after = output_state(batch.output_folder)
+    assert sorted(after) == ["p1.png", "p2.png", "p3.png", "p4.png", "p5.png"]
+    assert all(after[name] == before[name] for name in before)
+
+
+@pytest.mark.parametrize("hardlink", [False, True])
+def test_duplicate_inputs_are_rendered_once(batch, hardlink):
+    shutil.copyfile(str(batch.qr_folder / "q0.png"), str(batch.qr_folder / "q0_copy.png"))
+    result = poster_engine.run_batch(batch(hardlink_duplicates=hardlink))
+    assert result.success_count == 5 and result.deduplicated == 1
+
+    original = os.path.join(batch.output_folder, "q0.png")
+    duplicate = os.path.join(batch.output_folder, "q0_copy.png")
+    with open(original, "rb") as a, open(duplicate, "rb") as b:
+        assert a.read() == b.read()
+    assert os.path.samefile(original, duplicate) == hardlink
+
+    separate = poster_engine.run_batch(batch(deduplicate=False))
+    assert separate.deduplicated == 0 and separate.success_count == 5
+
+
+def test_rerendering_a_hardlinked_source_leaves_the_duplicate_intact(batch):
+    shutil.copyfile(str(batch.qr_folder / "q0.png"), str(batch.qr_folder / "q0_copy.png"))
+    poster_engine.run_batch(batch(incremental=True, hardlink_duplicates=True))
+    duplicate = os.path.join(batch.output_folder, "q0_copy.png")
+    with open(duplicate, "rb") as f:
+        duplicate_data = f.read()
+
+    # 源文件的输出通过临时文件替换，硬链接到它的副本不会被一起改写
+    write_qr(str(batch.qr_folder / "q0.png"), 8)
+    result = poster_engine.run_batch(batch(incremental=True, hardlink_duplicates=True))
+    assert result.skipped == 4 and not result.failed
+    with open(duplicate, "rb") as f:
+        assert f.read() == duplicate_data
+    with open(os.path.join(batch.output_folder, "q0.png"), "rb") as f:
+        assert f.read() != duplicate_data
+
+
+def test_resume_skips_duplicates_whose_outputs_are_done(batch):
+    shutil.copyfile(str(batch.qr_folder / "q0.png"), str(batch.qr_folder / "q0_copy.png"))
+    poster_engine.run_batch(batch(resume=True))
+    os.remove(os.path.join(batch.output_folder, "q0_copy.png"))
+
+    result = poster_engine.run_batch(batch(resume=True))
+    assert result.skipped == 4 and result.deduplicated == 1
+    assert os.path.exists(os.path.join(batch.output_folder, "q0_copy.png"))
+
+
+def test_manifest_ignores_broken_and_incomplete_lines(batch):
+    poster_engine.run_batch(batch(resume=True))
+    with open(os.path.join(batch.output_folder, poster_engine.JobManifest.FILENAME), "a", encoding="utf-8") as f:
+        f.write('{"type": "file"}\n[1, 2]\n{"type": "file", "input": "q0.pn')
+
+    result = poster_engine.run_batch(batch(resume=True))
+    assert result.skipped == 4 and not result.failed
+
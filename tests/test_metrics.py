@@ -0,0 +1,35 @@
+"""poster_metrics 的计时统计"""
+from poster_metrics import StageStats
+
+
+def stats_of(samples):
+    stats = StageStats()
+    for seconds in samples:
+        stats.add(seconds)
+    return stats
+
+
+def test_percentile_nearest_rank_takes_lower_value_at_ties():
+    assert stats_of([1, 2]).percentile(0.5) == 1
+    assert stats_of(range(1, 11)).percentile(0.5) == 5
+    assert stats_of(range(1, 11)).percentile(0.95) == 10
+    assert stats_of(range(1, 21)).percentile(0.95) == 19
+    assert stats_of(range(1, 101)).percentile(0.95) == 95
+
+
+def test_percentile_ignores_insertion_order_and_clamps():
+    stats = stats_of([3, 1, 2])
+    assert stats.percentile(0.5) == 2
+    assert stats.percentile(0.0) == 1
+    assert stats.percentile(1.0) == 3
+    assert stats_of([7]).percentile(0.95) == 7
+    assert StageStats().percentile(0.5) == 0.0
+
+
+def test_to_dict_reports_percentiles_and_histogram():
+    summary = stats_of([0.001, 0.002, 0.003, 0.004]).to_dict()
+    assert summary["count"] == 4
+    assert summary["p50"] == 0.002
+    assert summary["p95"] == 0.004
+    assert summary["max"] == 0.004
+    assert sum(bucket["count"] for bucket in summary["histogram"]) == 4